@@ -1,111 +1,125 @@
+# Первым: момент импорта - точка отсчета времени запуска
+from shared.readiness import readiness
 import os
 import asyncio
+import html
 import json
 import logging
+import time
 from datetime import datetime, timedelta
+from functools import partial
 import pathlib
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from dotenv import load_dotenv
+from telegram import ChatMember, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
     CommandHandler,
     CallbackQueryHandler,
+    ChatMemberHandler,
     ContextTypes,
     ApplicationBuilder,
     Defaults,
     MessageHandler,
     filters,
     ConversationHandler,
+    TypeHandler,
 )
 from telegram.error import TelegramError
-from database import Chat, Mailing, SendLog, db_session
-
-# Настройка логирования
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+from sqlalchemy import func, select
+from shared import metrics, tracing
+from shared.logging_setup import setup_logging, stop_logging
+from shared.database import (
+    Chat,
+    Mailing,
+    MailingMedia,
+    MailingRun,
+    Segment,
+    SendLog,
+    db_session,
+    ensure_schema,
+    mailing_recipients,
+)
+from telegram_api import TelegramAPI, TelegramAPIError, get_api_url
+from bot.delivery import (
+    ACTIVE_STATUSES,
+    AUTO_RETRY_CLASSES,
+    deliver_mailing,
+    due_retries,
+    latest_run,
+    pause_interrupted_runs,
+    pending_dead_letters,
+    run_stats,
+    set_run_status,
+)
+from bot.chat_registry import ChatRegistry
+from bot.health import start_health_server
+from bot.mailing_list import (
+    LIST_FILTERS,
+    fetch_page,
+    mailing_counts,
+    mailing_details,
+    mailing_views,
 )
+from bot.media import CAPTION_LIMIT, is_copy_source, media_from_message
+from bot.persistence import DatabasePersistence
+from bot.profiling import SamplingProfiler
+from bot.router import CallbackRouter
+from bot.updates import KeyedUpdateProcessor, TracedRequest
+
 logger = logging.getLogger(__name__)
 
-# Получаем абсолютный путь к текущей директории
-base_dir = pathlib.Path(__file__).parent.absolute()
-env_path = base_dir / ".env"
+# Переменные из .env рядом с ботом (или найденного python-dotenv) имеют
+# приоритет над окружением. Значения в лог не выводим - там токен.
+env_path = pathlib.Path(__file__).parent.absolute() / ".env"
+load_dotenv(env_path if env_path.exists() else None, override=True)
 
-# Очищаем кэшированные переменные окружения перед загрузкой
-keys_to_clear = ["ADMIN_IDS", "MINI_APP_URL", "TELEGRAM_BOT_TOKEN"]
-for key in keys_to_clear:
-    if key in os.environ:
-        print(f"Удаление кэшированной переменной: {key}")
-        del os.environ[key]
+# Логи пишутся фоновым потоком, формат и уровень - из LOG_FORMAT и LOG_LEVEL
+setup_logging()
 
-# Проверяем существование файла .env
-if env_path.exists():
-    print(f"Файл .env найден: {env_path}")
+# Список ID администраторов
+try:
+    ADMIN_IDS = [
+        int(id.strip())
+        for id in os.environ.get("ADMIN_IDS", "").split(",")
+        if id.strip()
+    ]
+except ValueError as e:
+    logger.error(f"Некорректное значение ADMIN_IDS: {e}")
+    ADMIN_IDS = []
+logger.info(f"Администраторов бота: {len(ADMIN_IDS)}")
 
-    # Читаем файл .env напрямую
-    try:
-        print("Чтение .env файла напрямую...")
-        with open(env_path, "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-
-                if "=" in line:
-                    key, value = line.split("=", 1)
-                    # Устанавливаем переменную окружения напрямую
-                    os.environ[key] = value
-                    print(f"Установлена переменная {key} = {value}")
-
-        print("Файл .env успешно загружен напрямую")
-    except Exception as e:
-        print(f"Ошибка при чтении .env файла напрямую: {e}")
+# URL вашего Mini App
+MINI_APP_URL = os.environ.get("MINI_APP_URL", "https://example.com/mini_app")
 
-        # Пробуем загрузить через python-dotenv как запасной вариант
-        try:
-            from dotenv import load_dotenv
+# Сколько обработчиков обновлений выполняется одновременно. Обновления
+# одного чата/пользователя все равно идут по очереди. Значение держим
+# ниже размера пула соединений к БД.
+UPDATE_WORKERS = int(os.environ.get("UPDATE_WORKERS", "8"))
 
-            load_dotenv(dotenv_path=env_path, override=True)
-            print("Файл .env загружен через python-dotenv с override=True")
-        except ImportError:
-            print("Модуль python-dotenv не установлен")
-        except Exception as e:
-            print(f"Ошибка при загрузке .env через python-dotenv: {e}")
-else:
-    print(f"Файл .env не найден по пути: {env_path}")
-    # Пробуем загрузить через python-dotenv как запасной вариант
-    try:
-        from dotenv import load_dotenv
+# Порт проверок /healthz, /ready и метрик /metrics (0 - не запускать)
+HEALTH_HOST = os.environ.get("HEALTH_HOST", "0.0.0.0")
+HEALTH_PORT = int(os.environ.get("HEALTH_PORT", "8080"))
 
-        load_dotenv(override=True)
-        print("Попытка загрузки .env через python-dotenv по умолчанию")
-    except Exception as e:
-        print(f"Ошибка при загрузке .env: {e}")
+# Длительность замера командой /profile по умолчанию и предел (секунды)
+PROFILE_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
 
-# Получаем список ID администраторов с логированием
-admin_ids_str = os.environ.get("ADMIN_IDS", "")
-print(f"Получено значение ADMIN_IDS из переменных окружения: '{admin_ids_str}'")
+# Файл трассировки (JSONL, по строке на спан); пусто - трассировка выключена
+TRACE_FILE = os.environ.get("TRACE_FILE")
 
-# Преобразуем строку с ID в список чисел
-try:
-    ADMIN_IDS = [int(id.strip()) for id in admin_ids_str.split(",") if id.strip()]
-    print(f"Обработанный список ADMIN_IDS: {ADMIN_IDS}")
-except Exception as e:
-    print(f"Ошибка при обработке ADMIN_IDS: {e}")
-    ADMIN_IDS = []
+# Запросов к Bot API одновременно (как у HTTP-клиента PTB по умолчанию)
+API_POOL_SIZE = 256
 
-# URL вашего Mini App
-MINI_APP_URL = os.environ.get("MINI_APP_URL", "https://example.com/mini_app")
-print(f"Получено значение MINI_APP_URL: '{MINI_APP_URL}'")
+UPDATE_QUEUE_DEPTH = metrics.Gauge(
+    "bot_update_queue_depth", "Полученные обновления, ожидающие обработки"
+)
 
 # Состояния диалога создания рассылки
 ENTER_MESSAGE, ENTER_SCHEDULE, SELECT_RECIPIENTS = range(3)
 
-# Состояния пагинации
-PAGE_SIZE = 5
-
 
 async def is_admin(user_id: int) -> bool:
     """Проверка, является ли пользователь администратором бота"""
-    print(f"Проверка admin для ID {user_id}. Список админов: {ADMIN_IDS}")
     return user_id in ADMIN_IDS
 
 
@@ -148,10 +162,56 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "Команды бота:\n"
         "/create - создать новую рассылку\n"
         "/list - список рассылок\n"
-        "/stats - общая статистика"
+        "/stats - общая статистика\n"
+        f"/profile N - профиль работы бота за N секунд (по умолчанию {PROFILE_SECONDS})"
     )
 
 
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /profile N: сэмплирование процесса N секунд, отчет - документом"""
+    if not await is_admin(update.effective_user.id):
+        await update.message.reply_text("У вас нет доступа к этой команде.")
+        return
+
+    try:
+        seconds = int(context.args[0]) if context.args else PROFILE_SECONDS
+    except ValueError:
+        await update.message.reply_text("Использование: /profile <секунды>")
+        return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+
+    if context.bot_data.get("profiling"):
+        await update.message.reply_text("Профилирование уже выполняется.")
+        return
+    context.bot_data["profiling"] = True
+
+    await update.message.reply_text(f"Профилирование процесса {seconds} с...")
+    # Замер идет в фоне: следующие команды админа не ждут его окончания
+    context.application.create_task(send_profile(update.message, context, seconds))
+
+
+async def send_profile(message, context, seconds: int) -> None:
+    """Замер и отправка отчета и свернутых стеков (для flame graph)"""
+    try:
+        with SamplingProfiler() as profiler:
+            await asyncio.sleep(seconds)
+        name = f"profile-{datetime.now():%Y%m%d-%H%M%S}"
+        await message.reply_document(
+            profiler.report().encode(),
+            filename=f"{name}.txt",
+            caption=f"Самые загруженные функции за {seconds} с",
+        )
+        await message.reply_document(
+            profiler.collapsed().encode(),
+            filename=f"{name}.folded",
+            caption="Свернутые стеки для flamegraph.pl или speedscope",
+        )
+    except TelegramError as e:
+        logger.error(f"Не удалось отправить профиль: {e}")
+    finally:
+        context.bot_data.pop("profiling", None)
+
+
 # СОЗДАНИЕ РАССЫЛКИ - НОВЫЙ ИНТЕРАКТИВНЫЙ ФОРМАТ
 async def start_create_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
@@ -163,6 +223,7 @@ async def start_create_handler(
     # Инициализируем данные новой рассылки
     context.user_data["temp_mailing"] = {
         "message_text": None,
+        "media": [],
         "schedule_type": None,
         "next_run_time": None,
         "is_recurring": False,
@@ -175,7 +236,9 @@ async def start_create_handler(
     ]
 
     await query.edit_message_text(
-        "Создание новой рассылки\n\n" "Шаг 1/3: Введите текст сообщения для рассылки:",
+        "Создание новой рассылки\n\n"
+        "Шаг 1/3: Введите текст сообщения для рассылки "
+        "или отправьте фото, видео, документ или альбом с подписью:",
         reply_markup=InlineKeyboardMarkup(keyboard),
     )
 
@@ -194,6 +257,7 @@ async def create(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     # Инициализируем данные новой рассылки
     context.user_data["temp_mailing"] = {
         "message_text": None,
+        "media": [],
         "schedule_type": None,
         "next_run_time": None,
         "is_recurring": False,
@@ -206,7 +270,9 @@ async def create(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     ]
 
     await update.message.reply_text(
-        "Создание новой рассылки\n\n" "Шаг 1/3: Введите текст сообщения для рассылки:",
+        "Создание новой рассылки\n\n"
+        "Шаг 1/3: Введите текст сообщения для рассылки "
+        "или отправьте фото, видео, документ или альбом с подписью:",
         reply_markup=InlineKeyboardMarkup(keyboard),
     )
 
@@ -243,11 +309,41 @@ async def enter_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         # Это уже должно быть обработано через cancel_create_handler
         return ENTER_MESSAGE
 
-    # Получаем текст сообщения
-    message_text = update.message.text
+    # Получаем текст сообщения (для медиа - подпись)
+    message = update.message
+    media = media_from_message(message)
+    message_text = message.caption if media else message.text
+    temp_mailing = context.user_data["temp_mailing"]
+
+    if is_copy_source(message):
+        # Рассылаем копию сообщения из чата с ботом со всем форматированием
+        temp_mailing["source_chat_id"] = message.chat_id
+        temp_mailing["source_message_id"] = message.message_id
+        temp_mailing["media"] = []
+        message_text = message.text or message.caption
+
+    elif media:
+        temp_mailing.pop("source_message_id", None)
+        media_group_id = update.message.media_group_id
+        if media_group_id and media_group_id == temp_mailing.get("media_group_id"):
+            # Очередной элемент уже принятого альбома
+            temp_mailing["media"].append(media)
+            if message_text and not temp_mailing["message_text"]:
+                temp_mailing["message_text"] = message_text
+            return ENTER_SCHEDULE
+
+        if message_text and len(message_text) > CAPTION_LIMIT:
+            await update.message.reply_text(
+                f"Подпись к медиа длиннее {CAPTION_LIMIT} символов. "
+                "Сократите подпись и отправьте файл снова:"
+            )
+            return ENTER_MESSAGE
+
+        temp_mailing["media"] = [media]
+        temp_mailing["media_group_id"] = media_group_id
 
     # Проверяем, не является ли сообщение командой
-    if message_text.startswith("/"):
+    elif message_text.startswith("/"):
         # Это команда, прерываем процесс создания
         await update.message.reply_text(
             "Процесс создания рассылки прерван командой. "
@@ -262,8 +358,11 @@ async def enter_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 
         return ConversationHandler.END
 
+    else:
+        temp_mailing.pop("source_message_id", None)
+
     # Сохраняем введенный текст
-    context.user_data["temp_mailing"]["message_text"] = message_text
+    temp_mailing["message_text"] = message_text
 
     # Переходим к выбору расписания с кнопками
     keyboard = [
@@ -435,10 +534,16 @@ async def finish_create(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
             next_run_time=temp_mailing.get("next_run_time"),
             is_recurring=temp_mailing.get("is_recurring", False),
             recurrence_interval=temp_mailing.get("recurrence_interval"),
+            source_chat_id=temp_mailing.get("source_chat_id"),
+            source_message_id=temp_mailing.get("source_message_id"),
+            segment_id=temp_mailing.get("segment_id"),
         )
+        for position, item in enumerate(temp_mailing.get("media", [])):
+            mailing.media.append(MailingMedia(position=position, **item))
         session.add(mailing)
         session.commit()
         mailing_id = mailing.mailing_id
+        mailing_counts.invalidate()
 
         # Теперь добавляем получателей (если они уже были выбраны)
         selected_chats = temp_mailing.get("selected_chats", [])
@@ -492,43 +597,54 @@ async def list_mailings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             await update.callback_query.answer("У вас нет доступа к этой команде.")
         return
 
-    # Устанавливаем начальную страницу
-    context.user_data["page"] = 0
-
-    # Показываем список рассылок
+    # Показываем первую страницу списка
     # Если вызов из callback_query, предаем edit=True
     await show_mailings_page(update, context, edit=bool(update.callback_query))
 
 
+def mailing_list_buttons(filter_name: str) -> list:
+    """Кнопки фильтров списка рассылок, текущий фильтр отмечен"""
+    buttons = [
+        InlineKeyboardButton(
+            f"• {title}" if name == filter_name else title,
+            callback_data=f"page:{name}",
+        )
+        for name, title in LIST_FILTERS.items()
+    ]
+    return [buttons[:2], buttons[2:]]
+
+
 async def show_mailings_page(
-    update: Update, context: ContextTypes.DEFAULT_TYPE, edit=False
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    edit=False,
+    filter_name: str = "all",
+    direction: str = None,
+    cursor: int = None,
 ) -> None:
-    """Отображение страницы списка рассылок"""
-    page = context.user_data.get("page", 0)
+    """Отображение страницы списка рассылок
 
-    with db_session() as session:
-        # Получаем общее количество рассылок для пагинации
-        total_mailings = session.query(Mailing).count()
+    Страницы листаются по ключу mailing_id: курсор (первый или последний ID
+    текущей страницы) передается в callback_data кнопок навигации.
+    """
+    user_id = update.effective_user.id
 
-        # Получаем рассылки для текущей страницы
-        mailings = (
-            session.query(Mailing)
-            .order_by(Mailing.mailing_id.desc())
-            .offset(page * PAGE_SIZE)
-            .limit(PAGE_SIZE)
-            .all()
+    with db_session() as session:
+        mailings, has_newer, has_older = fetch_page(
+            session, filter_name, user_id, direction, cursor
         )
+        if not mailings and cursor is not None:
+            # Рассылки курсора удалены - показываем первую страницу
+            mailings, has_newer, has_older = fetch_page(session, filter_name, user_id)
 
-        if not mailings and total_mailings > 0:
-            # Если страница пуста, но есть другие рассылки, возвращаемся на предыдущую страницу
-            context.user_data["page"] = max(0, page - 1)
-            await show_mailings_page(update, context, edit)
-            return
+        # Общее количество - из кэша, без COUNT на каждое листание
+        total_mailings = mailing_counts.get(session, filter_name, user_id)
 
         # Формируем текст списка
-        if total_mailings == 0:
+        if not mailings:
             list_text = "Рассылки не найдены."
-            keyboard = [
+            keyboard = mailing_list_buttons(filter_name) if filter_name != "all" else []
+            keyboard += [
                 [
                     InlineKeyboardButton(
                         "📝 Создать рассылку", callback_data="start_create"
@@ -537,7 +653,7 @@ async def show_mailings_page(
                 [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")],
             ]
         else:
-            list_text = f"Список рассылок (страница {page + 1}/{(total_mailings + PAGE_SIZE - 1) // PAGE_SIZE}):\n\n"
+            list_text = f"Список рассылок ({LIST_FILTERS[filter_name]}, всего {total_mailings}):\n\n"
 
             # Создаем кнопки для каждой рассылки
             keyboard = []
@@ -565,19 +681,27 @@ async def show_mailings_page(
             # Добавляем кнопки пагинации
             pagination_buttons = []
 
-            if page > 0:
+            if has_newer:
                 pagination_buttons.append(
-                    InlineKeyboardButton("⬅️ Назад", callback_data="page:prev")
+                    InlineKeyboardButton(
+                        "⬅️ Назад",
+                        callback_data=f"page:{filter_name}:prev:{mailings[0].mailing_id}",
+                    )
                 )
 
-            if (page + 1) * PAGE_SIZE < total_mailings:
+            if has_older:
                 pagination_buttons.append(
-                    InlineKeyboardButton("Вперед ➡️", callback_data="page:next")
+                    InlineKeyboardButton(
+                        "Вперед ➡️",
+                        callback_data=f"page:{filter_name}:next:{mailings[-1].mailing_id}",
+                    )
                 )
 
             if pagination_buttons:
                 keyboard.append(pagination_buttons)
 
+            keyboard += mailing_list_buttons(filter_name)
+
             # Добавляем кнопки для создания и возврата в главное меню
             keyboard.append(
                 [
@@ -610,144 +734,177 @@ async def show_mailings_page(
         await update.message.reply_text(text=list_text, reply_markup=markup)
 
 
-async def show_mailing_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Отображение меню рассылки с детальной информацией и кнопками"""
-    try:
-        if hasattr(update, "callback_query") and update.callback_query:
-            query = update.callback_query
-            await query.answer()
-            data = query.data
-            mailing_id = int(data.split(":")[1])
-        elif update.message:
-            data = update.message.text
-            # Пытаемся извлечь ID из разных форматов сообщений
-            try:
-                mailing_id = int(data.split(":")[1])
-            except (ValueError, IndexError):
-                # Если ID не найден в типичном формате, пробуем достать из user_data
-                mailing_id = context.user_data.get("last_mailing_id")
-                if not mailing_id:
-                    await update.message.reply_text(
-                        "Не удалось определить ID рассылки."
-                    )
-                    return
+def render_mailing_menu(details) -> tuple:
+    """Текст и клавиатура меню рассылки по результату mailing_details"""
+    mailing = details.Mailing
+    mailing_id = mailing.mailing_id
+
+    # Основная информация
+    text = f"📨 <b>Меню рассылки ID {mailing_id}</b>\n\n"
+    message_text = mailing.message_text or ""
+    text += f"📝 <b>Текст:</b> {message_text[:100]}{'...' if len(message_text) > 100 else ''}\n"
+    if mailing.source_message_id:
+        text += "📋 <b>Формат:</b> копия сообщения со всем оформлением\n"
+    elif details.media_count:
+        media_names = {
+            "photo": "фото",
+            "video": "видео",
+            "document": "документ",
+        }
+        if details.media_count > 1:
+            text += f"🖼 <b>Медиа:</b> альбом ({details.media_count} файлов)\n"
         else:
-            return
-
-        with db_session() as session:
-            mailing = session.query(Mailing).filter_by(mailing_id=mailing_id).first()
-
-            if not mailing:
-                if hasattr(update, "callback_query") and update.callback_query:
-                    await update.callback_query.edit_message_text(
-                        "Рассылка не найдена."
-                    )
+            text += f"🖼 <b>Медиа:</b> {media_names.get(details.media_type, details.media_type)}\n"
+
+    if mailing.next_run_time:
+        schedule = mailing.next_run_time.strftime("%Y-%m-%d %H:%M")
+        if mailing.is_recurring:
+            if mailing.recurrence_interval == "daily":
+                text += f"🕒 <b>Расписание:</b> Ежедневно в {mailing.next_run_time.strftime('%H:%M')}\n"
+            elif mailing.recurrence_interval == "weekly":
+                # Получаем дни недели
+                if mailing.recurrence_days:
+                    days_list = mailing.recurrence_days.split(",")
+                    weekdays = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+                    selected_days = [
+                        weekdays[int(d)]
+                        for d in days_list
+                        if d.isdigit() and 0 <= int(d) < 7
+                    ]
+                    days_str = ", ".join(selected_days)
+                    text += f"🕒 <b>Расписание:</b> Еженедельно ({days_str}) в {mailing.next_run_time.strftime('%H:%M')}\n"
                 else:
-                    await update.message.reply_text("Рассылка не найдена.")
-                return
+                    text += f"🕒 <b>Расписание:</b> Еженедельно в {mailing.next_run_time.strftime('%H:%M')}\n"
+        else:
+            text += f"🕒 <b>Запланировано на:</b> {schedule}\n"
+    else:
+        text += "🕒 <b>Расписание:</b> не задано\n"
 
-            # Основная информация
-            text = f"📨 <b>Меню рассылки ID {mailing_id}</b>\n\n"
-            text += f"📝 <b>Текст:</b> {mailing.message_text[:100]}{'...' if len(mailing.message_text) > 100 else ''}\n"
-
-            if mailing.next_run_time:
-                schedule = mailing.next_run_time.strftime("%Y-%m-%d %H:%M")
-                if mailing.is_recurring:
-                    if mailing.recurrence_interval == "daily":
-                        text += f"🕒 <b>Расписание:</b> Ежедневно в {mailing.next_run_time.strftime('%H:%M')}\n"
-                    elif mailing.recurrence_interval == "weekly":
-                        # Получаем дни недели
-                        if mailing.recurrence_days:
-                            days_list = mailing.recurrence_days.split(",")
-                            weekdays = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
-                            selected_days = [
-                                weekdays[int(d)]
-                                for d in days_list
-                                if d.isdigit() and 0 <= int(d) < 7
-                            ]
-                            days_str = ", ".join(selected_days)
-                            text += f"🕒 <b>Расписание:</b> Еженедельно ({days_str}) в {mailing.next_run_time.strftime('%H:%M')}\n"
-                        else:
-                            text += f"🕒 <b>Расписание:</b> Еженедельно в {mailing.next_run_time.strftime('%H:%M')}\n"
-                else:
-                    text += f"🕒 <b>Запланировано на:</b> {schedule}\n"
-            else:
-                text += "🕒 <b>Расписание:</b> не задано\n"
+    # Статистика по получателям
+    total_recipients = details.users + details.groups
+    if details.segment_name:
+        text += f"🎯 <b>Сегмент:</b> {html.escape(details.segment_name)}\n"
+    text += f"👥 <b>Получателей:</b> {total_recipients} (👤 {details.users} / 👥 {details.groups})\n\n"
+
+    # Статистика отправки
+    text += "📊 <b>Статистика отправки:</b>\n"
+    text += f"✅ Успешно: {details.successful}\n"
+    text += f"❌ Ошибок: {details.failed}\n"
 
-            # Статистика по получателям - используем правильные запросы ORM
-            user_recipients = 0
-            group_recipients = 0
+    if total_recipients > 0:
+        rate = (details.successful / total_recipients) * 100
+        text += f"📈 Успешность: {rate:.1f}%\n"
 
-            # Получаем все чаты, связанные с этой рассылкой
-            for chat in mailing.recipients:
-                if chat.type == "private":
-                    user_recipients += 1
-                elif chat.type in ["group", "supergroup", "channel"]:
-                    group_recipients += 1
+    # Получатели последнего запуска с временными ошибками
+    retry_count = details.retry_count if details.run_status == "finished" else 0
+    if retry_count:
+        text += f"🔁 Ожидают повтора: {retry_count}\n"
 
-            total_recipients = user_recipients + group_recipients
+    # Кнопки управления
+    keyboard = []
 
-            text += f"👥 <b>Получателей:</b> {total_recipients} (👤 {user_recipients} / 👥 {group_recipients})\n\n"
+    if total_recipients > 0 and (
+        mailing.message_text or details.media_count or mailing.source_message_id
+    ):
+        keyboard.append(
+            [
+                InlineKeyboardButton(
+                    "📤 Отправить сейчас", callback_data=f"send:{mailing_id}"
+                )
+            ]
+        )
+    if retry_count:
+        keyboard.append(
+            [
+                InlineKeyboardButton(
+                    "🔁 Повторить неудачные",
+                    callback_data=f"retry_failed:{details.run_id}",
+                )
+            ]
+        )
 
-            # Статистика отправки
-            logs = session.query(SendLog).filter_by(mailing_id=mailing_id).all()
-            successful = sum(1 for log in logs if log.status == "success")
-            failed = sum(1 for log in logs if log.status == "failed")
+    keyboard.append(
+        [
+            InlineKeyboardButton(
+                "✏️ Ред. текст", callback_data=f"edit_message:{mailing_id}"
+            ),
+            InlineKeyboardButton(
+                "🕒 Ред. расписание",
+                callback_data=f"edit_schedule:{mailing_id}",
+            ),
+        ]
+    )
+    keyboard.append(
+        [
+            InlineKeyboardButton(
+                "👥 Получатели",
+                web_app={"url": f"{MINI_APP_URL}?mailing_id={mailing_id}"},
+            )
+        ]
+    )
+    keyboard.append(
+        [InlineKeyboardButton("⬅️ Назад к списку", callback_data="back_to_list")]
+    )
 
-            text += "📊 <b>Статистика отправки:</b>\n"
-            text += f"✅ Успешно: {successful}\n"
-            text += f"❌ Ошибок: {failed}\n"
+    return text, InlineKeyboardMarkup(keyboard)
 
-            if total_recipients > 0:
-                rate = (successful / total_recipients) * 100
-                text += f"📈 Успешность: {rate:.1f}%\n"
 
-            # Кнопки управления
-            keyboard = []
+async def show_mailing_menu(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, mailing_id: int = None
+) -> None:
+    """Отображение меню рассылки с детальной информацией и кнопками
 
-            if total_recipients > 0 and mailing.message_text:
-                keyboard.append(
-                    [
-                        InlineKeyboardButton(
-                            "📤 Отправить сейчас", callback_data=f"send:{mailing_id}"
+    Текст и кнопки меню кэшируются (mailing_views) до изменения рассылки
+    или ее отправки, поэтому повторные открытия не обращаются к БД.
+    """
+    try:
+        if hasattr(update, "callback_query") and update.callback_query:
+            await update.callback_query.answer()
+            if mailing_id is None:
+                mailing_id = int(context.args[0])
+        elif update.message:
+            if mailing_id is None:
+                data = update.message.text
+                # Пытаемся извлечь ID из разных форматов сообщений
+                try:
+                    mailing_id = int(data.split(":")[1])
+                except (ValueError, IndexError):
+                    # Если ID не найден в типичном формате, пробуем достать из user_data
+                    mailing_id = context.user_data.get("last_mailing_id")
+                    if not mailing_id:
+                        await update.message.reply_text(
+                            "Не удалось определить ID рассылки."
                         )
-                    ]
-                )
-
-            keyboard.append(
-                [
-                    InlineKeyboardButton(
-                        "✏️ Ред. текст", callback_data=f"edit_message:{mailing_id}"
-                    ),
-                    InlineKeyboardButton(
-                        "🕒 Ред. расписание",
-                        callback_data=f"edit_schedule:{mailing_id}",
-                    ),
-                ]
-            )
-            keyboard.append(
-                [
-                    InlineKeyboardButton(
-                        "👥 Получатели",
-                        web_app={"url": f"{MINI_APP_URL}?mailing_id={mailing_id}"},
-                    )
-                ]
-            )
-            keyboard.append(
-                [InlineKeyboardButton("⬅️ Назад к списку", callback_data="back_to_list")]
-            )
+                        return
+        else:
+            return
 
-            markup = InlineKeyboardMarkup(keyboard)
+        view = mailing_views.get(mailing_id)
+        if view is None:
+            with db_session() as session:
+                details = mailing_details(session, mailing_id)
+                if details:
+                    view = render_mailing_menu(details)
+                    mailing_views.put(mailing_id, view)
 
-            # Отправка/редактирование сообщения
+        if view is None:
             if hasattr(update, "callback_query") and update.callback_query:
-                await update.callback_query.edit_message_text(
-                    text=text, reply_markup=markup, parse_mode="HTML"
-                )
+                await update.callback_query.edit_message_text("Рассылка не найдена.")
             else:
-                await update.message.reply_text(
-                    text=text, reply_markup=markup, parse_mode="HTML"
-                )
+                await update.message.reply_text("Рассылка не найдена.")
+            return
+
+        text, markup = view
+
+        # Отправка/редактирование сообщения
+        if hasattr(update, "callback_query") and update.callback_query:
+            await update.callback_query.edit_message_text(
+                text=text, reply_markup=markup, parse_mode="HTML"
+            )
+        else:
+            await update.message.reply_text(
+                text=text, reply_markup=markup, parse_mode="HTML"
+            )
 
     except Exception as e:
         logger.error(f"Ошибка в show_mailing_menu: {e}")
@@ -787,14 +944,21 @@ async def handle_pagination(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
 
-    action = query.data.split(":")[1]
-
-    if action == "prev":
-        context.user_data["page"] = max(0, context.user_data.get("page", 0) - 1)
-    elif action == "next":
-        context.user_data["page"] = context.user_data.get("page", 0) + 1
-
-    await show_mailings_page(update, context, edit=True)
+    # page:<фильтр>[:<prev|next>:<ID курсора>]
+    args = context.args
+    filter_name = args[0] if args and args[0] in LIST_FILTERS else "all"
+    direction, cursor = None, None
+    if len(args) == 3 and args[1] in ("prev", "next") and args[2].isdigit():
+        direction, cursor = args[1], int(args[2])
+
+    await show_mailings_page(
+        update,
+        context,
+        edit=True,
+        filter_name=filter_name,
+        direction=direction,
+        cursor=cursor,
+    )
 
 
 async def finish_create_handler(
@@ -859,7 +1023,7 @@ async def send_mailing_now(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     await query.answer()
 
     try:
-        mailing_id = int(query.data.split(":")[1])
+        mailing_id = int(context.args[0])
 
         with db_session() as session:
             mailing = session.query(Mailing).filter_by(mailing_id=mailing_id).first()
@@ -868,7 +1032,7 @@ async def send_mailing_now(update: Update, context: ContextTypes.DEFAULT_TYPE) -
                 await query.edit_message_text("Ошибка: рассылка не найдена.")
                 return
 
-            if not mailing.message_text:
+            if not (mailing.message_text or mailing.media or mailing.source_message_id):
                 await query.edit_message_text(
                     "Для рассылки не установлен текст сообщения.",
                     reply_markup=InlineKeyboardMarkup(
@@ -884,12 +1048,22 @@ async def send_mailing_now(update: Update, context: ContextTypes.DEFAULT_TYPE) -
                 )
                 return
 
-            recipients = [
-                (chat.chat_id, chat.title or str(chat.chat_id))
-                for chat in mailing.recipients
-            ]
+            # Число получателей без загрузки самих чатов
+            if mailing.segment_id:
+                segment = session.get(Segment, mailing.segment_id)
+                recipient_count = segment.users + segment.groups if segment else 0
+            else:
+                recipient_count = session.execute(
+                    select(func.count()).where(
+                        mailing_recipients.c.mailing_id == mailing_id
+                    )
+                ).scalar_one()
 
-            if not recipients:
+            # Рассылка уже идет или стоит на паузе - показываем ее статус
+            run = latest_run(session, mailing_id)
+            active = run_stats(run) if run and run.status in ACTIVE_STATUSES else None
+
+            if not recipient_count:
                 await query.edit_message_text(
                     "Для рассылки не выбраны получатели.",
                     reply_markup=InlineKeyboardMarkup(
@@ -905,10 +1079,17 @@ async def send_mailing_now(update: Update, context: ContextTypes.DEFAULT_TYPE) -
                 )
                 return
 
+        if active:
+            await query.edit_message_text(
+                text=run_status_text(mailing_id, active),
+                reply_markup=run_status_markup(mailing_id, active),
+            )
+            return
+
         # Отправляем сообщение о начале рассылки
         status_text = (
             f"Начинаю отправку рассылки ID {mailing_id}...\n"
-            f"Всего получателей: {len(recipients)}\n"
+            f"Всего получателей: {recipient_count}\n"
             f"Отправлено: 0\n"
             f"Ошибок: 0\n"
             f"Прогресс: 0%"
@@ -930,7 +1111,7 @@ async def send_mailing_now(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
         # Запускаем отправку в фоновом режиме
         context.application.create_task(
-            perform_mailing(context.bot, mailing_id, status_msg)
+            perform_mailing(context.application, mailing_id, status_msg)
         )
 
     except Exception as e:
@@ -955,7 +1136,7 @@ async def refresh_status(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await query.answer()
 
     try:
-        mailing_id = int(query.data.split(":")[1])
+        mailing_id = int(context.args[0])
 
         with db_session() as session:
             mailing = session.query(Mailing).filter_by(mailing_id=mailing_id).first()
@@ -964,52 +1145,29 @@ async def refresh_status(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 await query.edit_message_text("Ошибка: рассылка не найдена.")
                 return
 
-            # Получаем статистику отправки
-            total_recipients = len(mailing.recipients)
-
-            logs = session.query(SendLog).filter_by(mailing_id=mailing_id).all()
-            successful = sum(1 for log in logs if log.status == "success")
-            failed = sum(1 for log in logs if log.status == "failed")
-
-            progress = (
-                ((successful + failed) / total_recipients * 100)
-                if total_recipients > 0
-                else 0
-            )
+            run = latest_run(session, mailing_id)
+            stats = run_stats(run) if run else None
 
-            status_text = (
-                f"Отправка рассылки ID {mailing_id}...\n"
-                f"Всего получателей: {total_recipients}\n"
-                f"Отправлено: {successful}\n"
-                f"Ошибок: {failed}\n"
-                f"Прогресс: {progress:.1f}%"
-            )
-
-            # Определяем кнопки в зависимости от прогресса
-            keyboard = []
-            if successful + failed < total_recipients:
-                # Рассылка еще не завершена
-                keyboard.append(
-                    [
-                        InlineKeyboardButton(
-                            "🔄 Обновить статус",
-                            callback_data=f"refresh_status:{mailing_id}",
-                        )
-                    ]
-                )
-            else:
-                # Рассылка завершена
-                keyboard.append(
+        if not stats:
+            await query.edit_message_text(
+                f"Рассылка ID {mailing_id} еще не запускалась.",
+                reply_markup=InlineKeyboardMarkup(
                     [
-                        InlineKeyboardButton(
-                            "⬅️ К меню рассылки", callback_data=f"mailing:{mailing_id}"
-                        )
+                        [
+                            InlineKeyboardButton(
+                                "⬅️ К меню рассылки",
+                                callback_data=f"mailing:{mailing_id}",
+                            )
+                        ]
                     ]
-                )
-
-            await query.edit_message_text(
-                text=status_text, reply_markup=InlineKeyboardMarkup(keyboard)
+                ),
             )
+            return
+
+        await query.edit_message_text(
+            text=run_status_text(mailing_id, stats),
+            reply_markup=run_status_markup(mailing_id, stats),
+        )
 
     except Exception as e:
         logger.error(f"Ошибка при обновлении статуса: {e}")
@@ -1027,6 +1185,49 @@ async def refresh_status(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
 
 
+async def control_run(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, action: str
+) -> None:
+    """Пауза, продолжение и отмена запущенной рассылки
+
+    action - действие кнопки: run_pause, run_resume или run_cancel.
+    """
+    query = update.callback_query
+    run_id = int(context.args[0])
+
+    if action == "run_pause":
+        changed = set_run_status(run_id, "paused", allowed=("running",))
+        note = "Рассылка остановится после текущего пакета сообщений"
+    elif action == "run_resume":
+        changed = set_run_status(run_id, "running", allowed=("paused",))
+        note = "Рассылка продолжается"
+    else:
+        changed = set_run_status(run_id, "cancelled")
+        note = "Рассылка отменена"
+    await query.answer(note if changed else "Статус рассылки уже изменился")
+
+    with db_session() as session:
+        run = session.get(MailingRun, run_id)
+        if not run:
+            return
+        mailing_id, stats = run.mailing_id, run_stats(run)
+
+    active = context.application.bot_data.setdefault("active_mailings", set())
+    if action == "run_resume" and changed and mailing_id not in active:
+        # Движок уже остановился - запускаем его заново с точки возобновления
+        context.application.create_task(
+            perform_mailing(context.application, mailing_id, query.message, run_id)
+        )
+
+    try:
+        await query.edit_message_text(
+            text=run_status_text(mailing_id, stats),
+            reply_markup=run_status_markup(mailing_id, stats),
+        )
+    except TelegramError as e:
+        logger.debug(f"Не удалось обновить статус рассылки {mailing_id}: {e}")
+
+
 async def handle_webapp_data(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
@@ -1367,52 +1568,197 @@ async def handle_weekday_toggle(
     return ENTER_SCHEDULE
 
 
-def get_active_chats(session, send_to_users=True, send_to_groups=True):
-    """Получить список всех активных чатов с фильтрацией по типу"""
-    query = session.query(Chat).filter(Chat.status == "active")
+async def retry_failed(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Повторный запуск по получателям с временными ошибками"""
+    query = update.callback_query
+    await query.answer()
+    run_id = int(context.args[0])
 
-    if send_to_users and not send_to_groups:
-        # Только пользователи
-        query = query.filter(Chat.type == "private")
-    elif send_to_groups and not send_to_users:
-        # Только группы и каналы
-        query = query.filter(Chat.type.in_(["group", "supergroup", "channel"]))
-    # Если оба True - получаем все чаты
-    # Если оба False - пустой список
-    elif not send_to_users and not send_to_groups:
-        return []
+    with db_session() as session:
+        run = session.get(MailingRun, run_id)
+        if not run:
+            await query.edit_message_text("Ошибка: запуск рассылки не найден.")
+            return
+        mailing_id = run.mailing_id
+        count = pending_dead_letters(session, run_id)
+
+    active = context.application.bot_data.setdefault("active_mailings", set())
+    if not count or mailing_id in active:
+        await query.edit_message_text(
+            "Нет получателей для повтора или рассылка уже выполняется.",
+            reply_markup=InlineKeyboardMarkup(
+                [
+                    [
+                        InlineKeyboardButton(
+                            "⬅️ К меню рассылки", callback_data=f"mailing:{mailing_id}"
+                        )
+                    ]
+                ]
+            ),
+        )
+        return
 
-    return query.all()
+    status_msg = await query.edit_message_text(
+        f"Повтор рассылки ID {mailing_id} для неудачных получателей: {count}...",
+        reply_markup=InlineKeyboardMarkup(
+            [
+                [
+                    InlineKeyboardButton(
+                        "🔄 Обновить статус",
+                        callback_data=f"refresh_status:{mailing_id}",
+                    )
+                ]
+            ]
+        ),
+    )
+    context.application.create_task(
+        perform_mailing(context.application, mailing_id, status_msg, retry_of=run_id)
+    )
 
 
-async def perform_mailing(bot, mailing_id, status_msg=None):
-    """Выполнение рассылки"""
-    sent = 0
-    failed = 0
+# Минимальный интервал между обновлениями сообщения о статусе (секунды)
+STATUS_UPDATE_INTERVAL = 3
+
+RUN_STATUS_TITLES = {
+    "running": "Отправка рассылки",
+    "paused": "⏸ Пауза в рассылке",
+    "cancelled": "⛔ Отменена рассылка",
+    "finished": "✅ Завершена отправка рассылки",
+}
+
+
+def run_status_text(mailing_id: int, stats: dict) -> str:
+    """Текст сообщения о ходе запуска рассылки"""
+    done = stats["sent"] + stats["failed"]
+    total = stats["total"]
+    percent = done / total * 100 if total else 100
+    title = RUN_STATUS_TITLES.get(stats["status"], "Отправка рассылки")
+    text = (
+        f"{title} ID {mailing_id}...\n"
+        f"Всего получателей: {total}\n"
+        f"Отправлено: {stats['sent']}\n"
+        f"Ошибок: {stats['failed']}\n"
+        f"Прогресс: {percent:.1f}%"
+    )
 
-    with db_session() as session:
-        mailing = session.query(Mailing).filter_by(mailing_id=mailing_id).first()
+    # Оценка оставшегося времени по средней скорости запуска
+    started_at = stats.get("started_at")
+    if stats["status"] == "running" and started_at and 0 < done < total:
+        elapsed = (datetime.now() - started_at).total_seconds()
+        eta = elapsed / done * (total - done)
+        text += f"\nОсталось примерно: {max(1, round(eta / 60))} мин"
+    return text
+
+
+def run_status_buttons(mailing_id: int, stats: dict) -> list:
+    """Кнопки управления запуском: ряды пар (текст, callback_data)"""
+    run_id = stats["run_id"]
+    if stats["status"] == "running":
+        return [
+            [("🔄 Обновить статус", f"refresh_status:{mailing_id}")],
+            [
+                ("⏸ Пауза", f"run_pause:{run_id}"),
+                ("⛔ Отменить", f"run_cancel:{run_id}"),
+            ],
+        ]
+    if stats["status"] == "paused":
+        return [
+            [
+                ("▶️ Продолжить", f"run_resume:{run_id}"),
+                ("⛔ Отменить", f"run_cancel:{run_id}"),
+            ],
+            [("⬅️ К меню рассылки", f"mailing:{mailing_id}")],
+        ]
+    return [[("⬅️ К меню рассылки", f"mailing:{mailing_id}")]]
 
-        if not mailing:
-            logger.error(f"Рассылка с ID {mailing_id} не найдена.")
-            return
 
-        message_text = mailing.message_text
+def run_status_markup(mailing_id: int, stats: dict) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [
+            [InlineKeyboardButton(text, callback_data=data) for text, data in row]
+            for row in run_status_buttons(mailing_id, stats)
+        ]
+    )
 
-        # Фильтруем получателей в зависимости от настроек рассылки
-        send_to_users = getattr(mailing, "send_to_users", True)
-        send_to_groups = getattr(mailing, "send_to_groups", True)
 
-        # Получаем только активные чаты нужных типов
-        all_active_chats = get_active_chats(session, send_to_users, send_to_groups)
+async def perform_mailing(
+    application,
+    mailing_id,
+    status_msg=None,
+    run_id=None,
+    retry_of=None,
+    retry_classes=None,
+):
+    """Выполнение рассылки
+
+    run_id - продолжить приостановленный запуск с точки возобновления,
+    retry_of - повторить неудачных получателей завершенного запуска
+    (retry_classes - только с этими классами ошибок).
+    """
+    api = application.bot_data["telegram_api"]
+    active = application.bot_data.setdefault("active_mailings", set())
+    last_update = 0.0
+
+    async def progress(stats):
+        nonlocal last_update
+        if not status_msg:
+            return
 
-        # Фильтруем только те чаты, которые выбраны для этой рассылки
-        recipients = []
-        for chat in all_active_chats:
-            if chat in mailing.recipients:
-                recipients.append((chat.chat_id, chat.title or str(chat.chat_id)))
+        now = asyncio.get_running_loop().time()
+        if stats["status"] == "running" and now - last_update < STATUS_UPDATE_INTERVAL:
+            return
+        last_update = now
 
-        total = len(recipients)
+        keyboard = [
+            [{"text": text, "callback_data": data} for text, data in row]
+            for row in run_status_buttons(mailing_id, stats)
+        ]
+        try:
+            await api.edit_message_text(
+                status_msg.chat_id,
+                status_msg.message_id,
+                run_status_text(mailing_id, stats),
+                reply_markup={"inline_keyboard": keyboard},
+            )
+        except TelegramAPIError as e:
+            # Например, "message is not modified" - статус не изменился
+            logger.debug(f"Не удалось обновить статус рассылки {mailing_id}: {e}")
+
+    if mailing_id in active:
+        # Второе нажатие или тик планировщика, пока рассылка уже идет
+        logger.info(f"Рассылка ID {mailing_id} уже выполняется")
+        return
+    active.add(mailing_id)
+    try:
+        while True:
+            stats = await deliver_mailing(
+                api,
+                mailing_id,
+                progress,
+                run_id=run_id,
+                retry_of=retry_of,
+                retry_classes=retry_classes,
+            )
+            run_id, retry_of = stats["run_id"], None
+            if stats["status"] != "paused":
+                break
+            # Продолжение могли нажать, пока движок дорабатывал пакет
+            with db_session() as session:
+                run = session.get(MailingRun, run_id)
+                if not run or run.status != "running":
+                    break
+    except Exception as e:
+        logger.error(f"Ошибка выполнения рассылки ID {mailing_id}: {e}")
+        # Запуск остался "running" - ставим на паузу, чтобы его можно было
+        # продолжить кнопкой, а новые запуски не блокировались
+        try:
+            pause_interrupted_runs(mailing_id)
+        except Exception as e:
+            logger.error(f"Не удалось приостановить рассылку ID {mailing_id}: {e}")
+    finally:
+        active.discard(mailing_id)
+        # Изменились счетчики отправок и, возможно, расписание
+        mailing_views.invalidate(mailing_id)
 
 
 # РЕДАКТИРОВАНИЕ РАССЫЛКИ
@@ -1422,7 +1768,7 @@ async def edit_message_text(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
 
     try:
-        mailing_id = int(query.data.split(":")[1])
+        mailing_id = int(context.args[0])
 
         # Сохраняем ID рассылки для дальнейшего обновления
         context.user_data["edit_mailing_id"] = mailing_id
@@ -1472,7 +1818,7 @@ async def edit_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     await query.answer()
 
     try:
-        mailing_id = int(query.data.split(":")[1])
+        mailing_id = int(context.args[0])
 
         # Сохраняем ID рассылки для дальнейшего обновления
         context.user_data["edit_mailing_id"] = mailing_id
@@ -1539,7 +1885,11 @@ async def handle_awaiting_input(
 
             if mailing:
                 mailing.message_text = new_text
+                # Новый текст заменяет копию исходного сообщения
+                mailing.source_chat_id = None
+                mailing.source_message_id = None
                 session.commit()
+        mailing_views.invalidate(mailing_id)
 
         await update.message.reply_text(
             f"Текст сообщения для рассылки ID {mailing_id} обновлен."
@@ -1629,6 +1979,7 @@ async def handle_awaiting_input(
                     return
 
                 session.commit()
+            mailing_views.invalidate(mailing_id)
 
             await update.message.reply_text(
                 f"Расписание для рассылки ID {mailing_id} обновлено."
@@ -1662,6 +2013,31 @@ async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
 
 
+def collect_stats():
+    """Счетчики для экрана статистики (блокирующие запросы к БД)"""
+    with db_session() as session:
+        # Общее количество рассылок
+        total_mailings = session.query(Mailing).count()
+
+        # Количество отправленных сообщений
+        sent_messages = session.query(SendLog).count()
+
+        # Количество успешных отправок
+        try:
+            successful = session.query(SendLog).filter_by(status="success").count()
+            failed = session.query(SendLog).filter_by(status="failed").count()
+        except Exception as e:
+            logger.error(f"Ошибка при подсчете логов: {e}")
+            successful = 0
+            failed = 0
+
+    # Получаем статистику по типам чатов из новой функции
+    from shared.database import get_statistics_by_chat_type
+
+    chat_stats = get_statistics_by_chat_type()
+    return total_mailings, sent_messages, successful, failed, chat_stats
+
+
 async def show_stats_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
@@ -1673,26 +2049,11 @@ async def show_stats_handler(
     context.user_data.clear()
 
     try:
-        with db_session() as session:
-            # Общее количество рассылок
-            total_mailings = session.query(Mailing).count()
-
-            # Количество отправленных сообщений
-            sent_messages = session.query(SendLog).count()
-
-            # Количество успешных отправок
-            try:
-                successful = session.query(SendLog).filter_by(status="success").count()
-                failed = session.query(SendLog).filter_by(status="failed").count()
-            except Exception as e:
-                logger.error(f"Ошибка при подсчете логов: {e}")
-                successful = 0
-                failed = 0
-
-            # Получаем статистику по типам чатов из новой функции
-            from database import get_statistics_by_chat_type
-
-            chat_stats = get_statistics_by_chat_type()
+        # Подсчет идет в отдельном потоке, чтобы не задерживать остальные
+        # обновления, которые обрабатываются параллельно
+        total_mailings, sent_messages, successful, failed, chat_stats = (
+            await asyncio.to_thread(collect_stats)
+        )
 
         stats_text = "📊 Общая статистика рассылок:\n\n"
         stats_text += f"📨 Всего рассылок: {total_mailings}\n"
@@ -1758,20 +2119,36 @@ async def handle_webapp_data(
         data = json.loads(update.effective_message.web_app_data.data)
         mailing_id = data.get("mailing_id")
         selected_chats = data.get("selected_chats", [])
+        # Вместо отдельных чатов можно выбрать сохраненный сегмент
+        segment_id = data.get("segment_id")
 
-        if not isinstance(selected_chats, list):
+        if not isinstance(selected_chats, list) or not isinstance(
+            segment_id, (int, type(None))
+        ):
             await update.message.reply_text("Получены некорректные данные от Mini App.")
             return
 
+        if segment_id is not None:
+            with db_session() as session:
+                segment = session.get(Segment, segment_id)
+                if segment is None:
+                    await update.message.reply_text("Сегмент не найден.")
+                    return
+                selection = f"Выбран сегмент «{segment.name}»: {segment.users + segment.groups} получателей."
+            selected_chats = []
+        else:
+            selection = f"Выбрано {len(selected_chats)} получателей."
+
         # Проверяем, идет ли создание новой рассылки или редактирование существующей
         if mailing_id == "temp":
             # Это создание новой рассылки - сохраняем выбранных получателей во временные данные
             if "temp_mailing" in context.user_data:
                 context.user_data["temp_mailing"]["selected_chats"] = selected_chats
+                context.user_data["temp_mailing"]["segment_id"] = segment_id
 
                 await update.message.reply_text(
                     f"Получатели для новой рассылки выбраны.\n"
-                    f"Выбрано {len(selected_chats)} получателей.\n\n"
+                    f"{selection}\n\n"
                     f"Нажмите на кнопку ниже, чтобы завершить создание рассылки:"
                 )
 
@@ -1819,6 +2196,7 @@ async def handle_webapp_data(
 
                     # Очищаем текущий список получателей
                     mailing.recipients = []
+                    mailing.segment_id = segment_id
 
                     # Добавляем новых получателей
                     for chat_id in selected_chats:
@@ -1827,11 +2205,13 @@ async def handle_webapp_data(
                             mailing.recipients.append(chat)
 
                     session.commit()
-                    recipient_count = len(mailing.recipients)
+                    if segment_id is None:
+                        selection = f"Выбрано {len(mailing.recipients)} получателей."
+                mailing_views.invalidate(mailing_id)
 
                 await update.message.reply_text(
                     f"Получатели для рассылки ID {mailing_id} обновлены.\n"
-                    f"Выбрано {recipient_count} получателей."
+                    f"{selection}"
                 )
 
                 # После обновления получателей показываем меню рассылки
@@ -1852,6 +2232,27 @@ async def handle_webapp_data(
 async def post_init(application: Application) -> None:
     """Действия после инициализации бота"""
 
+    # /healthz отвечает сразу, /ready - после завершения post_init
+    if HEALTH_PORT:
+        application.bot_data["health_runner"] = await start_health_server(
+            readiness, HEALTH_HOST, HEALTH_PORT, application.bot_data
+        )
+
+    # Общий HTTP-клиент Bot API для рассылок (пул keep-alive соединений)
+    api = TelegramAPI(application.bot.token)
+    await api.open()
+    application.bot_data["telegram_api"] = api
+
+    # Реестр чатов с отложенной пакетной записью
+    registry = ChatRegistry()
+    registry.start()
+    application.bot_data["chat_registry"] = registry
+
+    # Запуски, прерванные остановкой бота, ждут продолжения кнопкой
+    interrupted = pause_interrupted_runs()
+    if interrupted:
+        logger.info(f"Прерванных рассылок поставлено на паузу: {interrupted}")
+
     # Вместо JobQueue используем asyncio для периодических задач
     async def periodic_check():
         while True:
@@ -1864,7 +2265,40 @@ async def post_init(application: Application) -> None:
     # Запускаем задачу асинхронно
     asyncio.create_task(periodic_check())
 
-    logger.info("Бот запущен и готов к работе.")
+    # Метрики процесса: лаг event loop и очередь входящих обновлений
+    application.bot_data["loop_watcher"] = asyncio.create_task(
+        metrics.watch_event_loop()
+    )
+    UPDATE_QUEUE_DEPTH.set_function(application.update_queue.qsize)
+
+    time_to_ready = readiness.mark_ready()
+    logger.info(f"Бот запущен и готов к работе за {time_to_ready:.2f} с.")
+
+
+async def post_shutdown(application: Application) -> None:
+    """Освобождение ресурсов при остановке бота"""
+    api = application.bot_data.pop("telegram_api", None)
+    if api:
+        await api.close()
+
+    registry = application.bot_data.pop("chat_registry", None)
+    if registry:
+        await registry.stop()
+
+    watcher = application.bot_data.pop("loop_watcher", None)
+    if watcher:
+        watcher.cancel()
+
+    health_runner = application.bot_data.pop("health_runner", None)
+    if health_runner:
+        await health_runner.cleanup()
+
+    router = application.bot_data.get("callback_router")
+    if router and router.stats:
+        logger.info(f"Статистика нажатий кнопок: {json.dumps(router.summary())}")
+
+    tracing.configure(None)
+    stop_logging()
 
 
 async def check_mailings(application: Application) -> None:
@@ -1873,16 +2307,43 @@ async def check_mailings(application: Application) -> None:
 
     with db_session() as session:
         # Находим рассылки, которые должны быть отправлены
-        mailings = (
-            session.query(Mailing)
-            .filter(Mailing.next_run_time <= now, Mailing.next_run_time != None)
+        due = (
+            session.execute(
+                select(Mailing.mailing_id).where(
+                    Mailing.next_run_time <= now, Mailing.next_run_time != None
+                )
+                # Пока предыдущий запуск идет или стоит на паузе, новый не начинаем
+                .where(~Mailing.runs.any(MailingRun.status.in_(ACTIVE_STATUSES)))
+            )
+            .scalars()
             .all()
         )
 
-        for mailing in mailings:
-            logger.info(f"Запуск запланированной рассылки ID {mailing.mailing_id}")
-            # Запускаем отправку рассылки
-            await perform_mailing(application.bot, mailing.mailing_id)
+    # Рассылки идут фоновыми задачами: сессия уже закрыта, а проверка
+    # расписания не ждет окончания доставки. Повторный запуск той же
+    # рассылки отсекает уникальный индекс активных запусков.
+    for mailing_id in due:
+        logger.info(f"Запуск запланированной рассылки ID {mailing_id}")
+        application.create_task(perform_mailing(application, mailing_id))
+
+    # Автоматический повтор временных ошибок завершенных запусков
+    for mailing_id, run_id in due_retries(now):
+        logger.info(f"Повтор неудачных получателей рассылки ID {mailing_id}")
+        application.create_task(
+            perform_mailing(
+                application,
+                mailing_id,
+                retry_of=run_id,
+                retry_classes=AUTO_RETRY_CLASSES,
+            )
+        )
+
+
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Отметка активности чата в реестре (запись в БД - пачками)"""
+    registry = context.application.bot_data.get("chat_registry")
+    if registry and update.effective_chat:
+        registry.touch(update.effective_chat)
 
 
 async def chat_join_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1894,26 +2355,7 @@ async def chat_join_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     # Проверяем, что добавленный участник - это наш бот
     if context.bot.id in [member.user.id for member in update.message.new_chat_members]:
-        with db_session() as session:
-            # Проверяем, существует ли уже запись о чате
-            existing_chat = session.query(Chat).filter_by(chat_id=chat.id).first()
-
-            if existing_chat:
-                # Обновляем статус и время последней активности
-                existing_chat.status = "active"
-                existing_chat.last_active = datetime.now()
-            else:
-                # Создаем новую запись о чате
-                new_chat = Chat(
-                    chat_id=chat.id,
-                    type=chat.type,
-                    title=chat.title or str(chat.id),
-                    status="active",
-                )
-                session.add(new_chat)
-
-            session.commit()
-
+        context.application.bot_data["chat_registry"].touch(chat, status="active")
         logger.info(f"Бот добавлен в чат: {chat.id} ({chat.title})")
 
 
@@ -1931,17 +2373,32 @@ async def chat_leave_handler(
         update.message.left_chat_member
         and update.message.left_chat_member.id == context.bot.id
     ):
-        with db_session() as session:
-            # Находим запись о чате
-            chat_record = session.query(Chat).filter_by(chat_id=chat.id).first()
+        context.application.bot_data["chat_registry"].touch(
+            chat, status="left", last_error="Бот был удален из чата"
+        )
+        logger.info(f"Бот удален из чата: {chat.id} ({chat.title})")
 
-            if chat_record:
-                # Помечаем чат как удаленный
-                chat_record.status = "left"
-                chat_record.last_error = "Бот был удален из чата"
-                session.commit()
 
-        logger.info(f"Бот удален из чата: {chat.id} ({chat.title})")
+async def my_chat_member_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Изменение статуса бота в чате: добавление, удаление, блокировка"""
+    member_update = update.my_chat_member
+    chat = member_update.chat
+    new_status = member_update.new_chat_member.status
+    registry = context.application.bot_data["chat_registry"]
+
+    if new_status in (ChatMember.MEMBER, ChatMember.ADMINISTRATOR):
+        registry.touch(chat, status="active")
+    elif new_status == ChatMember.BANNED and chat.type == "private":
+        registry.touch(
+            chat, status="blocked", last_error="Пользователь заблокировал бота"
+        )
+    elif new_status in (ChatMember.BANNED, ChatMember.LEFT):
+        registry.touch(chat, status="left", last_error="Бот был удален из чата")
+    else:
+        return
+    logger.info(f"Статус бота в чате {chat.id}: {new_status}")
 
 
 def main() -> None:
@@ -1955,10 +2412,17 @@ def main() -> None:
         )
         return
 
-    # Создаем таблицы в базе данных (если они еще не созданы)
-    from database import create_tables
+    # Настройки вебхука читаются после загрузки .env
+    from bot import webhook
+
+    if TRACE_FILE:
+        tracing.configure(TRACE_FILE)
+        logger.info(f"Трассировка включена: {TRACE_FILE}")
 
-    create_tables()
+    # Обычно один запрос версии схемы; полная проверка - только после обновления
+    started = time.monotonic()
+    if ensure_schema():
+        logger.info(f"Схема БД обновлена за {time.monotonic() - started:.2f} с")
 
     # Устанавливаем параметры по умолчанию для форматирования сообщений
     defaults = Defaults(
@@ -1966,14 +2430,28 @@ def main() -> None:
     )  # Устанавливаем по умолчанию форматирование None
 
     # Создаем объект Application с параметрами по умолчанию
+    # Адрес Bot API (например, локальный сервер для нагрузочных тестов)
+    api_url = get_api_url().rstrip("/")
+
     application = (
         Application.builder()
         .token(token)
+        .base_url(f"{api_url}/bot")
+        .base_file_url(f"{api_url}/file/bot")
         .defaults(defaults)
+        .request(TracedRequest(connection_pool_size=API_POOL_SIZE))
+        .concurrent_updates(KeyedUpdateProcessor(UPDATE_WORKERS))
+        # Черновики рассылок и шаги диалогов переживают перезапуск
+        .persistence(DatabasePersistence())
         .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .build()
     )
 
+    if webhook.WEBHOOK_URL:
+        # Замер задержки от приема вебхуком до обработки - раньше всех групп
+        application.add_handler(TypeHandler(Update, webhook.track_latency), group=-1)
+
     # Регистрируем обработчик диалога создания рассылки
     create_conv_handler = ConversationHandler(
         entry_points=[
@@ -1982,11 +2460,17 @@ def main() -> None:
         ],
         states={
             ENTER_MESSAGE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, enter_message),
+                MessageHandler(
+                    ~filters.COMMAND & ~filters.StatusUpdate.ALL, enter_message
+                ),
                 CallbackQueryHandler(cancel_create_handler, pattern="^cancel_create$"),
             ],
             ENTER_SCHEDULE: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, enter_schedule),
+                # Остальные элементы альбома приходят отдельными сообщениями
+                MessageHandler(
+                    filters.PHOTO | filters.VIDEO | filters.Document.ALL, enter_message
+                ),
                 CallbackQueryHandler(cancel_create_handler, pattern="^cancel_create$"),
             ],
             SELECT_RECIPIENTS: [
@@ -2000,6 +2484,7 @@ def main() -> None:
         fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
         per_user=True,
         name="create_mailing_conversation",
+        persistent=True,
     )
     application.add_handler(create_conv_handler)
 
@@ -2007,34 +2492,29 @@ def main() -> None:
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("list", list_mailings))
-
-    # Регистрируем обработчики взаимодействия с интерфейсом
-    application.add_handler(
-        CallbackQueryHandler(main_menu_handler, pattern="^main_menu$")
-    )
-    application.add_handler(
-        CallbackQueryHandler(show_list_handler, pattern="^open_list$")
-    )
-    application.add_handler(
-        CallbackQueryHandler(show_stats_handler, pattern="^show_stats$")
-    )
-    application.add_handler(CallbackQueryHandler(handle_pagination, pattern="^page:"))
-    application.add_handler(
-        CallbackQueryHandler(show_mailing_menu, pattern="^mailing:")
-    )
-    application.add_handler(CallbackQueryHandler(send_mailing_now, pattern="^send:"))
-    application.add_handler(
-        CallbackQueryHandler(refresh_status, pattern="^refresh_status:")
-    )
-    application.add_handler(
-        CallbackQueryHandler(edit_message_text, pattern="^edit_message:")
-    )
-    application.add_handler(
-        CallbackQueryHandler(edit_schedule, pattern="^edit_schedule:")
-    )
-    application.add_handler(
-        CallbackQueryHandler(list_mailings, pattern="^back_to_list$")
+    application.add_handler(CommandHandler("profile", profile_command))
+
+    # Нажатия кнопок: одна таблица действий вместо цепочки regex-обработчиков
+    router = CallbackRouter(
+        {
+            "main_menu": main_menu_handler,
+            "open_list": show_list_handler,
+            "show_stats": show_stats_handler,
+            "page": handle_pagination,
+            "mailing": show_mailing_menu,
+            "send": send_mailing_now,
+            "refresh_status": refresh_status,
+            "run_pause": partial(control_run, action="run_pause"),
+            "run_resume": partial(control_run, action="run_resume"),
+            "run_cancel": partial(control_run, action="run_cancel"),
+            "retry_failed": retry_failed,
+            "edit_message": edit_message_text,
+            "edit_schedule": edit_schedule,
+            "back_to_list": list_mailings,
+        }
     )
+    application.add_handler(router)
+    application.bot_data["callback_router"] = router
 
     # Регистрируем обработчик для данных от Mini App
     application.add_handler(
@@ -2063,9 +2543,18 @@ def main() -> None:
     application.add_handler(
         MessageHandler(filters.StatusUpdate.LEFT_CHAT_MEMBER, chat_leave_handler)
     )
+    application.add_handler(
+        ChatMemberHandler(my_chat_member_handler, ChatMemberHandler.MY_CHAT_MEMBER)
+    )
 
-    # Запускаем бота
-    application.run_polling()
+    # Обновление last_active для любого чата, откуда пришло обновление
+    application.add_handler(TypeHandler(Update, track_activity), group=-2)
+
+    # Запускаем бота: вебхук, если задан WEBHOOK_URL, иначе long polling
+    if webhook.WEBHOOK_URL:
+        asyncio.run(webhook.run_webhook(application, post_init, post_shutdown))
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import select
+
+from shared.database import Chat, db_session, upsert_insert
+from shared.segments import apply_chat_changes
+
+logger = logging.getLogger(__name__)
+
+# Период записи накопленных изменений в БД (секунды)
+FLUSH_INTERVAL = 1.0
+
+
+class ChatRegistry:
+    """Буфер отложенной записи реестра чатов
+
+    Обработчики только отмечают чат (touch) в памяти; повторные отметки
+    одного чата объединяются, а раз в FLUSH_INTERVAL все изменения
+    записываются пачкой через INSERT ... ON CONFLICT DO UPDATE.
+    Чаты, которые появились или ушли, в той же транзакции обновляют
+    составы сегментов получателей.
+    """
+
+    def __init__(self, interval: float = FLUSH_INTERVAL):
+        self.interval = interval
+        self.pending = {}
+        self._task = None
+        self._flushing = None
+
+    def touch(self, chat, status: str = None, last_error: str = None) -> None:
+        """Отметить активность в чате и, если задан, новый статус"""
+        entry = self.pending.setdefault(chat.id, {"chat_id": chat.id})
+        entry["type"] = chat.type
+        entry["title"] = chat.title or chat.full_name or str(chat.id)
+        entry["last_active"] = datetime.now()
+        if status:
+            entry["status"] = status
+            entry["last_error"] = last_error
+
+    def take(self) -> dict:
+        """Забрать накопленные изменения (вызывается в event loop)"""
+        pending, self.pending = self.pending, {}
+        return pending
+
+    def restore(self, pending: dict) -> None:
+        """Вернуть не записанные изменения в буфер; новые отметки важнее"""
+        for chat_id, row in pending.items():
+            newer = self.pending.get(chat_id)
+            self.pending[chat_id] = dict(row, **newer) if newer else row
+
+    def flush(self) -> int:
+        """Синхронная запись накопленных изменений; возвращает число чатов"""
+        pending = self.take()
+        if not pending:
+            return 0
+        try:
+            return self._write(pending)
+        except Exception:
+            self.restore(pending)
+            raise
+
+    async def flush_async(self) -> int:
+        """Запись в рабочем потоке; буфер забирается и пополняется в event loop"""
+        pending = self.take()
+        if not pending:
+            return 0
+        try:
+            return await asyncio.to_thread(self._write, pending)
+        except Exception:
+            self.restore(pending)
+            raise
+
+    @staticmethod
+    def _write(pending: dict) -> int:
+        """Запись пачки в БД; не обращается к состоянию реестра"""
+        # Отметки со сменой статуса и без нее - два пакетных запроса
+        with_status = [row for row in pending.values() if "status" in row]
+        activity = [
+            dict(row, status="active", last_error=None)
+            for row in pending.values()
+            if "status" not in row
+        ]
+        with db_session() as session:
+            previous = dict(
+                session.execute(
+                    select(Chat.chat_id, Chat.status).where(
+                        Chat.chat_id.in_(list(pending))
+                    )
+                ).all()
+            )
+            for rows, columns in (
+                (
+                    with_status,
+                    ("type", "title", "last_active", "status", "last_error"),
+                ),
+                (activity, ("type", "title", "last_active")),
+            ):
+                if not rows:
+                    continue
+                stmt = upsert_insert(session, Chat)
+                session.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=["chat_id"],
+                        set_={name: stmt.excluded[name] for name in columns},
+                    ),
+                    rows,
+                )
+
+            # Статус после записи: обычная отметка не меняет статус
+            # существующего чата, активным по ней становится только новый
+            current = {row["chat_id"]: row["status"] for row in with_status}
+            current.update(
+                (row["chat_id"], previous.get(row["chat_id"], "active"))
+                for row in activity
+            )
+            # Сегменты меняются только при смене активности чата
+            changes = {
+                chat_id: (pending[chat_id]["type"], status == "active")
+                for chat_id, status in current.items()
+                if (previous.get(chat_id) == "active") != (status == "active")
+            }
+            if changes:
+                apply_chat_changes(session, changes)
+        return len(pending)
+
+    async def run(self) -> None:
+        """Периодическая запись буфера до отмены задачи"""
+        while True:
+            await asyncio.sleep(self.interval)
+            # Запись в потоке не прерывается отменой: stop() дождется ее
+            self._flushing = asyncio.ensure_future(self.flush_async())
+            try:
+                await asyncio.shield(self._flushing)
+            except Exception as e:
+                logger.error(f"Ошибка записи реестра чатов: {e}")
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Остановка периодической записи и финальный сброс буфера"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._flushing:
+            # Запись, начатая до остановки, завершается до финальной
+            await asyncio.gather(self._flushing, return_exceptions=True)
+            self._flushing = None
+        await self.flush_async()
@@ -0,0 +1,137 @@
+import logging
+
+from sqlalchemy import bindparam, delete, literal, select, update
+
+from shared.database import Chat, insert_ignore, mailing_recipients
+from shared.segments import apply_chat_changes
+from telegram_api import BadRequest, Forbidden
+
+logger = logging.getLogger(__name__)
+
+# Фрагменты описаний ошибок Bot API, после которых чат больше не получает
+# сообщения. Пользователь заблокировал бота или удалил аккаунт:
+BLOCKED_MARKERS = (
+    "blocked by the user",
+    "user is deactivated",
+    "can't initiate conversation",
+)
+# Бота удалили из группы/канала или чата больше нет:
+LEFT_MARKERS = (
+    "kicked",
+    "not a member",
+    "chat not found",
+    "group chat was deleted",
+)
+
+
+def classify_error(error) -> str:
+    """Новый статус чата по ошибке отправки: 'blocked', 'left' или None"""
+    if not isinstance(error, (Forbidden, BadRequest)):
+        return None
+    description = (error.description or "").lower()
+    if any(marker in description for marker in BLOCKED_MARKERS):
+        return "blocked"
+    if any(marker in description for marker in LEFT_MARKERS):
+        return "left"
+    return None
+
+
+class ChatStatusBuffer:
+    """Накопитель изменений статусов чатов по результатам рассылки
+
+    Ошибки и миграции групп собираются во время отправки и записываются
+    пачкой в транзакции сохранения прогресса (apply), а не запросом на
+    каждую ошибку.
+    """
+
+    def __init__(self):
+        self.statuses = {}
+        self.migrations = {}
+
+    def __bool__(self):
+        return bool(self.statuses or self.migrations)
+
+    def record_error(self, chat_id: int, error) -> None:
+        status = classify_error(error)
+        if status:
+            self.statuses[chat_id] = (status, error.description)
+
+    def record_migration(self, chat_id: int, new_chat_id: int) -> None:
+        self.migrations[chat_id] = new_chat_id
+
+    def apply(self, session) -> None:
+        """Запись накопленных изменений в текущей сессии"""
+        if self.statuses:
+            session.connection().execute(
+                update(Chat.__table__)
+                .where(Chat.chat_id == bindparam("b_chat_id"))
+                .values(status=bindparam("b_status"), last_error=bindparam("b_error")),
+                [
+                    {"b_chat_id": chat_id, "b_status": status, "b_error": error}
+                    for chat_id, (status, error) in self.statuses.items()
+                ],
+            )
+            logger.info(f"Чатов помечено недоступными: {len(self.statuses)}")
+
+        for chat_id, new_chat_id in self.migrations.items():
+            migrate_chat(session, chat_id, new_chat_id)
+
+        if self.statuses or self.migrations:
+            update_segments(session, self.statuses, self.migrations)
+
+        self.statuses.clear()
+        self.migrations.clear()
+
+
+def update_segments(session, statuses: dict, migrations: dict) -> None:
+    """Выход недоступных и перенесенных чатов из сегментов
+
+    Новые супергруппы занимают в сегментах места старых групп.
+    """
+    changes = {
+        chat_id: (chat_type, False)
+        for chat_id, chat_type in session.execute(
+            select(Chat.chat_id, Chat.type).where(
+                Chat.chat_id.in_(list(statuses) + list(migrations))
+            )
+        )
+    }
+    changes.update(
+        (new_chat_id, ("supergroup", True)) for new_chat_id in migrations.values()
+    )
+    apply_chat_changes(session, changes, migrations)
+
+
+def migrate_chat(session, chat_id: int, new_chat_id: int) -> None:
+    """Переход группы в супергруппу (migrate_to_chat_id)
+
+    Создается чат с новым chat_id, связи с рассылками переносятся на него.
+    Старая запись остается для истории отправок со статусом 'left'.
+    """
+    old_chat = session.get(Chat, chat_id)
+    if session.get(Chat, new_chat_id) is None:
+        session.add(
+            Chat(
+                chat_id=new_chat_id,
+                type="supergroup",
+                title=old_chat.title if old_chat else str(new_chat_id),
+                status="active",
+            )
+        )
+        session.flush()
+
+    session.execute(
+        insert_ignore(session, mailing_recipients).from_select(
+            ["mailing_id", "chat_id"],
+            select(mailing_recipients.c.mailing_id, literal(new_chat_id)).where(
+                mailing_recipients.c.chat_id == chat_id
+            ),
+        )
+    )
+    session.execute(
+        delete(mailing_recipients).where(mailing_recipients.c.chat_id == chat_id)
+    )
+    if old_chat:
+        old_chat.status = "left"
+        old_chat.last_error = f"Группа преобразована в супергруппу {new_chat_id}"
+    logger.info(f"Чат {chat_id} перенесен на {new_chat_id}")
@@ -0,0 +1,853 @@
+import os
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, delete, func, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+
+from shared.database import (
+    Chat,
+    DeadLetter,
+    Mailing,
+    MailingRun,
+    RunRecipient,
+    Segment,
+    SendLog,
+    db_session,
+    insert_ignore,
+    mailing_recipients,
+)
+from telegram_api import (
+    BadRequest,
+    ChatMigrated,
+    Forbidden,
+    NetworkError,
+    PayloadTemplate,
+    RetryAfter,
+    TelegramAPIError,
+)
+from shared.metrics import Counter, Gauge, Histogram
+from shared.segments import unpack
+from bot.chat_status import ChatStatusBuffer, classify_error
+from bot.media import MEDIA_UPLOAD_CHAT_ID, media_request, resolve_media
+
+logger = logging.getLogger(__name__)
+
+# Параметры доставки
+DELIVERY_CONCURRENCY = int(os.environ.get("DELIVERY_CONCURRENCY", "20"))
+DELIVERY_RATE = float(os.environ.get("DELIVERY_RATE", "25"))  # сообщений в секунду
+# Размер пакета: после него сохраняется прогресс и проверяется пауза/отмена
+RUN_BATCH_SIZE = 200
+# Сколько пакетов получателей читается из БД заранее
+RECIPIENT_PREFETCH = 2
+# Сколько chat_id сегмента проверять одним запросом при фиксации аудитории
+SEGMENT_CHUNK = 500
+
+# Статусы запуска рассылки
+ACTIVE_STATUSES = ("running", "paused")
+FINAL_STATUSES = ("finished", "cancelled")
+
+# Автоматические повторы для временных ошибок: задержка после окончания
+# предыдущей попытки, число элементов - максимум повторов
+RETRY_DELAYS = (timedelta(minutes=5), timedelta(minutes=30), timedelta(hours=2))
+# Классы ошибок, которые повторяются автоматически (без 'unknown' - см.
+# transient_class)
+AUTO_RETRY_CLASSES = ("flood_wait", "network")
+
+GROUP_TYPES = ["group", "supergroup", "channel"]
+
+# Метрики доставки
+MESSAGES = Counter(
+    "mailing_messages_total", "Результаты отправки сообщений рассылок", ["result"]
+)
+SEND_ERRORS = Counter(
+    "mailing_send_errors_total",
+    "Ошибки отправки по классам (flood_wait - ограничение частоты)",
+    ["error_class"],
+)
+SEND_RATE = Gauge("mailing_send_rate", "Сообщений в секунду в последнем пакете")
+SENDS_IN_FLIGHT = Gauge("mailing_sends_in_flight", "Отправки, ожидающие ответа API")
+QUEUE_DEPTH = Gauge(
+    "mailing_queue_depth", "Захваченные получатели, еще не взятые воркерами"
+)
+ACTIVE_RUNS = Gauge("mailing_runs_active", "Запуски рассылок, выполняемые сейчас")
+SCHEDULER_LAG = Histogram(
+    "scheduler_lag_seconds",
+    "Задержка старта рассылки по расписанию относительно next_run_time",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800),
+)
+
+
+class RateLimiter:
+    """Равномерное ограничение частоты запросов для всех воркеров"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def audience_query(mailing, run_id: int, chat_ids: list = None):
+    """Активные получатели рассылки с учетом типов чатов: (run_id, chat_id)
+
+    chat_ids - часть состава сегмента вместо связей mailing_recipients.
+    None, если рассылка не адресована ни пользователям, ни группам.
+    """
+    send_to_users = getattr(mailing, "send_to_users", True)
+    send_to_groups = getattr(mailing, "send_to_groups", True)
+
+    if not send_to_users and not send_to_groups:
+        return None
+
+    query = select(literal(run_id), Chat.chat_id).where(Chat.status == "active")
+    if chat_ids is None:
+        query = query.join(
+            mailing_recipients, mailing_recipients.c.chat_id == Chat.chat_id
+        ).where(mailing_recipients.c.mailing_id == mailing.mailing_id)
+    else:
+        query = query.where(Chat.chat_id.in_(chat_ids))
+    if send_to_users and not send_to_groups:
+        query = query.where(Chat.type == "private")
+    elif send_to_groups and not send_to_users:
+        query = query.where(Chat.type.in_(GROUP_TYPES))
+    return query
+
+
+def snapshot_audience(session, mailing, run_id: int) -> int:
+    """Фиксация аудитории запуска в run_recipients одним INSERT ... SELECT
+
+    Прогресс, ETA и продолжение запуска считаются по этому списку, а не по
+    текущим получателям рассылки, которые могут меняться во время отправки.
+    Для рассылки по сегменту берется его готовый состав: запросы по
+    SEGMENT_CHUNK chat_id лишь сверяют актуальный статус и тип чатов.
+    Возвращает размер аудитории.
+    """
+    segment = (
+        session.get(Segment, mailing.segment_id)
+        if getattr(mailing, "segment_id", None)
+        else None
+    )
+    if segment is not None:
+        members = unpack(segment.members)
+        queries = [
+            audience_query(
+                mailing, run_id, members[start : start + SEGMENT_CHUNK].tolist()
+            )
+            for start in range(0, len(members), SEGMENT_CHUNK)
+        ]
+    else:
+        queries = [audience_query(mailing, run_id)]
+
+    for query in queries:
+        if query is None:
+            return 0
+        session.execute(insert(RunRecipient).from_select(["run_id", "chat_id"], query))
+    return session.execute(
+        select(func.count()).where(RunRecipient.run_id == run_id)
+    ).scalar_one()
+
+
+def snapshot_retry_audience(
+    session, parent_run_id: int, run_id: int, classes=None
+) -> int:
+    """Аудитория повторного запуска: ожидающие повтора получатели parent_run_id
+
+    Получатели помечаются взятыми в run_id, чтобы не попасть в следующий
+    повтор; чаты, ставшие недоступными, пропускаются. classes - повторять
+    только эти классы ошибок (None - все); остальные ожидающие получатели
+    переносятся в очередь повторов run_id без отправки, чтобы их можно было
+    повторить кнопкой у последнего запуска.
+    """
+    pending = (DeadLetter.run_id == parent_run_id, DeadLetter.retry_run_id.is_(None))
+    selected = pending
+    if classes is not None:
+        selected += (DeadLetter.error_class.in_(classes),)
+        columns = ["chat_id", "error_class", "error_message", "created_at"]
+        session.execute(
+            insert_ignore(session, DeadLetter).from_select(
+                ["run_id", *columns],
+                select(
+                    literal(run_id), *(getattr(DeadLetter, c) for c in columns)
+                ).where(*pending, DeadLetter.error_class.not_in(classes)),
+            )
+        )
+    session.execute(
+        insert(RunRecipient).from_select(
+            ["run_id", "chat_id"],
+            select(literal(run_id), DeadLetter.chat_id)
+            .join(Chat, Chat.chat_id == DeadLetter.chat_id)
+            .where(*selected, Chat.status == "active"),
+        )
+    )
+    session.execute(update(DeadLetter).where(*pending).values(retry_run_id=run_id))
+    return session.execute(
+        select(func.count()).where(RunRecipient.run_id == run_id)
+    ).scalar_one()
+
+
+async def iter_recipients(run_id: int, after: int = None, batch_size: int = None):
+    """Получатели запуска пакетами по возрастанию chat_id
+
+    Пакеты читаются по ключу (chat_id > последний), каждый отдельным коротким
+    запросом, поэтому память не зависит от размера аудитории.
+    """
+    batch_size = batch_size or RUN_BATCH_SIZE
+    while True:
+        query = select(RunRecipient.chat_id).where(RunRecipient.run_id == run_id)
+        if after is not None:
+            query = query.where(RunRecipient.chat_id > after)
+        with db_session() as session:
+            batch = list(
+                session.execute(
+                    query.order_by(RunRecipient.chat_id).limit(batch_size)
+                ).scalars()
+            )
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        after = batch[-1]
+
+
+def next_run_after(mailing, now: datetime):
+    """Следующее время запуска рассылки или None для разовой"""
+    if not mailing.is_recurring or not mailing.next_run_time:
+        return None
+
+    next_run = mailing.next_run_time
+    if mailing.recurrence_interval == "weekly" and mailing.recurrence_days:
+        days = {int(d) for d in mailing.recurrence_days.split(",") if d.isdigit()}
+        next_run += timedelta(days=1)
+        while next_run <= now or (days and next_run.weekday() not in days):
+            next_run += timedelta(days=1)
+        return next_run
+
+    step = timedelta(days=7 if mailing.recurrence_interval == "weekly" else 1)
+    next_run += step
+    while next_run <= now:
+        next_run += step
+    return next_run
+
+
+def log_row(
+    mailing_id: int, chat_id: int, status: str, error: str = None, run_id: int = None
+) -> dict:
+    return {
+        "mailing_id": mailing_id,
+        "run_id": run_id,
+        "chat_id": chat_id,
+        "send_time": datetime.now(),
+        "status": status,
+        "error_message": error,
+    }
+
+
+def transient_class(error) -> str:
+    """Класс временной ошибки для очереди повторов или None для постоянной
+
+    'unknown' - таймаут или 5xx после отправки запроса: сообщение могло
+    дойти, поэтому такие получатели повторяются только по кнопке.
+    """
+    if isinstance(error, RetryAfter):
+        # retry_after больше допустимого ожидания внутри запуска
+        return "flood_wait"
+    if isinstance(error, NetworkError):
+        return "unknown" if error.maybe_sent else "network"
+    return None
+
+
+def error_class(error) -> str:
+    """Класс ошибки отправки для метрик"""
+    return transient_class(error) or classify_error(error) or "other"
+
+
+def dead_letter_row(run_id: int, chat_id: int, error) -> dict:
+    return {
+        "run_id": run_id,
+        "chat_id": chat_id,
+        "error_class": transient_class(error),
+        "error_message": error.description,
+        "created_at": datetime.now(),
+    }
+
+
+def pending_dead_letters(session, run_id: int) -> int:
+    """Число получателей запуска, ожидающих повтора"""
+    return session.execute(
+        select(func.count()).where(
+            DeadLetter.run_id == run_id, DeadLetter.retry_run_id.is_(None)
+        )
+    ).scalar_one()
+
+
+# Отправка прервана между захватом чата и записью результата
+UNKNOWN_RESULT = "Результат неизвестен: отправка была прервана"
+
+
+def claim_chats(mailing_id: int, run_id: int, chat_ids: list) -> list:
+    """Захват чатов под отправку в рамках запуска
+
+    Для каждого чата создается запись SendLog со статусом 'pending'; ключ
+    (run_id, chat_id) уникален, поэтому чат, уже захваченный этим запуском
+    (повтор, продолжение, параллельный воркер), повторно не возвращается.
+    Возвращает захваченные chat_id по возрастанию.
+    """
+    if not chat_ids:
+        return []
+    now = datetime.now()
+    rows = [
+        {
+            "mailing_id": mailing_id,
+            "run_id": run_id,
+            "chat_id": chat_id,
+            "send_time": now,
+            "status": "pending",
+        }
+        for chat_id in chat_ids
+    ]
+    with db_session() as session:
+        claimed = session.execute(
+            insert_ignore(session, SendLog).values(rows).returning(SendLog.chat_id)
+        ).scalars()
+        return sorted(claimed)
+
+
+def release_chats(run_id: int, chat_ids) -> None:
+    """Снятие захвата с чатов, отправка в которые не начиналась"""
+    if not chat_ids:
+        return
+    with db_session() as session:
+        session.execute(
+            delete(SendLog).where(
+                SendLog.run_id == run_id,
+                SendLog.chat_id.in_(list(chat_ids)),
+                SendLog.status == "pending",
+            )
+        )
+
+
+def write_results(session, rows: list) -> None:
+    """Запись результатов отправки в захваченные строки SendLog"""
+    if not rows:
+        return
+    session.connection().execute(
+        update(SendLog.__table__)
+        .where(
+            SendLog.run_id == bindparam("b_run_id"),
+            SendLog.chat_id == bindparam("b_chat_id"),
+        )
+        .values(
+            send_time=bindparam("b_send_time"),
+            status=bindparam("b_status"),
+            error_message=bindparam("b_error_message"),
+        ),
+        [{f"b_{key}": value for key, value in row.items()} for row in rows],
+    )
+
+
+def run_stats(run: MailingRun) -> dict:
+    return {
+        "run_id": run.run_id,
+        "status": run.status,
+        "total": run.total or 0,
+        "sent": run.sent or 0,
+        "failed": run.failed or 0,
+        "started_at": run.started_at,
+    }
+
+
+def latest_run(session, mailing_id: int):
+    """Последний запуск рассылки или None"""
+    return (
+        session.query(MailingRun)
+        .filter_by(mailing_id=mailing_id)
+        .order_by(MailingRun.run_id.desc())
+        .first()
+    )
+
+
+def set_run_status(run_id: int, status: str, allowed=ACTIVE_STATUSES) -> bool:
+    """Смена статуса запуска, если текущий статус входит в allowed
+
+    Движок рассылки проверяет статус после каждого пакета, поэтому пауза
+    и отмена срабатывают не позже чем через RUN_BATCH_SIZE сообщений.
+    """
+    values = {"status": status}
+    if status in FINAL_STATUSES:
+        values["finished_at"] = datetime.now()
+    with db_session() as session:
+        result = session.execute(
+            update(MailingRun)
+            .where(MailingRun.run_id == run_id, MailingRun.status.in_(allowed))
+            .values(**values)
+        )
+        return result.rowcount > 0
+
+
+def pause_interrupted_runs(mailing_id: int = None) -> int:
+    """Запуски, оставшиеся "running" после перезапуска бота, ставятся на паузу
+
+    mailing_id - только запуск этой рассылки (движок остановился из-за ошибки).
+    """
+    query = update(MailingRun).where(MailingRun.status == "running")
+    if mailing_id is not None:
+        query = query.where(MailingRun.mailing_id == mailing_id)
+    with db_session() as session:
+        return session.execute(query.values(status="paused")).rowcount
+
+
+def save_progress(
+    stats: dict, checkpoint, rows: list, chat_updates=None, dead_letters=None
+) -> str:
+    """Запись результатов пакета и точки возобновления одной транзакцией
+
+    chat_updates - ChatStatusBuffer с изменениями статусов чатов по ошибкам,
+    dead_letters - строки DeadLetter для получателей с временными ошибками.
+    Возвращает текущий статус запуска (его могли сменить кнопками).
+    """
+    with db_session() as session:
+        write_results(session, rows)
+        if chat_updates:
+            chat_updates.apply(session)
+        if dead_letters:
+            session.execute(insert_ignore(session, DeadLetter), dead_letters)
+            dead_letters.clear()
+        values = {"sent": stats["sent"], "failed": stats["failed"]}
+        if checkpoint is not None:
+            values["checkpoint"] = checkpoint
+        session.execute(
+            update(MailingRun)
+            .where(MailingRun.run_id == stats["run_id"])
+            .values(**values)
+        )
+        status = session.execute(
+            select(MailingRun.status).where(MailingRun.run_id == stats["run_id"])
+        ).scalar_one()
+    rows.clear()
+    return status
+
+
+async def prepare_media(
+    api, mailing_id, media, caption, recipients, stats, log_rows, chat_updates=None
+):
+    """Загрузка медиа рассылки и подстановка file_id в media
+
+    Без MEDIA_UPLOAD_CHAT_ID файлы загружаются первому получателю, для него
+    рассылка на этом завершена. Возвращает оставшихся получателей.
+    """
+    if MEDIA_UPLOAD_CHAT_ID:
+        media[:], _ = await resolve_media(
+            api, media, int(MEDIA_UPLOAD_CHAT_ID), caption
+        )
+        return recipients
+
+    run_id = stats.get("run_id")
+    while recipients:
+        chat_id = recipients[0]
+        if not claim_chats(mailing_id, run_id, [chat_id]):
+            recipients = recipients[1:]
+            continue
+        try:
+            resolved, delivered = await resolve_media(api, media, chat_id, caption)
+        except (Forbidden, BadRequest) as e:
+            # Получатель недоступен - пробуем загрузить следующему
+            if chat_updates is not None:
+                chat_updates.record_error(chat_id, e)
+            stats["failed"] += 1
+            MESSAGES.inc(result="failed")
+            SEND_ERRORS.inc(error_class=error_class(e))
+            log_rows.append(
+                log_row(mailing_id, chat_id, "failed", e.description, run_id)
+            )
+            recipients = recipients[1:]
+            continue
+
+        media[:] = resolved
+        if not delivered:
+            # Все файлы нашлись в кэше - чат получит рассылку в общем порядке
+            release_chats(run_id, [chat_id])
+            return recipients
+        stats["sent"] += 1
+        MESSAGES.inc(result="success")
+        log_rows.append(log_row(mailing_id, chat_id, "success", run_id=run_id))
+        return recipients[1:]
+
+    return recipients
+
+
+class ActiveRunExists(Exception):
+    """У рассылки уже есть запуск в статусе running или paused"""
+
+
+def add_run(session, run) -> None:
+    """Добавление нового запуска
+
+    Уникальный частичный индекс ix_mailing_runs_active допускает один
+    активный запуск на рассылку, так что проверка и вставка атомарны.
+    """
+    session.add(run)
+    try:
+        session.flush()
+    except IntegrityError as e:
+        raise ActiveRunExists(run.mailing_id) from e
+
+
+def start_run(
+    mailing_id: int, run_id: int = None, retry_of: int = None, retry_classes=None
+):
+    """Создание или возобновление запуска рассылки
+
+    Новый запуск фиксирует аудиторию (snapshot_audience), повторный запуск
+    (retry_of) - получателей с временными ошибками исходного запуска,
+    продолжение идет по аудитории после checkpoint. Возвращает (параметры
+    рассылки, checkpoint, статистика запуска) или None, если рассылки нет,
+    запуск уже завершен или у рассылки уже есть другой активный запуск.
+    """
+    try:
+        with db_session() as session:
+            mailing = session.query(Mailing).filter_by(mailing_id=mailing_id).first()
+
+            if not mailing:
+                logger.error(f"Рассылка с ID {mailing_id} не найдена.")
+                return None
+
+            content = {
+                "text": mailing.message_text,
+                "media": [
+                    {
+                        "media_id": item.media_id,
+                        "media_type": item.media_type,
+                        "file_id": item.file_id,
+                        "file_path": item.file_path,
+                        "file_name": item.file_name,
+                    }
+                    for item in mailing.media
+                ],
+                "source": (mailing.source_chat_id, mailing.source_message_id),
+            }
+
+            if run_id is None and retry_of is not None:
+                parent = session.get(MailingRun, retry_of)
+                run = MailingRun(
+                    mailing_id=mailing_id,
+                    status="running",
+                    sent=0,
+                    failed=0,
+                    parent_run_id=retry_of,
+                    attempt=(parent.attempt or 0) + 1 if parent else 1,
+                )
+                add_run(session, run)
+                run.total = snapshot_retry_audience(
+                    session, retry_of, run.run_id, retry_classes
+                )
+            elif run_id is None:
+                run = MailingRun(
+                    mailing_id=mailing_id, status="running", sent=0, failed=0
+                )
+                add_run(session, run)
+                run.total = snapshot_audience(session, mailing, run.run_id)
+
+                # Запуск по расписанию сразу переносится на следующий раз,
+                # чтобы пауза или перезапуск бота не запустили его повторно
+                now = datetime.now()
+                if mailing.next_run_time and mailing.next_run_time <= now:
+                    SCHEDULER_LAG.observe((now - mailing.next_run_time).total_seconds())
+                    mailing.next_run_time = next_run_after(mailing, now)
+            else:
+                run = session.get(MailingRun, run_id)
+                if not run or run.status in FINAL_STATUSES:
+                    return None
+                run.status = "running"
+
+                # Чаты, захваченные прерванной отправкой, повторно не получают
+                # сообщение: оно могло уже дойти
+                unknown = session.execute(
+                    update(SendLog)
+                    .where(SendLog.run_id == run_id, SendLog.status == "pending")
+                    .values(status="unknown", error_message=UNKNOWN_RESULT)
+                ).rowcount
+                if unknown:
+                    run.failed = (run.failed or 0) + unknown
+
+            session.flush()
+            return content, run.checkpoint, run_stats(run)
+    except ActiveRunExists:
+        # Параллельный запуск (двойное нажатие, планировщик) уже создал свой
+        logger.warning(
+            f"Рассылка ID {mailing_id} уже выполняется, новый запуск не создан",
+            extra={"mailing_id": mailing_id},
+        )
+        return None
+
+
+async def deliver_mailing(
+    api,
+    mailing_id: int,
+    progress=None,
+    on_result=None,
+    run_id: int = None,
+    retry_of: int = None,
+    retry_classes=None,
+) -> dict:
+    """Отправка рассылки всем активным получателям через TelegramAPI
+
+    Получатели обрабатываются пакетами по RUN_BATCH_SIZE: после каждого
+    пакета результаты и точка возобновления сохраняются в MailingRun, а
+    статус запуска перечитывается - так работают пауза и отмена.
+    run_id - продолжить ранее приостановленный запуск.
+    retry_of - новый запуск только по получателям с временными ошибками
+    (таймауты, 5xx, долгий flood wait) запуска retry_of; retry_classes -
+    только получателей с этими классами ошибок (автоматический повтор).
+    progress - необязательная корутина progress(stats), вызывается
+    после каждого пакета; stats содержит run_id, status, total, sent, failed.
+    on_result - необязательная функция on_result(chat_id, status, enqueued_at)
+    для каждого результата отправки (enqueued_at по time.monotonic()).
+    """
+    started = start_run(mailing_id, run_id, retry_of, retry_classes)
+    if started is None:
+        return {"run_id": run_id, "status": None, "total": 0, "sent": 0, "failed": 0}
+
+    content, checkpoint, stats = started
+    message_text, media, source = content["text"], content["media"], content["source"]
+    run_id = stats["run_id"]
+    log_rows, dead_letters = [], []
+    chat_updates = ChatStatusBuffer()
+    logger.info(
+        f"Рассылка ID {mailing_id}, запуск {run_id}: получателей {stats['total']}, "
+        f"обработано {stats['sent'] + stats['failed']}",
+        extra={"mailing_id": mailing_id, "run_id": run_id},
+    )
+
+    # Получатели читаются из БД пакетами в ограниченную очередь:
+    # следующий пакет готовится, пока отправляется текущий
+    batches = asyncio.Queue(maxsize=RECIPIENT_PREFETCH)
+
+    async def produce():
+        try:
+            async for batch in iter_recipients(run_id, checkpoint):
+                await batches.put(batch)
+        except Exception as e:
+            # Ошибка чтения (например, БД) передается потребителю, иначе
+            # он вечно ждал бы следующего пакета
+            await batches.put(e)
+        else:
+            await batches.put(None)
+
+    async def next_batch():
+        batch = await batches.get()
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+    producer = asyncio.create_task(produce())
+    status, done = "running", True
+    ACTIVE_RUNS.inc()
+    try:
+        batch = await next_batch()
+
+        if media and not source[1]:
+            # Файлы загружаются один раз, дальше рассылка идет по file_id
+            while batch and not all(item.get("file_id") for item in media):
+                remaining = await prepare_media(
+                    api,
+                    mailing_id,
+                    media,
+                    message_text,
+                    batch,
+                    stats,
+                    log_rows,
+                    chat_updates,
+                )
+                consumed = len(batch) - len(remaining)
+                if consumed:
+                    save_progress(stats, batch[consumed - 1], log_rows, chat_updates)
+                batch = remaining or await next_batch()
+
+        if source[1]:
+            # Копия исходного сообщения: форматирование и медиа сохраняются,
+            # а тело запроса - несколько десятков байт на получателя
+            method = "copyMessage"
+            params = {"from_chat_id": source[0], "message_id": source[1]}
+        elif media:
+            method, params = media_request(media, message_text)
+        else:
+            method, params = "sendMessage", {"text": message_text}
+
+        if not (message_text or media or source[1]):
+            batch = None
+
+        # Тело запроса сериализуется один раз на всю рассылку
+        template = PayloadTemplate(method, params)
+        limiter = RateLimiter(DELIVERY_RATE)
+        queue = asyncio.Queue()
+        # Проверяется один раз: при уровне INFO цикл не создает записей вовсе
+        debug = logger.isEnabledFor(logging.DEBUG)
+
+        async def worker():
+            while True:
+                try:
+                    chat_id, enqueued_at = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                QUEUE_DEPTH.dec()
+
+                await limiter.acquire()
+                attempted.add(chat_id)
+                SENDS_IN_FLIGHT.inc()
+                sent_at = time.monotonic()
+                try:
+                    try:
+                        await api.send_prepared(template, chat_id)
+                    except ChatMigrated as e:
+                        # Группа стала супергруппой: отправляем по новому chat_id
+                        chat_updates.record_migration(chat_id, e.new_chat_id)
+                        await api.send_prepared(template, e.new_chat_id)
+                    status, error = "success", None
+                    stats["sent"] += 1
+                except TelegramAPIError as e:
+                    chat_updates.record_error(chat_id, e)
+                    if transient_class(e):
+                        dead_letters.append(dead_letter_row(run_id, chat_id, e))
+                    status, error = "failed", e.description
+                    stats["failed"] += 1
+                    SEND_ERRORS.inc(error_class=error_class(e))
+                finally:
+                    SENDS_IN_FLIGHT.dec()
+                MESSAGES.inc(result=status)
+                if debug:
+                    # Прореживается в shared.logging_setup.DebugSampler
+                    logger.debug(
+                        "Отправка",
+                        extra={
+                            "mailing_id": mailing_id,
+                            "run_id": run_id,
+                            "chat_id": chat_id,
+                            "status": status,
+                            "latency_ms": round((time.monotonic() - sent_at) * 1000, 1),
+                        },
+                    )
+
+                log_rows.append(log_row(mailing_id, chat_id, status, error, run_id))
+                if on_result:
+                    on_result(chat_id, status, enqueued_at)
+
+        while batch:
+            claimed = claim_chats(mailing_id, run_id, batch)
+            attempted = set()
+            enqueued_at = time.monotonic()
+            for chat_id in claimed:
+                queue.put_nowait((chat_id, enqueued_at))
+            QUEUE_DEPTH.inc(len(claimed))
+
+            workers = [
+                asyncio.create_task(worker())
+                for _ in range(min(DELIVERY_CONCURRENCY, len(claimed)))
+            ]
+            try:
+                await asyncio.gather(*workers)
+            except BaseException:
+                # Пакет прерван: результаты сохраняем, необработанные чаты
+                # освобождаем; запуск останется "running" и при следующем
+                # старте бота встанет на паузу
+                for task in workers:
+                    task.cancel()
+                QUEUE_DEPTH.dec(queue.qsize())
+                save_progress(stats, None, log_rows, chat_updates, dead_letters)
+                release_chats(run_id, set(claimed) - attempted)
+                raise
+
+            elapsed = time.monotonic() - enqueued_at
+            if claimed and elapsed > 0:
+                SEND_RATE.set(len(claimed) / elapsed)
+
+            status = save_progress(
+                stats, batch[-1], log_rows, chat_updates, dead_letters
+            )
+            batch = await next_batch()
+            if not batch:
+                break
+            if status != "running":
+                done = False
+                break
+            if progress:
+                await progress(dict(stats, status=status))
+    finally:
+        producer.cancel()
+        ACTIVE_RUNS.dec()
+
+    if done and status != "cancelled":
+        # Все получатели обработаны (пауза на последнем пакете не в счет)
+        set_run_status(run_id, "finished")
+        status = "finished"
+    stats["status"] = status
+
+    if progress:
+        await progress(dict(stats))
+
+    logger.info(
+        f"Рассылка ID {mailing_id}, запуск {run_id}: {status}, "
+        f"отправлено {stats['sent']}, ошибок {stats['failed']}",
+        extra={
+            "mailing_id": mailing_id,
+            "run_id": run_id,
+            "status": status,
+            "sent": stats["sent"],
+            "failed": stats["failed"],
+        },
+    )
+    return stats
+
+
+def due_retries(now: datetime) -> list:
+    """Завершенные запуски, по которым пора автоматически повторить неудачные
+
+    Повтор N-й попытки начинается через RETRY_DELAYS[N] после окончания
+    предыдущей; у рассылки не должно быть идущего или приостановленного
+    запуска. Учитываются только ошибки AUTO_RETRY_CLASSES: запускать их
+    повтор нужно с retry_classes=AUTO_RETRY_CLASSES. Возвращает
+    [(mailing_id, run_id)].
+    """
+    with db_session() as session:
+        candidates = (
+            session.query(MailingRun)
+            .filter(
+                MailingRun.status == "finished",
+                MailingRun.attempt < len(RETRY_DELAYS),
+                MailingRun.finished_at <= now - min(RETRY_DELAYS),
+                select(DeadLetter.chat_id)
+                .where(
+                    DeadLetter.run_id == MailingRun.run_id,
+                    DeadLetter.retry_run_id.is_(None),
+                    DeadLetter.error_class.in_(AUTO_RETRY_CLASSES),
+                )
+                .exists(),
+            )
+            .all()
+        )
+        busy = set(
+            session.execute(
+                select(MailingRun.mailing_id).where(
+                    MailingRun.status.in_(ACTIVE_STATUSES)
+                )
+            ).scalars()
+        )
+        due = {}
+        for run in candidates:
+            if run.mailing_id in busy or run.mailing_id in due:
+                continue
+            if run.finished_at <= now - RETRY_DELAYS[run.attempt or 0]:
+                due[run.mailing_id] = run.run_id
+        return list(due.items())
@@ -0,0 +1,53 @@
+"""Эндпоинты проверки состояния бота для оркестратора
+
+/healthz - процесс жив (всегда 200), /ready - бот готов принимать
+обновления (200 после запуска, до этого 503) и время запуска,
+/metrics - метрики в формате Prometheus, /stats - задержка обработки
+обновлений вебхука и время обработки кнопок. Порт не публикуется наружу.
+"""
+
+from aiohttp import web
+
+from shared import metrics
+
+
+def make_health_app(readiness, bot_data: dict = None) -> web.Application:
+    async def handle_health(request):
+        return web.json_response({"status": "ok"})
+
+    async def handle_ready(request):
+        return web.json_response(
+            readiness.status(), status=200 if readiness.ready else 503
+        )
+
+    async def handle_metrics(request):
+        return web.Response(
+            body=metrics.render().encode(),
+            headers={"Content-Type": metrics.CONTENT_TYPE},
+        )
+
+    async def handle_stats(request):
+        data = bot_data or {}
+        latency = data.get("update_latency")
+        stats = latency.percentiles() if latency else {}
+        router = data.get("callback_router")
+        if router:
+            stats["callbacks"] = router.summary()
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_get("/healthz", handle_health)
+    app.router.add_get("/ready", handle_ready)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/stats", handle_stats)
+    return app
+
+
+async def start_health_server(
+    readiness, host: str, port: int, bot_data: dict = None
+) -> web.AppRunner:
+    """Запуск сервера проверок; вызывающий освобождает его через cleanup()"""
+    runner = web.AppRunner(make_health_app(readiness, bot_data), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
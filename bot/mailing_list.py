@@ -0,0 +1,201 @@
+import time
+
+from sqlalchemy import func, select
+
+from shared.database import (
+    Chat,
+    DeadLetter,
+    Mailing,
+    MailingMedia,
+    MailingRun,
+    Segment,
+    SendLog,
+    mailing_recipients,
+)
+from bot.delivery import GROUP_TYPES
+
+# Рассылок на одной странице списка
+PAGE_SIZE = 5
+# Сколько секунд показывать закэшированное общее число рассылок
+COUNT_TTL = 30.0
+
+# Сколько секунд хранить отрисованное меню рассылки
+VIEW_TTL = 60.0
+
+# Фильтры списка: ключ (часть callback_data) -> подпись кнопки
+LIST_FILTERS = {
+    "all": "Все",
+    "scheduled": "⏰ Запланированные",
+    "recurring": "🔄 Повторяющиеся",
+    "mine": "👤 Мои",
+}
+
+
+def filter_clause(name: str, user_id: int):
+    """Условие фильтра; каждое покрыто индексом таблицы mailings"""
+    if name == "scheduled":
+        return Mailing.next_run_time.isnot(None)
+    if name == "recurring":
+        return Mailing.is_recurring.is_(True)
+    if name == "mine":
+        return Mailing.created_by == user_id
+    return None
+
+
+def fetch_page(
+    session,
+    filter_name: str = "all",
+    user_id: int = None,
+    direction: str = None,
+    cursor: int = None,
+    size: int = PAGE_SIZE,
+):
+    """Страница списка рассылок по ключу mailing_id (от новых к старым)
+
+    direction="next" - рассылки старше cursor, "prev" - новее cursor,
+    без курсора - первая страница. Возвращает (рассылки, есть_новее, есть_старше).
+    Берем на одну строку больше страницы, чтобы узнать, есть ли продолжение.
+    """
+    query = select(Mailing)
+    clause = filter_clause(filter_name, user_id)
+    if clause is not None:
+        query = query.where(clause)
+
+    if cursor is not None and direction == "prev":
+        rows = session.scalars(
+            query.where(Mailing.mailing_id > cursor)
+            .order_by(Mailing.mailing_id.asc())
+            .limit(size + 1)
+        ).all()
+        rows.reverse()
+        has_newer = len(rows) > size
+        return rows[-size:], has_newer, True
+
+    if cursor is not None:
+        query = query.where(Mailing.mailing_id < cursor)
+    rows = session.scalars(
+        query.order_by(Mailing.mailing_id.desc()).limit(size + 1)
+    ).all()
+    return rows[:size], cursor is not None, len(rows) > size
+
+
+class CountCache:
+    """Кэш числа рассылок по фильтрам с ограниченным временем жизни
+
+    Счетчик нужен только для подписи списка, поэтому точность в пределах
+    ttl секунд достаточна; бот сбрасывает кэш при создании рассылок.
+    """
+
+    def __init__(self, ttl: float = COUNT_TTL):
+        self.ttl = ttl
+        self.values = {}
+
+    def get(self, session, filter_name: str, user_id: int = None) -> int:
+        key = (filter_name, user_id if filter_name == "mine" else None)
+        cached = self.values.get(key)
+        now = time.monotonic()
+        if cached and now - cached[1] < self.ttl:
+            return cached[0]
+
+        query = select(func.count(Mailing.mailing_id))
+        clause = filter_clause(filter_name, user_id)
+        if clause is not None:
+            query = query.where(clause)
+        count = session.scalar(query)
+        self.values[key] = (count, now)
+        return count
+
+    def invalidate(self) -> None:
+        self.values.clear()
+
+
+mailing_counts = CountCache()
+
+
+def mailing_details(session, mailing_id: int):
+    """Рассылка и все счетчики ее меню за один запрос
+
+    Возвращает строку с полями Mailing, users, groups, segment_name,
+    successful, failed, media_count, media_type, run_id, run_status,
+    retry_count или None. Счетчики - коррелированные подзапросы, каждый
+    идет по индексу; у рассылки по сегменту - готовые счетчики сегмента.
+    """
+    recipients = (
+        select(func.count())
+        .select_from(mailing_recipients)
+        .join(Chat, Chat.chat_id == mailing_recipients.c.chat_id)
+        .where(mailing_recipients.c.mailing_id == Mailing.mailing_id)
+    )
+    segment = select(Segment).where(Segment.segment_id == Mailing.segment_id)
+    logs = select(func.count()).where(SendLog.mailing_id == Mailing.mailing_id)
+    media = select(MailingMedia).where(MailingMedia.mailing_id == Mailing.mailing_id)
+    latest = (
+        select(MailingRun)
+        .where(MailingRun.mailing_id == Mailing.mailing_id)
+        .order_by(MailingRun.run_id.desc())
+        .limit(1)
+    )
+    latest_run_id = (
+        latest.with_only_columns(MailingRun.run_id).correlate(Mailing).scalar_subquery()
+    )
+
+    query = select(
+        Mailing,
+        func.coalesce(
+            segment.with_only_columns(Segment.users).scalar_subquery(),
+            recipients.where(Chat.type == "private").scalar_subquery(),
+        ).label("users"),
+        func.coalesce(
+            segment.with_only_columns(Segment.groups).scalar_subquery(),
+            recipients.where(Chat.type.in_(GROUP_TYPES)).scalar_subquery(),
+        ).label("groups"),
+        segment.with_only_columns(Segment.name).scalar_subquery().label("segment_name"),
+        logs.where(SendLog.status == "success").scalar_subquery().label("successful"),
+        logs.where(SendLog.status == "failed").scalar_subquery().label("failed"),
+        media.with_only_columns(func.count()).scalar_subquery().label("media_count"),
+        media.with_only_columns(MailingMedia.media_type)
+        .order_by(MailingMedia.position)
+        .limit(1)
+        .scalar_subquery()
+        .label("media_type"),
+        latest_run_id.label("run_id"),
+        latest.with_only_columns(MailingRun.status)
+        .scalar_subquery()
+        .label("run_status"),
+        select(func.count())
+        .where(DeadLetter.run_id == latest_run_id, DeadLetter.retry_run_id.is_(None))
+        .scalar_subquery()
+        .label("retry_count"),
+    ).where(Mailing.mailing_id == mailing_id)
+    return session.execute(query).first()
+
+
+class RenderCache:
+    """Отрисованные экраны (текст и клавиатура) по ключу с временем жизни
+
+    Бот сбрасывает запись при изменении рассылки и после отправки; ttl
+    ограничивает устаревание из-за правок в других процессах (Mini App).
+    """
+
+    def __init__(self, ttl: float = VIEW_TTL):
+        self.ttl = ttl
+        self.values = {}
+
+    def get(self, key):
+        cached = self.values.get(key)
+        if cached and time.monotonic() - cached[1] < self.ttl:
+            return cached[0]
+        self.values.pop(key, None)
+        return None
+
+    def put(self, key, value) -> None:
+        self.values[key] = (value, time.monotonic())
+
+    def invalidate(self, key=None) -> None:
+        if key is None:
+            self.values.clear()
+        else:
+            self.values.pop(key, None)
+
+
+mailing_views = RenderCache()
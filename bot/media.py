@@ -0,0 +1,238 @@
+"""Медиа рассылок: file_id, загрузка локальных файлов и кэш по содержимому
+
+Файлы с диска добавляются в рассылку командой
+python -m bot.media MAILING_ID FILE [FILE ...]; при первом запуске они
+загружаются в Telegram один раз, полученный file_id сохраняется и в кэш
+по sha256, и в саму рассылку.
+"""
+
+import os
+import argparse
+import hashlib
+import logging
+import mimetypes
+
+from sqlalchemy import update
+
+from shared.database import MailingMedia, MediaFile, db_session
+
+logger = logging.getLogger(__name__)
+
+# Методы Bot API для отправки одиночного медиа
+MEDIA_METHODS = {
+    "photo": "sendPhoto",
+    "video": "sendVideo",
+    "document": "sendDocument",
+}
+
+# Ограничение Telegram на длину подписи к медиа
+CAPTION_LIMIT = 1024
+
+# Чат для первичной загрузки файлов (например, служебный чат админов).
+# Если не задан, файл загружается первому получателю рассылки.
+MEDIA_UPLOAD_CHAT_ID = os.environ.get("MEDIA_UPLOAD_CHAT_ID")
+
+
+def content_hash(path: str) -> str:
+    """sha256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_id_from_message(media_type: str, message: dict) -> str:
+    """file_id из сообщения, которое вернул Bot API после загрузки"""
+    if media_type == "photo":
+        # Последний элемент - самый большой размер фото
+        return message["photo"][-1]["file_id"]
+    return message[media_type]["file_id"]
+
+
+def media_from_message(message):
+    """Описание медиа из входящего сообщения python-telegram-bot или None"""
+    if message.photo:
+        return {"media_type": "photo", "file_id": message.photo[-1].file_id}
+    if message.video:
+        return {"media_type": "video", "file_id": message.video.file_id}
+    if message.document:
+        return {
+            "media_type": "document",
+            "file_id": message.document.file_id,
+            "file_name": message.document.file_name,
+        }
+    return None
+
+
+def is_copy_source(message) -> bool:
+    """Рассылать сообщение копией (copyMessage), а не текстом или по file_id
+
+    Копией уходят пересланные и отформатированные сообщения, а также типы,
+    которые не сводятся к тексту и фото/видео/документу (стикеры, голосовые,
+    опросы и т.п.). Альбомы собираются по file_id.
+    """
+    if message.media_group_id:
+        return False
+    if getattr(message, "forward_origin", None):
+        return True
+    if message.entities or message.caption_entities:
+        return True
+    return not (message.text or media_from_message(message))
+
+
+def media_request(media: list, caption: str = None):
+    """Метод и параметры (без chat_id) для отправки медиа по file_id"""
+    if len(media) == 1:
+        item = media[0]
+        params = {item["media_type"]: item["file_id"]}
+        if caption:
+            params["caption"] = caption
+        return MEDIA_METHODS[item["media_type"]], params
+
+    group = []
+    for i, item in enumerate(media):
+        entry = {"type": item["media_type"], "media": item["file_id"]}
+        if i == 0 and caption:
+            entry["caption"] = caption
+        group.append(entry)
+    return "sendMediaGroup", {"media": group}
+
+
+def media_type_for(path: str) -> str:
+    """Тип медиа по расширению файла: фото, видео или документ"""
+    mime, _ = mimetypes.guess_type(path)
+    if mime and mime.startswith("image/") and mime != "image/gif":
+        return "photo"
+    if mime and mime.startswith("video/"):
+        return "video"
+    return "document"
+
+
+def attach_files(mailing_id: int, paths: list) -> list:
+    """Добавление локальных файлов в рассылку; возвращает [(путь, тип)]"""
+    attached = []
+    with db_session() as session:
+        position = session.query(MailingMedia).filter_by(mailing_id=mailing_id).count()
+        for path in paths:
+            path = os.path.abspath(path)
+            if not os.path.isfile(path):
+                raise FileNotFoundError(path)
+            media_type = media_type_for(path)
+            session.add(
+                MailingMedia(
+                    mailing_id=mailing_id,
+                    position=position,
+                    media_type=media_type,
+                    file_path=path,
+                    file_name=os.path.basename(path),
+                )
+            )
+            attached.append((path, media_type))
+            position += 1
+    return attached
+
+
+def save_file_ids(items: list) -> None:
+    """file_id загруженных файлов в медиа рассылки: следующий запуск не читает файл"""
+    rows = [
+        {"media_id": item["media_id"], "file_id": item["file_id"]}
+        for item in items
+        if item.get("media_id")
+    ]
+    if rows:
+        with db_session() as session:
+            session.execute(update(MailingMedia), rows)
+
+
+def lookup_cached(hashes: list) -> dict:
+    """file_id из кэша для набора хэшей"""
+    if not hashes:
+        return {}
+    with db_session() as session:
+        rows = session.query(MediaFile).filter(MediaFile.content_hash.in_(hashes))
+        return {row.content_hash: row.file_id for row in rows}
+
+
+def store_cached(entries: list) -> None:
+    """Сохранение новых file_id в кэш: [(hash, media_type, file_id)]"""
+    with db_session() as session:
+        for digest, media_type, file_id in entries:
+            session.merge(
+                MediaFile(content_hash=digest, media_type=media_type, file_id=file_id)
+            )
+
+
+async def resolve_media(api, media: list, upload_chat_id: int, caption: str = None):
+    """Подготовка медиа к рассылке: file_id для каждого элемента
+
+    Элементы с file_id используются как есть. Локальные файлы ищутся в кэше
+    по хэшу содержимого, а отсутствующие загружаются один раз в upload_chat_id.
+    Возвращает (список медиа с file_id, True если сообщение уже доставлено
+    в upload_chat_id).
+    """
+    resolved = [dict(item) for item in media]
+    pending = [item for item in resolved if not item.get("file_id")]
+    if not pending:
+        return resolved, False
+
+    for item in pending:
+        item["content_hash"] = content_hash(item["file_path"])
+    cached = lookup_cached([item["content_hash"] for item in pending])
+    for item in pending:
+        item["file_id"] = cached.get(item["content_hash"])
+
+    to_upload = [item for item in pending if not item["file_id"]]
+    if not to_upload:
+        save_file_ids(pending)
+        return resolved, False
+
+    # Загружаем всю рассылку одним сообщением: файлы из кэша идут по file_id,
+    # новые - вложениями. Так upload_chat_id получает полноценную копию.
+    files = {}
+    for i, item in enumerate(to_upload):
+        name = f"file{i}"
+        filename = item.get("file_name") or os.path.basename(item["file_path"])
+        with open(item["file_path"], "rb") as f:
+            files[name] = (filename, f.read())
+        item["file_id"] = f"attach://{name}"
+        item["upload"] = True
+
+    method, params = media_request(resolved, caption)
+    params["chat_id"] = upload_chat_id
+    if len(resolved) == 1:
+        # attach:// работает только внутри InputMedia, одиночный файл
+        # передается в поле с именем типа медиа
+        media_type = resolved[0]["media_type"]
+        params.pop(media_type)
+        files = {media_type: files["file0"]}
+    result = await api.upload(method, params, files)
+
+    messages = result if isinstance(result, list) else [result]
+    new_entries = []
+    for item, message in zip(resolved, messages):
+        file_id = file_id_from_message(item["media_type"], message)
+        if item.pop("upload", False):
+            new_entries.append((item["content_hash"], item["media_type"], file_id))
+        item["file_id"] = file_id
+
+    store_cached(new_entries)
+    save_file_ids(pending)
+    logger.info(f"Загружено файлов: {len(new_entries)}, file_id сохранены в кэш")
+    return resolved, True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Добавление файлов с диска в медиарассылку"
+    )
+    parser.add_argument("mailing_id", type=int)
+    parser.add_argument("files", nargs="+")
+    args = parser.parse_args()
+
+    for path, media_type in attach_files(args.mailing_id, args.files):
+        print(f"{media_type}: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+from datetime import datetime
+
+from sqlalchemy import delete, select, tuple_
+from telegram.ext import BasePersistence, PersistenceInput
+
+from shared.database import PersistentState, db_session, upsert_insert
+
+logger = logging.getLogger(__name__)
+
+# Как часто Application передает измененные данные на запись (секунды)
+PERSISTENCE_INTERVAL = 5
+USER_DATA = "user_data"
+
+
+def encode_state(value) -> str:
+    """JSON состояния; datetime (например, время рассылки в черновике) - ISO-строкой"""
+
+    def default(obj):
+        if isinstance(obj, datetime):
+            return {"__datetime__": obj.isoformat()}
+        raise TypeError(f"Не удается сохранить значение типа {type(obj).__name__}")
+
+    return json.dumps(value, default=default, ensure_ascii=False)
+
+
+def decode_state(data: str):
+    def object_hook(obj):
+        if len(obj) == 1 and "__datetime__" in obj:
+            return datetime.fromisoformat(obj["__datetime__"])
+        return obj
+
+    return json.loads(data, object_hook=object_hook)
+
+
+def conversation_namespace(name: str) -> str:
+    return f"conversation:{name}"
+
+
+class DatabasePersistence(BasePersistence):
+    """Хранение user_data и состояний ConversationHandler в БД
+
+    Application раз в PERSISTENCE_INTERVAL передает измененные записи; все
+    записи одного цикла объединяются и пишутся одной пачкой (upsert/delete).
+    user_data пользователя читается из БД лениво - перед первым обновлением
+    от него после запуска, поэтому старт не зависит от числа админов.
+    bot_data и chat_data не сохраняются: там живут клиенты и буферы процесса.
+    """
+
+    def __init__(self, update_interval: float = PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        # (namespace, key) -> JSON-совместимое значение, None - удалить
+        self.dirty = {}
+        self.loaded_users = set()
+        self._batch = None
+        # Пачки пишутся строго по очереди: более поздняя не обгонит раннюю
+        self._save_lock = asyncio.Lock()
+
+    # Чтение
+
+    def load(self, namespace: str, key: str = None) -> dict:
+        """Записи пространства имен (или одна запись) в виде {key: значение}"""
+        query = select(PersistentState.key, PersistentState.data).where(
+            PersistentState.namespace == namespace
+        )
+        if key is not None:
+            query = query.where(PersistentState.key == key)
+        with db_session() as session:
+            rows = session.execute(query).all()
+        return {row.key: decode_state(row.data) for row in rows}
+
+    async def get_user_data(self) -> dict:
+        # Данные пользователей подгружаются по одному в refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if user_id in self.loaded_users:
+            return
+        stored = await asyncio.to_thread(self.load, USER_DATA, str(user_id))
+        self.loaded_users.add(user_id)
+        for name, value in stored.get(str(user_id), {}).items():
+            user_data.setdefault(name, value)
+
+    async def get_conversations(self, name: str) -> dict:
+        stored = await asyncio.to_thread(self.load, conversation_namespace(name))
+        return {tuple(json.loads(key)): state for key, state in stored.items()}
+
+    # Запись
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        await self.write(USER_DATA, str(user_id), data or None)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self.write(USER_DATA, str(user_id), None)
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        await self.write(conversation_namespace(name), json.dumps(list(key)), new_state)
+
+    async def write(self, namespace: str, key: str, value) -> None:
+        """Поставить запись в текущую пачку и дождаться ее сохранения
+
+        Application вызывает update_* для всех измененных записей через
+        asyncio.gather; задача пачки запускается после того, как все они
+        успели добавить свои записи.
+        """
+        self.dirty[(namespace, key)] = value
+        if self._batch is None:
+            self._batch = asyncio.create_task(self.write_batch())
+        await asyncio.shield(self._batch)
+
+    async def write_batch(self) -> None:
+        self._batch = None
+        async with self._save_lock:
+            # Изменения забираются только после записи предыдущей пачки
+            dirty, self.dirty = self.dirty, {}
+            if not dirty:
+                return
+            try:
+                await asyncio.to_thread(self.save, dirty)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения состояния бота: {e}")
+                # Повторим со следующей пачкой; более новые значения важнее
+                self.dirty = {**dirty, **self.dirty}
+
+    def save(self, entries: dict) -> None:
+        """Запись пачки изменений в одной транзакции"""
+        rows, removed = [], []
+        for (namespace, key), value in entries.items():
+            if value is None:
+                removed.append((namespace, key))
+                continue
+            try:
+                data = encode_state(value)
+            except TypeError as e:
+                logger.error(f"Состояние {namespace}/{key} не сохранено: {e}")
+                continue
+            rows.append(
+                {
+                    "namespace": namespace,
+                    "key": key,
+                    "data": data,
+                    "updated_at": datetime.now(),
+                }
+            )
+
+        with db_session() as session:
+            if rows:
+                stmt = upsert_insert(session, PersistentState)
+                session.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=["namespace", "key"],
+                        set_={
+                            "data": stmt.excluded.data,
+                            "updated_at": stmt.excluded.updated_at,
+                        },
+                    ),
+                    rows,
+                )
+            if removed:
+                session.execute(
+                    delete(PersistentState).where(
+                        tuple_(PersistentState.namespace, PersistentState.key).in_(
+                            removed
+                        )
+                    )
+                )
+
+    async def flush(self) -> None:
+        if self._batch is not None:
+            await self._batch
+        # Дожидается и уже начатой пачки, и записи оставшихся изменений
+        await self.write_batch()
+
+    # Не сохраняемые данные
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
@@ -0,0 +1,234 @@
+"""Профилирование пути доставки рассылок
+
+Прогон рассылки против встроенного фейкового Bot API (как в tools.benchmark)
+под сэмплирующим профилировщиком или cProfile. Результат - файл свернутых
+стеков (формат flamegraph.pl / speedscope / inferno) или, для cProfile,
+файл pstats (.prof) и отчет с самыми горячими функциями. Тот же SamplingProfiler использует команда бота
+/profile для замера работающего процесса.
+
+Запуск: python -m bot.profiling --chats 20000 --collapsed delivery.folded
+"""
+
+import argparse
+import asyncio
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+
+# Период сэмплирования стеков (секунды)
+SAMPLE_INTERVAL = 0.005
+# Сколько функций выводить в отчете
+TOP_FUNCTIONS = 25
+
+# Кадры, на которых поток простаивает: такие сэмплы фоновых потоков
+# (пул asyncio.to_thread, поток логов) не учитываются
+IDLE_FRAMES = {
+    "selectors.py:select",
+    "threading.py:wait",
+    "queue.py:get",
+    "thread.py:_worker",
+    "handlers.py:dequeue",
+}
+
+
+class SamplingProfiler:
+    """Сэмплирующий профилировщик потоков процесса
+
+    Отдельный поток раз в interval снимает стеки через sys._current_frames().
+    Главный поток (event loop) учитывается всегда, включая простой в select,
+    остальные - только когда заняты работой. Накладные расходы не зависят
+    от числа вызовов функций, поэтому подходит для живого процесса.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = (
+                f"{os.path.basename(code.co_filename)}:{code.co_name}"
+            )
+        return label
+
+    def sample(self) -> None:
+        main = threading.main_thread().ident
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.label(frame.f_code))
+                frame = frame.f_back
+            if thread_id != main and stack and stack[0] in IDLE_FRAMES:
+                continue
+            stack.append(names.get(thread_id, str(thread_id)))
+            stack.reverse()
+            self.stacks[";".join(stack)] += 1
+        self.samples += 1
+
+    def run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.run, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def collapsed(self) -> str:
+        """Свернутые стеки: "поток;внешняя;...;внутренняя число_сэмплов" """
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def top(self, limit: int = TOP_FUNCTIONS) -> list:
+        """[(функция, собственные сэмплы, сэмплы с вложенными вызовами)]"""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return [
+            (function, own[function], total[function])
+            for function, _ in own.most_common(limit)
+        ]
+
+    def report(self, limit: int = TOP_FUNCTIONS) -> str:
+        lines = [
+            f"Сэмплов: {self.samples}, период {self.interval * 1000:g} мс",
+            "",
+            f"{'свои':>8} {'всего':>8}  функция",
+        ]
+        samples = self.samples or 1
+        for function, own, total in self.top(limit):
+            lines.append(f"{own / samples:>8.1%} {total / samples:>8.1%}  {function}")
+        return "\n".join(lines) + "\n"
+
+
+def cprofile_report(profile: cProfile.Profile, limit: int = TOP_FUNCTIONS) -> str:
+    """Отчет cProfile: функции с наибольшим собственным и накопленным временем"""
+    output = io.StringIO()
+    stats = pstats.Stats(profile, stream=output).strip_dirs()
+    stats.sort_stats("tottime").print_stats(limit)
+    stats.sort_stats("cumulative").print_stats(limit)
+    return output.getvalue()
+
+
+async def profile_delivery(
+    mode: str = "sampling", interval: float = SAMPLE_INTERVAL, **options
+):
+    """Прогон рассылки tools.benchmark под профилировщиком
+
+    options - параметры run_benchmark (chats, database_url, latency, ...).
+    Возвращает (результат бенчмарка, SamplingProfiler или cProfile.Profile).
+    Подготовка базы попадает в профиль cProfile, но не в сэмплы: их
+    снимают только пока идет доставка.
+    """
+    # Бенчмарк и фейковый API нужны только здесь, боту они не нужны
+    from tools.benchmark import run_benchmark
+
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            result = await run_benchmark(**options)
+        finally:
+            profiler.disable()
+        return result, profiler
+
+    profiler = SamplingProfiler(interval)
+    with profiler:
+        result = await run_benchmark(**options)
+    return result, profiler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=("sampling", "cprofile"), default="sampling")
+    parser.add_argument("--interval", type=float, default=SAMPLE_INTERVAL)
+    parser.add_argument("--top", type=int, default=TOP_FUNCTIONS)
+    parser.add_argument(
+        "--collapsed",
+        help="файл свернутых стеков (sampling), по умолчанию delivery.folded",
+    )
+    parser.add_argument(
+        "--pstats",
+        help="файл статистики pstats (cprofile), по умолчанию delivery.prof",
+    )
+    parser.add_argument("--report", help="файл для отчета, по умолчанию stdout")
+    parser.add_argument("--chats", type=int, default=10000)
+    parser.add_argument("--database-url", help="по умолчанию временный SQLite")
+    parser.add_argument("--recipient-ratio", type=float, default=0.8)
+    parser.add_argument("--blocked-ratio", type=float, default=0.02)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args(argv)
+    # cProfile не хранит полных стеков, свернутые стеки из него не построить
+    if args.mode == "cprofile" and args.collapsed:
+        parser.error("--collapsed только для --mode sampling, для cprofile - --pstats")
+    if args.mode == "sampling" and args.pstats:
+        parser.error("--pstats только для --mode cprofile")
+
+    result, profiler = asyncio.run(
+        profile_delivery(
+            mode=args.mode,
+            interval=args.interval,
+            chats=args.chats,
+            database_url=args.database_url,
+            recipient_ratio=args.recipient_ratio,
+            blocked_ratio=args.blocked_ratio,
+            latency=args.latency,
+            jitter=args.jitter,
+            concurrency=args.concurrency,
+        )
+    )
+
+    if args.mode == "cprofile":
+        profiler.dump_stats(args.pstats or "delivery.prof")
+        report = cprofile_report(profiler, args.top)
+    else:
+        with open(args.collapsed or "delivery.folded", "w") as f:
+            f.write(profiler.collapsed())
+        report = profiler.report(args.top)
+
+    report = json.dumps(result, indent=2, ensure_ascii=False) + "\n\n" + report
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import time
+from collections import deque
+
+from telegram import Update
+from telegram.ext import BaseHandler
+
+from shared import tracing
+from shared.metrics import Counter, Histogram
+
+# Сколько последних замеров длительности хранить на одно действие
+DURATION_SAMPLES = 500
+
+CALLBACK_SECONDS = Histogram(
+    "bot_callback_duration_seconds",
+    "Длительность обработки нажатий кнопок по действиям",
+    ["action"],
+)
+CALLBACK_ERRORS = Counter(
+    "bot_callback_errors_total", "Ошибки обработки нажатий кнопок", ["action"]
+)
+
+
+def parse_callback_data(data: str) -> tuple:
+    """callback_data вида "действие:арг1:арг2" -> ("действие", ["арг1", "арг2"])"""
+    action, *args = data.split(":")
+    return action, args
+
+
+class ActionStats:
+    """Число вызовов, ошибок и длительность обработки одного действия"""
+
+    def __init__(self, size: int = DURATION_SAMPLES):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds: float, failed: bool = False) -> None:
+        self.count += 1
+        self.errors += failed
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def summary(self) -> dict:
+        values = sorted(self.samples)
+        p99 = values[min(len(values) - 1, int(0.99 * len(values)))] if values else 0
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total / self.count * 1000, 2) if self.count else 0,
+            "p99_ms": round(p99 * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+class CallbackRouter(BaseHandler):
+    """Обработчик нажатий inline-кнопок с выбором по словарю действий
+
+    callback_data разбирается один раз; действие (часть до первого ":")
+    ищется в словаре, остальные части передаются обработчику в context.args.
+    Нажатия с неизвестным действием пропускаются к следующим обработчикам.
+    Каждый вызов замеряется и учитывается в stats по действию.
+    """
+
+    def __init__(self, routes: dict = None):
+        # Обработчик выбирается в handle_update, общий callback не нужен
+        super().__init__(callback=None)
+        self.routes = dict(routes or {})
+        self.stats = {}
+
+    def add(self, action: str, callback) -> None:
+        self.routes[action] = callback
+
+    def check_update(self, update: object):
+        if not isinstance(update, Update) or not update.callback_query:
+            return None
+        data = update.callback_query.data
+        if not isinstance(data, str):
+            return None
+        action, args = parse_callback_data(data)
+        if action not in self.routes:
+            return None
+        return action, args
+
+    def collect_additional_context(self, context, update, application, check_result):
+        context.args = check_result[1]
+
+    async def handle_update(self, update, application, check_result, context):
+        self.collect_additional_context(context, update, application, check_result)
+        action = check_result[0]
+        stats = self.stats.get(action)
+        if stats is None:
+            stats = self.stats[action] = ActionStats()
+
+        started = time.perf_counter()
+        failed = True
+        try:
+            with tracing.span(f"callback.{action}"):
+                result = await self.routes[action](update, context)
+            failed = False
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            stats.record(elapsed, failed)
+            CALLBACK_SECONDS.observe(elapsed, action=action)
+            if failed:
+                CALLBACK_ERRORS.inc(action=action)
+
+    def summary(self) -> dict:
+        """Статистика по действиям, самые медленные (по p99) - первыми"""
+        items = [(action, stats.summary()) for action, stats in self.stats.items()]
+        items.sort(key=lambda item: item[1]["p99_ms"], reverse=True)
+        return dict(items)
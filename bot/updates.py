@@ -0,0 +1,105 @@
+import asyncio
+import time
+from contextlib import AsyncExitStack
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from telegram.request import HTTPXRequest
+
+from shared import tracing
+
+# Сколько обновлений может ждать своей очереди сверх выполняющихся
+PENDING_FACTOR = 16
+
+
+def update_keys(update) -> list:
+    """Ключи упорядочивания обновления: чат и пользователь
+
+    Обновления с общим ключом обрабатываются строго по очереди (диалоги
+    и user_data одного админа, события одного чата), остальные - параллельно.
+    Ключи отсортированы, поэтому блокировки всегда берутся в одном порядке.
+    """
+    keys = set()
+    if isinstance(update, Update):
+        if update.effective_chat:
+            keys.add(("chat", update.effective_chat.id))
+        if update.effective_user:
+            keys.add(("user", update.effective_user.id))
+    return sorted(keys)
+
+
+def describe_update(update) -> dict:
+    """Атрибуты спана обновления: тип, команда или действие кнопки"""
+    if not isinstance(update, Update):
+        return {"kind": type(update).__name__}
+    attributes = {"update_id": update.update_id}
+    if update.callback_query:
+        attributes["kind"] = "callback_query"
+        attributes["action"] = (update.callback_query.data or "").split(":")[0]
+    elif update.message:
+        attributes["kind"] = "message"
+        text = update.message.text or ""
+        if text.startswith("/"):
+            attributes["command"] = text.split()[0]
+    else:
+        attributes["kind"] = "other"
+    if update.effective_user:
+        attributes["user_id"] = update.effective_user.id
+    return attributes
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с очередностью внутри чата/пользователя
+
+    max_running - предел одновременно выполняющихся обработчиков (держит
+    число соединений к БД ниже размера пула). Ожидающие своей очереди
+    обновления слот не занимают; их общее число ограничено max_pending.
+    """
+
+    def __init__(self, max_running: int, max_pending: int = None):
+        super().__init__(max_pending or max_running * PENDING_FACTOR)
+        self.max_running = max_running
+        self._running = asyncio.Semaphore(max_running)
+        # ключ -> [блокировка, число обновлений, которые ее держат или ждут]
+        self._locks = {}
+
+    async def do_process_update(self, update, coroutine) -> None:
+        keys = update_keys(update)
+        entries = []
+        for key in keys:
+            entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+            entries.append(entry)
+
+        try:
+            attributes = describe_update(update) if tracing.enabled() else {}
+            with tracing.span("bot.update", **attributes) as span:
+                queued = time.perf_counter()
+                async with AsyncExitStack() as stack:
+                    for lock, _ in entries:
+                        await stack.enter_async_context(lock)
+                    async with self._running:
+                        # Время ожидания очереди чата/пользователя и свободного слота
+                        span.set(
+                            queued_ms=round((time.perf_counter() - queued) * 1000, 3)
+                        )
+                        await coroutine
+        finally:
+            for key, entry in zip(keys, entries):
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+class TracedRequest(HTTPXRequest):
+    """HTTP-клиент PTB, отмечающий каждый запрос к Bot API спаном трассировки"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        with tracing.span(f"telegram.{url.rsplit('/', 1)[-1]}"):
+            return await super().do_request(url, method, *args, **kwargs)
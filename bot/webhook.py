@@ -0,0 +1,148 @@
+"""Прием обновлений Telegram через вебхук (aiohttp)
+
+Режим включается переменной WEBHOOK_URL - публичным адресом, который
+регистрируется в Telegram (например, https://example.com/tg-webhook).
+Без нее бот работает через long polling. Запросы без верного secret token
+отклоняются всегда: если WEBHOOK_SECRET не задан, секрет генерируется при
+запуске и передается Telegram в setWebhook.
+"""
+
+import os
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+import signal
+import time
+from collections import deque
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/tg-webhook")
+
+# Заголовок, в котором Telegram передает secret_token из setWebhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Сколько последних замеров задержки хранить
+LATENCY_SAMPLES = 1000
+
+
+class UpdateLatency:
+    """Задержка от получения обновления вебхуком до начала его обработки"""
+
+    def __init__(self, size: int = LATENCY_SAMPLES):
+        self.received = {}
+        self.samples = deque(maxlen=size)
+
+    def received_now(self, update_id: int) -> None:
+        self.received[update_id] = time.monotonic()
+
+    def handled_now(self, update_id: int) -> None:
+        received = self.received.pop(update_id, None)
+        if received is not None:
+            self.samples.append(time.monotonic() - received)
+
+    def percentiles(self) -> dict:
+        values = sorted(self.samples)
+        if not values:
+            return {"count": 0, "p50_ms": None, "p99_ms": None}
+
+        def pick(q):
+            return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+
+        return {"count": len(values), "p50_ms": pick(0.5), "p99_ms": pick(0.99)}
+
+
+def make_webhook_app(
+    application, secret: str, path: str = WEBHOOK_PATH
+) -> web.Application:
+    """aiohttp-приложение, передающее обновления в очередь Application
+
+    Принимает только POST на path с заголовком secret token; статистика
+    задержек отдается сервером проверок (bot.health), а не здесь.
+    """
+    if not secret:
+        raise ValueError("Вебхук без secret token принимал бы поддельные обновления")
+    latency = application.bot_data.setdefault("update_latency", UpdateLatency())
+
+    async def handle_update(request):
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), secret.encode()):
+            logger.warning("Вебхук: запрос с неверным secret token отклонен")
+            return web.Response(status=403)
+
+        try:
+            data = await request.json(loads=json.loads)
+        except ValueError:
+            return web.Response(status=400)
+
+        update = Update.de_json(data, application.bot)
+        if update is None:
+            return web.Response(status=400)
+
+        latency.received_now(update.update_id)
+        await application.update_queue.put(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    return app
+
+
+async def track_latency(update: Update, context) -> None:
+    """Первый обработчик: фиксирует задержку до начала обработки"""
+    latency = context.application.bot_data.get("update_latency")
+    if latency:
+        latency.handled_now(update.update_id)
+
+
+async def run_webhook(application, post_init=None, post_shutdown=None) -> None:
+    """Запуск бота в режиме вебхука до сигнала остановки
+
+    post_init/post_shutdown вызываются так же, как в run_polling.
+    """
+    secret = WEBHOOK_SECRET
+    if not secret:
+        secret = secrets.token_urlsafe(32)
+        logger.info("WEBHOOK_SECRET не задан: secret token сгенерирован при запуске")
+    app = make_webhook_app(application, secret)
+    runner = web.AppRunner(app, access_log=None)
+
+    await application.initialize()
+    if post_init:
+        await post_init(application)
+
+    await application.bot.set_webhook(
+        WEBHOOK_URL,
+        secret_token=secret,
+        allowed_updates=Update.ALL_TYPES,
+    )
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    await application.start()
+    logger.info(
+        f"Вебхук слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, "
+        f"адрес для Telegram: {WEBHOOK_URL}"
+    )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await application.stop()
+        if post_shutdown:
+            await post_shutdown(application)
+        await application.shutdown()
@@ -8,16 +8,23 @@ from sqlalchemy import (
     Boolean,
     DateTime,
     ForeignKey,
+    Index,
+    LargeBinary,
     Table,
 )
 
 # Заменяем устаревший импорт на новый
 from sqlalchemy.orm import relationship, sessionmaker, declarative_base
 from sqlalchemy.sql import func, text
+import logging
 import os
 from contextlib import contextmanager
 from datetime import datetime
 
+from shared import metrics, tracing
+
+logger = logging.getLogger(__name__)
+
 # Создаем базовый класс моделей
 Base = declarative_base()
 
@@ -53,14 +60,19 @@ class Mailing(Base):
 
     mailing_id = Column(Integer, primary_key=True)
     message_text = Column(Text, nullable=True)
-    next_run_time = Column(DateTime, nullable=True)
-    is_recurring = Column(Boolean, default=False)
+    next_run_time = Column(DateTime, nullable=True, index=True)
+    is_recurring = Column(Boolean, default=False, index=True)
     recurrence_interval = Column(String(100), nullable=True)
     recurrence_days = Column(String(100), nullable=True)  # Новое поле для дней недели
     created_at = Column(DateTime, default=datetime.now)
-    created_by = Column(BigInteger)
+    created_by = Column(BigInteger, index=True)
     send_to_users = Column(Boolean, default=True)  # Отправлять пользователям
     send_to_groups = Column(Boolean, default=True)  # Отправлять в группы
+    # Рассылка копией сообщения (copyMessage) вместо текста
+    source_chat_id = Column(BigInteger, nullable=True)
+    source_message_id = Column(Integer, nullable=True)
+    # Сохраненный сегмент вместо списка получателей в mailing_recipients
+    segment_id = Column(Integer, ForeignKey("segments.segment_id"), nullable=True)
 
     # Отношение к получателям через таблицу связи
     recipients = relationship(
@@ -68,16 +80,96 @@ class Mailing(Base):
     )
     # Отношение к логам отправки
     send_logs = relationship("SendLog", back_populates="mailing")
+    # Запуски рассылки
+    runs = relationship("MailingRun", back_populates="mailing")
+    # Медиафайлы рассылки (фото, видео, документы; несколько - альбом)
+    media = relationship(
+        "MailingMedia",
+        back_populates="mailing",
+        order_by="MailingMedia.position",
+        cascade="all, delete-orphan",
+    )
+
+
+# Условие частичного индекса активных запусков (статусы running и paused)
+ACTIVE_RUN_CONDITION = "status IN ('running', 'paused')"
+
+
+class MailingRun(Base):
+    """Запуск рассылки: состояние, прогресс и точка возобновления"""
+
+    __tablename__ = "mailing_runs"
+    __table_args__ = (
+        # Не больше одного идущего или приостановленного запуска на рассылку
+        Index(
+            "ix_mailing_runs_active",
+            "mailing_id",
+            unique=True,
+            postgresql_where=text(ACTIVE_RUN_CONDITION),
+            sqlite_where=text(ACTIVE_RUN_CONDITION),
+        ),
+    )
+
+    run_id = Column(Integer, primary_key=True)
+    mailing_id = Column(Integer, ForeignKey("mailings.mailing_id"), index=True)
+    # 'running', 'paused', 'cancelled', 'finished'
+    status = Column(String(20), default="running", index=True)
+    # Последний обработанный chat_id (получатели идут по возрастанию chat_id)
+    checkpoint = Column(BigInteger, nullable=True)
+    total = Column(Integer, default=0)
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    started_at = Column(DateTime, default=datetime.now)
+    finished_at = Column(DateTime, nullable=True)
+    # Повторный запуск по неудачным получателям: исходный запуск и номер попытки
+    parent_run_id = Column(Integer, ForeignKey("mailing_runs.run_id"), nullable=True)
+    attempt = Column(Integer, default=0)
+
+    mailing = relationship("Mailing", back_populates="runs")
+
+
+class RunRecipient(Base):
+    """Зафиксированная аудитория запуска: получатели на момент старта"""
+
+    __tablename__ = "run_recipients"
+
+    run_id = Column(Integer, ForeignKey("mailing_runs.run_id"), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
+
+
+class DeadLetter(Base):
+    """Получатель запуска с временной ошибкой доставки (для повтора)"""
+
+    __tablename__ = "dead_letters"
+
+    run_id = Column(Integer, ForeignKey("mailing_runs.run_id"), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
+    # 'flood_wait', 'network' - повторяются автоматически; 'unknown' - запрос
+    # мог выполниться (таймаут, 5xx), повтор только вручную
+    error_class = Column(String(20))
+    error_message = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    # Запуск, в который получатель взят на повтор
+    retry_run_id = Column(Integer, ForeignKey("mailing_runs.run_id"), nullable=True)
 
 
 class SendLog(Base):
     __tablename__ = "send_logs"
+    __table_args__ = (
+        # Ключ идемпотентности: не больше одной отправки в чат за запуск
+        Index("ix_send_logs_run_chat", "run_id", "chat_id", unique=True),
+        # Счетчики отправок рассылки по статусам
+        Index("ix_send_logs_mailing_status", "mailing_id", "status"),
+    )
 
     log_id = Column(Integer, primary_key=True)
     mailing_id = Column(Integer, ForeignKey("mailings.mailing_id"))
+    run_id = Column(Integer, ForeignKey("mailing_runs.run_id"), nullable=True)
     chat_id = Column(BigInteger, ForeignKey("chats.chat_id"))
     send_time = Column(DateTime, default=datetime.now)
-    status = Column(String(20))  # 'success', 'failed'
+    # 'success', 'failed'; в рамках запуска также 'pending' (чат занят
+    # под отправку) и 'unknown' (отправка прервана, результат неизвестен)
+    status = Column(String(20))
     error_message = Column(Text, nullable=True)
 
     # Отношения
@@ -85,9 +177,82 @@ class SendLog(Base):
     chat = relationship("Chat", back_populates="send_logs")
 
 
+class MailingMedia(Base):
+    __tablename__ = "mailing_media"
+
+    media_id = Column(Integer, primary_key=True)
+    mailing_id = Column(Integer, ForeignKey("mailings.mailing_id"), index=True)
+    position = Column(Integer, default=0)  # Порядок в альбоме
+    media_type = Column(String(20))  # 'photo', 'video', 'document'
+    file_id = Column(String(255), nullable=True)  # file_id в Telegram
+    file_path = Column(Text, nullable=True)  # Локальный файл для загрузки
+    file_name = Column(String(255), nullable=True)
+
+    mailing = relationship("Mailing", back_populates="media")
+
+
+class MediaFile(Base):
+    """Кэш file_id загруженных файлов по хэшу содержимого"""
+
+    __tablename__ = "media_files"
+
+    content_hash = Column(String(64), primary_key=True)  # sha256
+    media_type = Column(String(20))
+    file_id = Column(String(255))
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class Segment(Base):
+    """Сохраненный сегмент получателей с заранее вычисленным составом
+
+    Состав хранится отсортированным массивом int64 (shared.segments.pack)
+    и обновляется при появлении и уходе чатов, а не при каждой рассылке.
+    """
+
+    __tablename__ = "segments"
+
+    segment_id = Column(Integer, primary_key=True)
+    name = Column(String(100), unique=True)
+    # JSON: {"type": "private"|"groups"}, {"chats": "base"} или
+    # {"op": "union"|"intersection"|"difference", "of": [segment_id, ...]}
+    definition = Column(Text)
+    base = Column(LargeBinary, nullable=True)  # Выбранные вручную чаты
+    members = Column(LargeBinary)  # Активные чаты сегмента
+    users = Column(Integer, default=0)
+    groups = Column(Integer, default=0)
+    created_by = Column(BigInteger, nullable=True)
+    updated_at = Column(DateTime, default=datetime.now)
+
+
+class SchemaVersion(Base):
+    """Версия схемы, до которой обновлена БД (одна строка)"""
+
+    __tablename__ = "schema_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer)
+    applied_at = Column(DateTime, default=datetime.now)
+
+
+class PersistentState(Base):
+    """Состояние бота между перезапусками: user_data и шаги диалогов"""
+
+    __tablename__ = "persistent_state"
+
+    # 'user_data' или 'conversation:<имя ConversationHandler>'
+    namespace = Column(String(100), primary_key=True)
+    key = Column(String(100), primary_key=True)  # ID пользователя / ключ диалога
+    data = Column(Text)  # JSON
+    updated_at = Column(DateTime, default=datetime.now)
+
+
 # Создание подключения к базе данных
 def get_database_url():
     """Получение URL базы данных из переменных окружения"""
+    # Полный URL (например, sqlite для тестов и бенчмарков) имеет приоритет
+    if os.environ.get("DATABASE_URL"):
+        return os.environ["DATABASE_URL"]
+
     user = os.environ.get("DB_USER")
     password = os.environ.get("DB_PASSWORD")
     host = os.environ.get("DB_HOST", "localhost")
@@ -158,36 +323,180 @@ def get_statistics_by_chat_type():
 
 # Создание движка и сессии
 engine = create_engine(get_database_url())
+metrics.instrument_engine(engine)
+tracing.instrument_engine(engine)
 SessionLocal = sessionmaker(bind=engine)
 
 
 @contextmanager
 def db_session():
-    """Контекстный менеджер для работы с сессией базы данных"""
-    session = SessionLocal()
-    try:
-        yield session
-        session.commit()
-    except Exception as e:
-        session.rollback()
-        raise e
-    finally:
-        session.close()
+    """Контекстный менеджер для работы с сессией базы данных
+
+    Сессия - отдельный спан трассировки: в нем видно число запросов и время в БД.
+    """
+    with tracing.span("db.session"):
+        session = SessionLocal()
+        try:
+            yield session
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+
+def upsert_insert(session, table):
+    """INSERT с поддержкой ON CONFLICT для диалекта текущего подключения"""
+    from sqlalchemy.dialects import postgresql, sqlite
+
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table)
+    if dialect == "sqlite":
+        return sqlite.insert(table)
+    raise NotImplementedError(f"ON CONFLICT: диалект {dialect} не поддерживается")
+
+
+def insert_ignore(session, table):
+    """INSERT, пропускающий строки с уже существующим уникальным ключом"""
+    return upsert_insert(session, table).on_conflict_do_nothing()
+
+
+# Колонки, добавленные в существующие таблицы: {таблица: {колонка: тип}}
+ADDED_COLUMNS = {
+    "mailings": {
+        "source_chat_id": "BIGINT",
+        "source_message_id": "INTEGER",
+        "segment_id": "INTEGER REFERENCES segments(segment_id)",
+    },
+    "send_logs": {
+        "run_id": "INTEGER REFERENCES mailing_runs(run_id)",
+    },
+    "mailing_runs": {
+        "parent_run_id": "INTEGER REFERENCES mailing_runs(run_id)",
+        "attempt": "INTEGER DEFAULT 0",
+    },
+}
+
+# Индексы, появившиеся после создания таблиц:
+# имя -> (таблица, колонки, unique[, условие частичного индекса])
+ADDED_INDEXES = {
+    "ix_send_logs_run_chat": ("send_logs", "run_id, chat_id", True),
+    # Фильтры списка рассылок и выборка запланированных
+    "ix_mailings_next_run_time": ("mailings", "next_run_time", False),
+    "ix_mailings_is_recurring": ("mailings", "is_recurring", False),
+    "ix_mailings_created_by": ("mailings", "created_by", False),
+    "ix_send_logs_mailing_status": ("send_logs", "mailing_id, status", False),
+    "ix_mailing_runs_active": (
+        "mailing_runs",
+        "mailing_id",
+        True,
+        ACTIVE_RUN_CONDITION,
+    ),
+}
+
+
+# Версия схемы БД. Увеличивать при любом изменении моделей, ADDED_COLUMNS
+# или ADDED_INDEXES: по ней запуск решает, нужна ли полная проверка структуры.
+SCHEMA_VERSION = 3
+
+
+def stored_schema_version():
+    """Версия схемы из БД одним запросом; None, если версия еще не записана
+
+    Ошибка подключения к БД не перехватывается.
+    """
+    from sqlalchemy.exc import DBAPIError
+
+    with engine.connect() as conn:
+        try:
+            return conn.execute(
+                text("SELECT version FROM schema_version WHERE id = 1")
+            ).scalar()
+        except DBAPIError:
+            return None
+
+
+def ensure_schema() -> bool:
+    """Быстрая проверка схемы при запуске
+
+    Если в БД записана текущая SCHEMA_VERSION, обходится одним запросом;
+    иначе создает таблицы, проверяет структуру и записывает версию.
+    Если хотя бы один шаг проверки не удался, версия не записывается,
+    и проверка повторится при следующем запуске.
+    Возвращает True, если понадобилось обновление.
+    """
+    if stored_schema_version() == SCHEMA_VERSION:
+        return False
+
+    if not create_tables():
+        logger.error("Структура БД обновлена не полностью, версия схемы не записана")
+        return True
+    with db_session() as session:
+        session.merge(
+            SchemaVersion(id=1, version=SCHEMA_VERSION, applied_at=datetime.now())
+        )
+    return True
 
 
 # Функция для создания всех таблиц
-def create_tables():
+def create_tables() -> bool:
     Base.metadata.create_all(engine)
     # Вызываем проверку структуры БД после создания таблиц
-    verify_database_structure()
+    return verify_database_structure()
+
 
+def verify_database_structure() -> bool:
+    """Проверяет и обновляет структуру базы данных при необходимости
 
-def verify_database_structure():
-    """Проверяет и обновляет структуру базы данных при необходимости"""
+    Ошибки отдельных шагов логируются, остальные шаги выполняются.
+    Возвращает True, только если все шаги прошли успешно.
+    """
     from sqlalchemy import inspect
     from sqlalchemy.exc import SQLAlchemyError
 
     inspector = inspect(engine)
+    ok = True
+
+    # Добавляем колонки, появившиеся в моделях после создания таблиц
+    for table_name, columns in ADDED_COLUMNS.items():
+        if table_name not in inspector.get_table_names():
+            continue
+        existing = {col["name"] for col in inspector.get_columns(table_name)}
+        for column_name, column_type in columns.items():
+            if column_name in existing:
+                continue
+            logger.info(f"Добавление колонки {column_name} в таблицу {table_name}...")
+            try:
+                with engine.connect() as conn:
+                    conn.execute(
+                        text(
+                            f"ALTER TABLE {table_name} "
+                            f"ADD COLUMN {column_name} {column_type}"
+                        )
+                    )
+                    conn.commit()
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при добавлении колонки {column_name}: {e}")
+                ok = False
+
+    for index_name, (table_name, columns, unique, *where) in ADDED_INDEXES.items():
+        if table_name not in inspector.get_table_names():
+            continue
+        try:
+            with engine.connect() as conn:
+                conn.execute(
+                    text(
+                        f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS "
+                        f"{index_name} ON {table_name} ({columns})"
+                        + (f" WHERE {where[0]}" if where else "")
+                    )
+                )
+                conn.commit()
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при создании индекса {index_name}: {e}")
+            ok = False
 
     # Проверяем таблицу send_logs
     if "send_logs" in inspector.get_table_names():
@@ -195,13 +504,13 @@ def verify_database_structure():
 
         # Проверяем наличие колонки mailing_id
         if "mailing_id" not in columns:
-            print(
+            logger.warning(
                 "Обнаружена проблема: отсутствует колонка mailing_id в таблице send_logs"
             )
 
             try:
                 # Создаем временную таблицу с правильной структурой
-                print("Создание временной таблицы...")
+                logger.info("Создание временной таблицы...")
                 with engine.connect() as conn:
                     # Создаем временную таблицу
                     conn.execute(
@@ -220,7 +529,7 @@ def verify_database_structure():
                     )
 
                     # Переносим существующие данные
-                    print("Перенос данных...")
+                    logger.info("Перенос данных...")
                     conn.execute(
                         text(
                             """
@@ -231,21 +540,25 @@ def verify_database_structure():
                     )
 
                     # Удаляем старую таблицу и переименовываем новую
-                    print("Обновление структуры таблицы...")
+                    logger.info("Обновление структуры таблицы...")
                     conn.execute(text("DROP TABLE send_logs"))
                     conn.execute(text("ALTER TABLE send_logs_temp RENAME TO send_logs"))
 
                     # Фиксируем изменения
                     conn.commit()
 
-                print("Структура таблицы send_logs успешно обновлена!")
+                logger.info("Структура таблицы send_logs успешно обновлена!")
 
             except SQLAlchemyError as e:
-                print(f"Ошибка при обновлении структуры таблицы: {e}")
-                print(
+                logger.error(f"Ошибка при обновлении структуры таблицы: {e}")
+                logger.error(
                     "Рекомендуется выполнить миграцию вручную или пересоздать базу данных."
                 )
+                ok = False
+
+    return ok
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     create_tables()
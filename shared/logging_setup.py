@@ -0,0 +1,136 @@
+"""Неблокирующее логирование: очередь в памяти и фоновый поток записи
+
+Обработчики и цикл рассылки только кладут запись в очередь; форматирование
+и вывод в stdout выполняет отдельный поток (QueueListener), поэтому запись
+лога не блокирует event loop. Формат по умолчанию - JSON по строке на запись;
+поля из extra (mailing_id, chat_id, run_id, latency_ms, ...) попадают в нее
+отдельными ключами. DEBUG-записи горячего пути прореживаются: из каждых
+LOG_DEBUG_SAMPLE записей одного места в коде в очередь попадает одна.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Из скольких DEBUG-записей одного места в коде выводить одну
+DEBUG_SAMPLE = 100
+
+# Атрибуты LogRecord; все остальные пришли из extra
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+    "taskName",
+}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога в одну строку JSON с полями из extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES:
+                data[name] = value
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DebugSampler(logging.Filter):
+    """Пропускает одну DEBUG-запись из rate для каждого места вызова
+
+    Записи INFO и выше проходят всегда. Пропущенной записи добавляется
+    поле sampled - сколько записей она представляет.
+    """
+
+    def __init__(self, rate: int = DEBUG_SAMPLE):
+        super().__init__()
+        self.rate = max(1, rate)
+        self.counters = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate == 1:
+            return True
+        site = (record.pathname, record.lineno)
+        seen = self.counters.get(site, 0)
+        self.counters[site] = seen + 1
+        if seen % self.rate:
+            return False
+        record.sampled = self.rate
+        return True
+
+
+class LogQueueHandler(QueueHandler):
+    """QueueHandler, оставляющий форматирование фоновому потоку
+
+    В вызывающем потоке подставляются только аргументы сообщения и текст
+    исключения (объект traceback нельзя безопасно передать дальше).
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(
+    level=None, log_format: str = None, debug_sample: int = None
+) -> QueueListener:
+    """Настройка корневого логгера; повторный вызов возвращает уже запущенный поток
+
+    Параметры по умолчанию берутся из LOG_LEVEL (INFO), LOG_FORMAT
+    (json или text) и LOG_DEBUG_SAMPLE.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    level = level or os.environ.get("LOG_LEVEL", "INFO").upper()
+    log_format = log_format or os.environ.get("LOG_FORMAT", "json")
+    if debug_sample is None:
+        debug_sample = int(os.environ.get("LOG_DEBUG_SAMPLE", DEBUG_SAMPLE))
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(
+        logging.Formatter(TEXT_FORMAT) if log_format == "text" else JsonFormatter()
+    )
+
+    records = queue.SimpleQueue()
+    handler = LogQueueHandler(records)
+    handler.addFilter(DebugSampler(debug_sample))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+
+    _listener = QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging() -> None:
+    """Вывод оставшихся в очереди записей и остановка фонового потока"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
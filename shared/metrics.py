@@ -0,0 +1,262 @@
+"""Метрики процесса в текстовом формате Prometheus (без внешних зависимостей)
+
+Метрики объявляются на уровне модулей, которые их обновляют, и попадают
+в общий реестр REGISTRY; render() отдает его содержимое для /metrics.
+Обновление метрик потокобезопасно: запросы к БД идут и из asyncio.to_thread.
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+
+from shared.readiness import readiness
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин гистограмм длительности (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+# Как часто замерять лаг event loop (секунды)
+LOOP_LAG_INTERVAL = 0.5
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in labels.items())
+    return "{" + pairs + "}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric) -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                lines.append(
+                    f"{metric.name}{suffix}{format_labels(labels)} {format_value(value)}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name}: ожидаются метки {self.labelnames}, получены {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple) -> dict:
+        return dict(zip(self.labelnames, key))
+
+
+class Counter(Metric):
+    """Монотонно растущий счетчик"""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield "", self._labels(key), value
+
+
+class Gauge(Metric):
+    """Текущее значение; без меток может вычисляться при чтении (set_function)"""
+
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function = None
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function) -> None:
+        self._function = function
+
+    def value(self, **labels) -> float:
+        if self._function is not None:
+            return self._function()
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        if self._function is not None:
+            yield "", {}, self._function()
+            return
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield "", self._labels(key), value
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам с суммой и числом наблюдений"""
+
+    type = "histogram"
+
+    def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замер длительности блока with"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = [
+                (key, list(counts), total, count)
+                for key, (counts, total, count) in self._values.items()
+            ]
+        for key, counts, total, count in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                yield "_bucket", dict(labels, le=format_value(bound)), cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, count
+
+
+def render(registry: Registry = REGISTRY) -> str:
+    return registry.render()
+
+
+# Общие метрики процесса
+
+TIME_TO_READY = Gauge(
+    "process_time_to_ready_seconds", "Время от старта процесса до готовности"
+)
+TIME_TO_READY.set_function(lambda: readiness.time_to_ready or 0)
+
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Насколько позже запланированного просыпается задача event loop",
+    buckets=DB_BUCKETS,
+)
+
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Длительность SQL-запросов", buckets=DB_BUCKETS
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Соединения пула БД, выданные в работу"
+)
+DB_POOL_SIZE = Gauge("db_pool_size", "Размер пула соединений БД")
+
+
+async def watch_event_loop(interval: float = LOOP_LAG_INTERVAL) -> None:
+    """Фоновая задача: замер лага event loop до отмены"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+
+
+def instrument_engine(engine) -> None:
+    """Длительность запросов и заполнение пула для SQLAlchemy engine"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def query_started(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def query_finished(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def query_failed(context):
+        stack = (
+            context.connection.info.get("query_started") if context.connection else None
+        )
+        if stack:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - stack.pop())
+
+    # У SingletonThreadPool (SQLite в памяти) size - атрибут, а не метод
+    pool = engine.pool
+    if callable(getattr(pool, "checkedout", None)):
+        DB_POOL_CHECKED_OUT.set_function(pool.checkedout)
+    if callable(getattr(pool, "size", None)):
+        DB_POOL_SIZE.set_function(pool.size)
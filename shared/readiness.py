@@ -0,0 +1,48 @@
+"""Готовность процесса к работе и время запуска (time-to-ready)
+
+Модуль легкий и импортируется точками входа первым, поэтому момент его
+импорта - практически момент старта процесса.
+"""
+
+import time
+
+PROCESS_STARTED = time.monotonic()
+
+
+class Readiness:
+    """Флаг готовности с замером времени от старта процесса"""
+
+    def __init__(self, started: float = PROCESS_STARTED):
+        self.started = started
+        self.ready_at = None
+        # Последняя ошибка подготовки (например, БД еще недоступна)
+        self.error = None
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+
+    @property
+    def time_to_ready(self) -> float:
+        if self.ready_at is None:
+            return None
+        return self.ready_at - self.started
+
+    def mark_ready(self) -> float:
+        """Отметить готовность; возвращает время запуска в секундах"""
+        if self.ready_at is None:
+            self.ready_at = time.monotonic()
+            self.error = None
+        return self.time_to_ready
+
+    def status(self) -> dict:
+        ttr = self.time_to_ready
+        return {
+            "ready": self.ready,
+            "time_to_ready_seconds": round(ttr, 3) if ttr is not None else None,
+            "uptime_seconds": round(time.monotonic() - self.started, 3),
+            "error": self.error,
+        }
+
+
+readiness = Readiness()
@@ -0,0 +1,305 @@
+"""Сегменты получателей: именованные наборы чатов и операции над ними
+
+Сегмент задается правилом (все пользователи / все группы), выбранными
+вручную чатами или операцией над другими сегментами (объединение,
+пересечение, разность). Состав - активные чаты сегмента - хранится
+отсортированным массивом int64 и пересчитывается точечно, когда чаты
+появляются или уходят (apply_chat_changes), поэтому рассылке по сегменту
+не нужны десятки тысяч строк в mailing_recipients.
+"""
+
+import json
+import sys
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+
+from sqlalchemy import select
+
+from shared.database import Chat, Mailing, Segment
+
+# Типы чатов для сегментов-правил
+CHAT_TYPES = {
+    "private": ("private",),
+    "groups": ("group", "supergroup", "channel"),
+}
+OPERATIONS = ("union", "intersection", "difference")
+
+
+class SegmentError(ValueError):
+    """Некорректное описание сегмента или операция с ним"""
+
+
+def pack(chat_ids) -> bytes:
+    """Отсортированные chat_id -> байты (int64, little-endian)"""
+    values = array("q", chat_ids)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def unpack(data: bytes) -> array:
+    values = array("q")
+    values.frombytes(data or b"")
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def contains(values: array, chat_id: int) -> bool:
+    index = bisect_left(values, chat_id)
+    return index < len(values) and values[index] == chat_id
+
+
+def combine(op: str, operands: list) -> set:
+    """Операция над множествами chat_id"""
+    sets = [set(values) for values in operands]
+    if op == "union":
+        return set().union(*sets)
+    if op == "intersection":
+        return set.intersection(*sets) if sets else set()
+    return sets[0].difference(*sets[1:]) if sets else set()
+
+
+def is_group(chat_type: str) -> bool:
+    return chat_type in CHAT_TYPES["groups"]
+
+
+class SegmentState:
+    """Состав сегмента в памяти на время пересчета"""
+
+    def __init__(self, segment: Segment):
+        self.segment = segment
+        self.definition = json.loads(segment.definition)
+        self.base = unpack(segment.base) if segment.base is not None else None
+        self.members = unpack(segment.members)
+        self.changed = False
+
+    def should_contain(self, chat_id: int, chat_type: str, states: dict) -> bool:
+        """Должен ли активный чат входить в сегмент"""
+        definition = self.definition
+        if "type" in definition:
+            return chat_type in CHAT_TYPES[definition["type"]]
+        if "op" in definition:
+            inside = [contains(states[i].members, chat_id) for i in definition["of"]]
+            if definition["op"] == "union":
+                return any(inside)
+            if definition["op"] == "intersection":
+                return all(inside)
+            return inside[0] and not any(inside[1:])
+        return contains(self.base, chat_id)
+
+    def update(self, chat_id: int, chat_type: str, member: bool) -> None:
+        index = bisect_left(self.members, chat_id)
+        present = index < len(self.members) and self.members[index] == chat_id
+        if present == member:
+            return
+        if member:
+            self.members.insert(index, chat_id)
+        else:
+            del self.members[index]
+        delta = 1 if member else -1
+        if is_group(chat_type):
+            self.segment.groups += delta
+        else:
+            self.segment.users += delta
+        self.changed = True
+
+    def save(self) -> None:
+        if self.changed:
+            self.segment.members = pack(self.members)
+            self.segment.updated_at = datetime.now()
+
+
+def validate_definition(session, definition: dict) -> dict:
+    """Проверка описания сегмента; возвращает нормализованное описание"""
+    if "type" in definition:
+        if definition["type"] not in CHAT_TYPES:
+            raise SegmentError(f"Неизвестный тип чатов: {definition['type']}")
+        return {"type": definition["type"]}
+    if "op" in definition:
+        if definition["op"] not in OPERATIONS:
+            raise SegmentError(f"Неизвестная операция: {definition['op']}")
+        operands = [int(segment_id) for segment_id in definition.get("of", [])]
+        if len(operands) < 2:
+            raise SegmentError("Операции нужны хотя бы два сегмента")
+        found = set(
+            session.scalars(
+                select(Segment.segment_id).where(Segment.segment_id.in_(operands))
+            )
+        )
+        missing = set(operands) - found
+        if missing:
+            raise SegmentError(f"Сегменты не найдены: {sorted(missing)}")
+        return {"op": definition["op"], "of": operands}
+    return {"chats": "base"}
+
+
+def active_chats(session) -> dict:
+    """chat_id -> тип для всех активных чатов"""
+    return dict(
+        session.execute(
+            select(Chat.chat_id, Chat.type).where(Chat.status == "active")
+        ).all()
+    )
+
+
+def materialize(session, segment: Segment, active: dict = None) -> None:
+    """Полный пересчет состава сегмента (при создании)"""
+    active = active_chats(session) if active is None else active
+    definition = json.loads(segment.definition)
+    if "type" in definition:
+        types = CHAT_TYPES[definition["type"]]
+        members = [chat_id for chat_id, type_ in active.items() if type_ in types]
+    elif "op" in definition:
+        operands = {
+            row.segment_id: unpack(row.members)
+            for row in session.execute(
+                select(Segment.segment_id, Segment.members).where(
+                    Segment.segment_id.in_(definition["of"])
+                )
+            )
+        }
+        combined = combine(definition["op"], [operands[i] for i in definition["of"]])
+        members = [chat_id for chat_id in combined if chat_id in active]
+    else:
+        members = [chat_id for chat_id in unpack(segment.base) if chat_id in active]
+
+    members = sorted(members)
+    segment.members = pack(members)
+    segment.groups = sum(is_group(active[chat_id]) for chat_id in members)
+    segment.users = len(members) - segment.groups
+    segment.updated_at = datetime.now()
+
+
+def create_segment(
+    session, name: str, definition: dict, chats=None, created_by: int = None
+) -> Segment:
+    """Новый сегмент с вычисленным составом
+
+    chats - выбранные вручную chat_id (для сегмента без правила и операции).
+    """
+    definition = validate_definition(session, definition)
+    if session.scalar(select(Segment.segment_id).where(Segment.name == name)):
+        raise SegmentError(f"Сегмент «{name}» уже существует")
+
+    segment = Segment(
+        name=name,
+        definition=json.dumps(definition),
+        base=(
+            pack(sorted({int(chat_id) for chat_id in chats or ()}))
+            if "chats" in definition
+            else None
+        ),
+        users=0,
+        groups=0,
+        created_by=created_by,
+    )
+    materialize(session, segment)
+    session.add(segment)
+    session.flush()
+    return segment
+
+
+def segment_usage(session, segment_id: int) -> list:
+    """Что ссылается на сегмент: ["mailing:ID", "segment:ID", ...]"""
+    usage = [
+        f"mailing:{mailing_id}"
+        for mailing_id in session.scalars(
+            select(Mailing.mailing_id).where(Mailing.segment_id == segment_id)
+        )
+    ]
+    for row in session.execute(select(Segment.segment_id, Segment.definition)):
+        if segment_id in json.loads(row.definition).get("of", ()):
+            usage.append(f"segment:{row.segment_id}")
+    return usage
+
+
+def delete_segment(session, segment_id: int) -> None:
+    usage = segment_usage(session, segment_id)
+    if usage:
+        raise SegmentError(f"Сегмент используется: {', '.join(usage)}")
+    segment = session.get(Segment, segment_id)
+    if segment is not None:
+        session.delete(segment)
+
+
+def affected_segments(session, changes: dict, renamed: dict = None) -> tuple:
+    """Сегменты, состав которых могут изменить changes и renamed
+
+    Читает только описания и выбранные вручную чаты, без составов, и
+    блокирует строки сегментов до конца транзакции (SELECT ... FOR UPDATE):
+    реестр чатов и рассылки пересчитывают составы из разных потоков и не
+    должны затирать изменения друг друга. Правило затрагивают только чаты
+    его типов, выбранные чаты - только входящие в них, операцию - только
+    затронутые операнды. Возвращает (затронутые segment_id, segment_id для
+    загрузки: затронутые и операнды затронутых операций).
+    """
+    types = {chat_type for chat_type, _ in changes.values()}
+    touched = set(changes) | set(renamed or ())
+    affected, operands = set(), set()
+    rows = session.execute(
+        select(Segment.segment_id, Segment.definition, Segment.base)
+        .order_by(Segment.segment_id)
+        .with_for_update()
+    )
+    for segment_id, definition, base in rows:
+        definition = json.loads(definition)
+        if "type" in definition:
+            hit = not types.isdisjoint(CHAT_TYPES[definition["type"]])
+        elif "op" in definition:
+            hit = not affected.isdisjoint(definition["of"])
+            if hit:
+                operands.update(definition["of"])
+        else:
+            values = unpack(base)
+            hit = any(contains(values, chat_id) for chat_id in touched)
+        if hit:
+            affected.add(segment_id)
+    return affected, affected | operands
+
+
+def apply_chat_changes(session, changes: dict, renamed: dict = None) -> int:
+    """Точечное обновление составов после появления и ухода чатов
+
+    changes - {chat_id: (тип, активен ли)} только для чатов, чья активность
+    изменилась; renamed - {старый chat_id: новый} для групп, ставших
+    супергруппами (меняется и список выбранных вручную чатов).
+    Загружаются только сегменты, которые эти изменения могут затронуть
+    (affected_segments), и операнды затронутых операций.
+    Сегменты обходятся по возрастанию segment_id: операнды операции
+    всегда созданы раньше нее. Возвращает число измененных сегментов.
+    """
+    if not changes and not renamed:
+        return 0
+    changes = changes or {}
+    affected, needed = affected_segments(session, changes, renamed)
+    if not affected:
+        return 0
+
+    states = {}
+    for segment in session.scalars(
+        select(Segment)
+        .where(Segment.segment_id.in_(needed))
+        .order_by(Segment.segment_id)
+    ):
+        state = states[segment.segment_id] = SegmentState(segment)
+        # Незатронутый операнд нужен только ради своего состава
+        if segment.segment_id not in affected:
+            continue
+        if renamed and state.base is not None:
+            moved = [old for old in renamed if contains(state.base, old)]
+            if moved:
+                base = (set(state.base) - set(moved)) | {renamed[o] for o in moved}
+                state.base = array("q", sorted(base))
+                segment.base = pack(state.base)
+
+        for chat_id, (chat_type, active) in changes.items():
+            member = active and state.should_contain(chat_id, chat_type, states)
+            state.update(chat_id, chat_type, member)
+
+    changed = 0
+    for state in states.values():
+        state.save()
+        changed += state.changed
+    return changed
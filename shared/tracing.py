@@ -0,0 +1,179 @@
+"""Локальная трассировка: вложенные спаны с выгрузкой в JSONL-файл
+
+Спан - именованный замер участка (обработка обновления, сессия БД, запрос
+к Bot API) с атрибутами и ссылкой на родителя. Текущий спан хранится в
+contextvars, поэтому связи сохраняются в задачах asyncio и в asyncio.to_thread.
+Пока экспортер не настроен (configure), span() почти ничего не стоит.
+
+Каждая строка файла - один завершенный спан; спаны одного обновления
+объединяет trace_id. Для спанов отмечается число SQL-запросов, время в БД
+и самый часто повторенный запрос - так видны N+1 и медленные пути.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Длина текста SQL-запроса в атрибутах спана
+STATEMENT_PREVIEW = 200
+
+_current = ContextVar("current_span", default=None)
+exporter = None
+
+
+class Span:
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start",
+        "started",
+        "duration",
+        "attributes",
+        "error",
+        "statements",
+        "db_time",
+    )
+
+    def __init__(self, name: str, parent=None, **attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.attributes = attributes
+        self.error = None
+        # Запросы, выполненные непосредственно в этом спане: текст -> число
+        self.statements = None
+        self.db_time = 0.0
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def record_statement(self, statement: str, seconds: float) -> None:
+        if self.statements is None:
+            self.statements = Counter()
+        self.statements[statement] += 1
+        self.db_time += seconds
+
+    def to_dict(self) -> dict:
+        data = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration_ms": round(self.duration * 1000, 3),
+        }
+        if self.statements:
+            statement, repeats = self.statements.most_common(1)[0]
+            data["db"] = {
+                "statements": sum(self.statements.values()),
+                "time_ms": round(self.db_time * 1000, 3),
+            }
+            if repeats > 1:
+                data["db"]["repeated"] = {
+                    "count": repeats,
+                    "statement": statement[:STATEMENT_PREVIEW],
+                }
+        if self.attributes:
+            data["attributes"] = self.attributes
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+class NoopSpan:
+    """Заглушка, которую span() отдает при выключенной трассировке"""
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class JsonlExporter:
+    """Запись завершенных спанов построчно в файл
+
+    Строки буферизуются и сбрасываются на диск по завершении корневого
+    спана, так что трасса одного обновления пишется одной порцией.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            if span.parent_id is None:
+                self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def configure(path: str = None) -> None:
+    """Включить запись трасс в файл path (None - выключить)"""
+    global exporter
+    if exporter is not None:
+        exporter.close()
+    exporter = JsonlExporter(path) if path else None
+
+
+def enabled() -> bool:
+    return exporter is not None
+
+
+def current_span():
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Спан вокруг блока with; исключение отмечается в спане и пробрасывается"""
+    if exporter is None:
+        yield NOOP_SPAN
+        return
+
+    current = Span(name, _current.get(), **attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        current.duration = time.perf_counter() - current.started
+        # Экспортер могли выключить, пока спан выполнялся
+        if exporter is not None:
+            exporter.export(current)
+
+
+def instrument_engine(engine) -> None:
+    """Учет SQL-запросов engine в текущем спане"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def query_started(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info["trace_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def query_finished(conn, cursor, statement, parameters, context, executemany):
+        current = _current.get()
+        started = conn.info.pop("trace_started", None)
+        if current is not None and started is not None:
+            current.record_statement(statement, time.perf_counter() - started)
@@ -1,35 +1,327 @@
-import aiohttp
+import os
+import asyncio
 import json
 import logging
 
+import aiohttp
+
+from shared import tracing
+from shared.metrics import Counter, Histogram
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson необязателен
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+# Метрики запросов к Bot API
+THROTTLED = Counter(
+    "telegram_throttled_total", "Ответы 429 (flood wait) от Bot API", ["method"]
+)
+RETRIES = Counter(
+    "telegram_retries_total", "Повторы запросов к Bot API", ["method", "reason"]
+)
+REQUEST_SECONDS = Histogram(
+    "telegram_request_duration_seconds", "Длительность запросов к Bot API", ["method"]
+)
+
+
+# Быстрая сериализация JSON: orjson, если установлен, иначе стандартный json
+if orjson is not None:
+
+    def json_dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+    json_loads = orjson.loads
+else:
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+    json_loads = json.loads
+
+
+# Таймауты по методам (секунды). Загрузка медиа занимает заметно больше времени
+DEFAULT_TIMEOUT = 10
+METHOD_TIMEOUTS = {
+    "sendPhoto": 60,
+    "sendVideo": 120,
+    "sendDocument": 120,
+    "sendMediaGroup": 120,
+}
+
+DEFAULT_API_URL = "https://api.telegram.org"
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Запас к long polling таймауту getUpdates
+GET_UPDATES_TIMEOUT_MARGIN = 10
+
+# Методы, повтор которых после таймаута или 5xx может создать дубль сообщения
+NON_IDEMPOTENT_PREFIXES = ("send", "copy", "forward")
+
+
+def is_idempotent(method: str) -> bool:
+    """Можно ли повторить метод, если первая попытка могла выполниться"""
+    return not method.startswith(NON_IDEMPOTENT_PREFIXES)
+
+
+def get_api_url() -> str:
+    """Адрес Bot API из переменной окружения TELEGRAM_API_URL"""
+    return os.environ.get("TELEGRAM_API_URL") or DEFAULT_API_URL
+
+
+class PayloadTemplate:
+    """Тело запроса, сериализованное один раз для всех получателей
+
+    Общая часть (текст, parse_mode, клавиатура) кодируется в JSON заранее,
+    на каждого получателя остается только подставить chat_id.
+    """
+
+    __slots__ = ("method", "_prefix", "_suffix")
+
+    def __init__(self, method: str, params: dict):
+        self.method = method
+        rest = json_dumps({k: v for k, v in params.items() if k != "chat_id"})
+        self._prefix = b'{"chat_id":'
+        # rest начинается с "{" - заменяем ее на разделитель после chat_id
+        self._suffix = b"," + rest[1:] if len(rest) > 2 else b"}"
+
+    def render(self, chat_id: int) -> bytes:
+        return b"%s%d%s" % (self._prefix, chat_id, self._suffix)
+
+
+class TelegramAPIError(Exception):
+    """Ошибка, возвращенная Telegram Bot API"""
+
+    def __init__(self, description: str, error_code: int = None, parameters=None):
+        super().__init__(description)
+        self.description = description
+        self.error_code = error_code
+        self.parameters = parameters or {}
+
+
+class BadRequest(TelegramAPIError):
+    """Некорректный запрос (400)"""
+
+
+class Forbidden(TelegramAPIError):
+    """Бот заблокирован, удален из чата или не имеет прав (403)"""
+
+
+class ChatMigrated(BadRequest):
+    """Группа преобразована в супергруппу с новым chat_id"""
+
+    def __init__(self, description: str, new_chat_id: int, **kwargs):
+        super().__init__(description, **kwargs)
+        self.new_chat_id = new_chat_id
+
+
+class RetryAfter(TelegramAPIError):
+    """Превышен лимит запросов (429), повторить через retry_after секунд"""
+
+    def __init__(self, description: str, retry_after: float, **kwargs):
+        super().__init__(description, **kwargs)
+        self.retry_after = retry_after
+
+
+class NetworkError(TelegramAPIError):
+    """Временная ошибка: таймаут, обрыв соединения или 5xx от сервера
+
+    maybe_sent - запрос мог дойти до Telegram и выполниться (таймаут, обрыв
+    после отправки, 5xx). False только если соединение не установилось.
+    """
+
+    def __init__(self, description: str, maybe_sent: bool = True, **kwargs):
+        super().__init__(description, **kwargs)
+        self.maybe_sent = maybe_sent
+
+
+def parse_error(status: int, data: dict) -> TelegramAPIError:
+    """Преобразование ответа с ошибкой в типизированное исключение"""
+    description = data.get("description") or f"HTTP {status}"
+    error_code = data.get("error_code", status)
+    parameters = data.get("parameters") or {}
+    kwargs = {"error_code": error_code, "parameters": parameters}
+
+    if "retry_after" in parameters:
+        return RetryAfter(description, parameters["retry_after"], **kwargs)
+    if "migrate_to_chat_id" in parameters:
+        return ChatMigrated(description, parameters["migrate_to_chat_id"], **kwargs)
+    if error_code == 403:
+        return Forbidden(description, **kwargs)
+    if error_code == 400:
+        return BadRequest(description, **kwargs)
+    if error_code >= 500:
+        return NetworkError(description, **kwargs)
+    return TelegramAPIError(description, **kwargs)
+
 
 class TelegramAPI:
-    def __init__(self, token: str):
+    """Легковесный клиент Bot API для горячего пути рассылки"""
+
+    def __init__(
+        self,
+        token: str,
+        api_url: str = None,
+        pool_size: int = 100,
+        keepalive_timeout: float = 30,
+        dns_cache_ttl: int = 300,
+        max_retries: int = 3,
+        retry_after_limit: float = 30,
+        backoff: float = 0.5,
+    ):
         self.token = token
-        self.base_url = f"https://api.telegram.org/bot{self.token}"
+        # Адрес Bot API можно переопределить, например для локального сервера
+        self.api_url = (api_url or get_api_url()).rstrip("/")
+        self.base_url = f"{self.api_url}/bot{self.token}"
         self.session = None
 
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        # Количество повторов для временных ошибок и 429
+        self.max_retries = max_retries
+        # Максимальное ожидание по retry_after, дольше - ошибка уходит наверх
+        self.retry_after_limit = retry_after_limit
+        self.backoff = backoff
+
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
+        await self.open()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.session.close()
+        await self.close()
 
-    async def _make_request(self, method: str, params: dict = None):
+    async def open(self):
+        """Создание HTTP-сессии с пулом keep-alive соединений"""
+        if self.session is not None and not self.session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            limit_per_host=self.pool_size,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True,
+        )
+        self.session = aiohttp.ClientSession(connector=connector)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _timeout(self, method: str, params: dict = None) -> aiohttp.ClientTimeout:
+        if method == "getUpdates":
+            poll_timeout = (params or {}).get("timeout", 0)
+            total = poll_timeout + GET_UPDATES_TIMEOUT_MARGIN
+        else:
+            total = METHOD_TIMEOUTS.get(method, DEFAULT_TIMEOUT)
+        return aiohttp.ClientTimeout(total=total, connect=min(total, 5))
+
+    async def _post(self, method: str, body, timeout: aiohttp.ClientTimeout):
+        """Один HTTP-запрос к API с уже сериализованным телом"""
         url = f"{self.base_url}/{method}"
+        headers = JSON_HEADERS if isinstance(body, bytes) else None
+        try:
+            async with self.session.post(
+                url, data=body, headers=headers, timeout=timeout
+            ) as resp:
+                raw = await resp.read()
+                status = resp.status
+        except aiohttp.ClientConnectorError as e:
+            # Соединение не установлено - запрос точно не отправлен
+            raise NetworkError(f"{type(e).__name__}: {e}", maybe_sent=False) from e
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise NetworkError(f"{type(e).__name__}: {e}") from e
+
         try:
-            async with self.session.post(url, json=params) as resp:
-                data = await resp.json()
-                if not data.get("ok"):
-                    logger.error(f"Telegram API error: {data}")
-                    raise Exception(f"Telegram API error: {data.get('description')}")
-                return data["result"]
-        except Exception as e:
-            logger.error(f"Error making request to Telegram API: {e}")
-            raise
+            data = json_loads(raw)
+        except ValueError:
+            data = {"description": raw[:200].decode(errors="replace")}
+
+        if status == 200 and data.get("ok"):
+            return data["result"]
+        raise parse_error(status, data)
+
+    async def request_raw(
+        self, method: str, body, timeout=None, retry_maybe_sent: bool = None
+    ):
+        """Запрос с готовым JSON-телом, повторы для временных ошибок и 429
+
+        body - байты JSON или функция, создающая multipart-форму
+        (форму нельзя отправить повторно, поэтому она строится на каждую попытку).
+        retry_maybe_sent=False - не повторять запрос, который мог выполниться
+        (таймаут, 5xx): для отправки сообщений это означало бы дубль.
+        По умолчанию решает is_idempotent: send*, copy* и forward* не повторяются.
+        """
+        if timeout is None:
+            timeout = self._timeout(method)
+        if retry_maybe_sent is None:
+            retry_maybe_sent = is_idempotent(method)
+
+        with tracing.span(f"telegram.{method}") as span:
+            attempt = 0
+            while True:
+                span.set(attempts=attempt + 1)
+                try:
+                    data = body() if callable(body) else body
+                    with REQUEST_SECONDS.time(method=method):
+                        return await self._post(method, data, timeout)
+                except RetryAfter as e:
+                    THROTTLED.inc(method=method)
+                    if (
+                        attempt >= self.max_retries
+                        or e.retry_after > self.retry_after_limit
+                    ):
+                        raise
+                    delay = e.retry_after
+                    RETRIES.inc(method=method, reason="flood_wait")
+                except NetworkError as e:
+                    if e.maybe_sent and not retry_maybe_sent:
+                        raise
+                    if attempt >= self.max_retries:
+                        logger.error(f"Ошибка запроса к Telegram API ({method}): {e}")
+                        raise
+                    delay = self.backoff * (2**attempt)
+                    RETRIES.inc(method=method, reason="network")
+
+                attempt += 1
+                logger.warning(
+                    f"Повтор запроса {method} через {delay} с (попытка {attempt})"
+                )
+                await asyncio.sleep(delay)
+
+    async def _make_request(self, method: str, params: dict = None):
+        body = json_dumps(params or {})
+        return await self.request_raw(method, body, self._timeout(method, params))
+
+    async def send_prepared(self, template: PayloadTemplate, chat_id: int):
+        """Отправка заранее сериализованного запроса в конкретный чат
+
+        Неоднозначные сетевые ошибки не повторяются: сообщение могло быть
+        уже доставлено, решение о повторе принимает вызывающий код.
+        """
+        return await self.request_raw(template.method, template.render(chat_id))
+
+    async def upload(self, method: str, params: dict, files: dict):
+        """Загрузка файлов multipart-запросом
+
+        files - словарь {имя поля: (имя файла, байты)}, на поле можно
+        сослаться из params как attach://<имя поля>.
+        """
+
+        def build_form():
+            form = aiohttp.FormData()
+            for key, value in params.items():
+                if not isinstance(value, str):
+                    value = json_dumps(value).decode()
+                form.add_field(key, value)
+            for name, (filename, content) in files.items():
+                form.add_field(name, content, filename=filename)
+            return form
+
+        return await self.request_raw(method, build_form, self._timeout(method))
 
     async def send_message(
         self, chat_id: int, text: str, parse_mode: str = None, reply_markup: dict = None
@@ -38,7 +330,7 @@ class TelegramAPI:
         if parse_mode:
             params["parse_mode"] = parse_mode
         if reply_markup:
-            params["reply_markup"] = json.dumps(reply_markup)
+            params["reply_markup"] = reply_markup
         return await self._make_request("sendMessage", params)
 
     async def edit_message_text(
@@ -53,7 +345,7 @@ class TelegramAPI:
         if parse_mode:
             params["parse_mode"] = parse_mode
         if reply_markup:
-            params["reply_markup"] = json.dumps(reply_markup)
+            params["reply_markup"] = reply_markup
         return await self._make_request("editMessageText", params)
 
     async def answer_callback_query(
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import shared.database as database
+from shared.database import Base
+
+
+@pytest.fixture
+def sqlite_db(request, monkeypatch):
+    """Подмена подключения к базе данных на SQLite в памяти
+
+    Пустые таблицы; строки добавляет сам тест. Параметр (indirect) -
+    словарь: seed - функция seed(session), заполняющая БД перед тестом,
+    create_tables=False - не создавать таблицы (проверка миграций).
+    """
+    options = getattr(request, "param", None) or {}
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    if options.get("create_tables", True):
+        Base.metadata.create_all(engine)
+
+    original = database.engine
+    monkeypatch.setattr(database, "engine", engine)
+    database.SessionLocal.configure(bind=engine)
+    if options.get("seed"):
+        with database.db_session() as session:
+            options["seed"](session)
+
+    yield engine
+
+    database.SessionLocal.configure(bind=original)
+    engine.dispose()
@@ -0,0 +1,30 @@
+import os
+import sys
+import asyncio
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.benchmark import run_benchmark
+
+
+def test_benchmark_smoke():
+    """Малый прогон бенчмарка дает полный набор метрик"""
+    result = asyncio.run(run_benchmark(chats=500, blocked_ratio=0.1))
+
+    assert result["recipients"] > 0
+    assert result["sent"] + result["failed"] == result["recipients"]
+    assert result["failed"] > 0
+    assert result["msgs_per_sec"] > 0
+    assert result["latency_p99_ms"] >= result["latency_p50_ms"]
+    # Запросы к БД не растут линейно с числом сообщений
+    assert result["db_queries_per_message"] < 0.5
+    assert result["peak_rss_mb"] > 0
+
+
+def test_benchmark_memory_is_constant():
+    """Пик памяти рассылки не растет с размером аудитории"""
+    small = asyncio.run(run_benchmark(chats=400, trace_memory=True))
+    large = asyncio.run(run_benchmark(chats=2000, trace_memory=True))
+
+    assert large["recipients"] > 4 * small["recipients"]
+    assert large["peak_traced_mb"] < small["peak_traced_mb"] * 1.5
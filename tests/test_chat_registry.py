@@ -0,0 +1,115 @@
+import os
+import sys
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import shared.database as database
+from shared.database import Chat
+from bot.chat_registry import ChatRegistry
+
+
+def make_chat(chat_id, title=None, chat_type="group"):
+    return SimpleNamespace(id=chat_id, type=chat_type, title=title, full_name=None)
+
+
+def load_chats():
+    with database.db_session() as session:
+        return {
+            chat.chat_id: (chat.title, chat.status, chat.last_error)
+            for chat in session.query(Chat).all()
+        }
+
+
+def test_touches_are_coalesced(sqlite_db):
+    registry = ChatRegistry()
+    for i in range(5):
+        registry.touch(make_chat(1, f"title {i}"))
+    registry.touch(make_chat(2, "other"))
+
+    assert registry.flush() == 2
+    assert registry.pending == {}
+    assert load_chats() == {
+        1: ("title 4", "active", None),
+        2: ("other", "active", None),
+    }
+    assert registry.flush() == 0
+
+
+def test_status_updates_existing_chat(sqlite_db):
+    registry = ChatRegistry()
+    registry.touch(make_chat(1, "group"))
+    registry.flush()
+
+    registry.touch(make_chat(1, "group"), status="left", last_error="removed")
+    registry.flush()
+
+    assert load_chats() == {1: ("group", "left", "removed")}
+
+
+def test_activity_does_not_overwrite_status(sqlite_db):
+    registry = ChatRegistry()
+    registry.touch(make_chat(1, "group"), status="blocked", last_error="blocked")
+    registry.flush()
+
+    # Обычное обновление из чата не должно "оживлять" его
+    registry.touch(make_chat(1, "renamed"))
+    registry.flush()
+
+    assert load_chats() == {1: ("renamed", "blocked", "blocked")}
+
+
+def test_failed_flush_keeps_changes(sqlite_db, monkeypatch):
+    registry = ChatRegistry()
+    registry.touch(make_chat(1, "group"), status="left")
+
+    def broken_session():
+        raise RuntimeError("db is down")
+
+    with monkeypatch.context() as patch:
+        patch.setattr("bot.chat_registry.db_session", broken_session)
+        with pytest.raises(RuntimeError):
+            registry.flush()
+
+    registry.touch(make_chat(1, "renamed"))
+    registry.flush()
+
+    assert load_chats() == {1: ("renamed", "left", None)}
+
+
+def test_stop_waits_for_flush_in_thread(sqlite_db):
+    """Отметки во время записи в потоке не теряются, stop() ждет запись"""
+    registry = ChatRegistry(interval=0)
+    started, release = threading.Event(), threading.Event()
+    write = registry._write
+
+    def slow_write(pending):
+        started.set()
+        release.wait(5)
+        return write(pending)
+
+    registry._write = slow_write
+
+    async def scenario():
+        registry.start()
+        registry.touch(make_chat(1, "first"))
+        while not started.is_set():
+            await asyncio.sleep(0.01)
+
+        # Буфер уже подменен в event loop: новая отметка ждет следующей записи
+        registry.touch(make_chat(2, "second"))
+        assert list(registry.pending) == [2]
+
+        asyncio.get_running_loop().call_later(0.05, release.set)
+        await registry.stop()
+
+    asyncio.run(scenario())
+
+    assert load_chats() == {
+        1: ("first", "active", None),
+        2: ("second", "active", None),
+    }
@@ -145,3 +145,34 @@ def test_send_log_model(db_session):
     assert saved_log.chat_id == chat.chat_id
     assert saved_log.status == "success"
     assert saved_log.error_message is None
+
+
+@pytest.mark.parametrize("sqlite_db", [{"create_tables": False}], indirect=True)
+def test_ensure_schema_checks_version_once(sqlite_db):
+    """Полная проверка схемы - только пока версия в БД не совпадает"""
+    import shared.database as database
+    from sqlalchemy import event
+
+    statements = []
+    event.listen(
+        sqlite_db, "before_cursor_execute", lambda *args: statements.append(args[2])
+    )
+    assert database.ensure_schema() is True
+    assert database.stored_schema_version() == database.SCHEMA_VERSION
+
+    statements.clear()
+    assert database.ensure_schema() is False
+    assert len(statements) == 1
+
+
+def test_failed_migration_step_leaves_version_unwritten(sqlite_db, monkeypatch):
+    """Версия записывается, только если все шаги проверки схемы удались"""
+    import shared.database as database
+
+    with monkeypatch.context() as patch:
+        patch.setitem(database.ADDED_COLUMNS, "chats", {"broken": "NOT A TYPE ("})
+        assert database.ensure_schema() is True
+        assert database.stored_schema_version() is None
+
+    assert database.ensure_schema() is True
+    assert database.stored_schema_version() == database.SCHEMA_VERSION
@@ -0,0 +1,528 @@
+import os
+import sys
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import shared.database as database
+from shared.database import (
+    Chat,
+    DeadLetter,
+    Mailing,
+    MailingMedia,
+    MailingRun,
+    MediaFile,
+    RunRecipient,
+    SendLog,
+)
+from telegram_api import BadRequest, ChatMigrated, Forbidden, NetworkError, json_loads
+from bot import chat_status, delivery, media
+
+
+class FakeAPI:
+    """Заглушка TelegramAPI, запоминающая отправленные сообщения"""
+
+    def __init__(self, blocked=()):
+        self.blocked = set(blocked)
+        self.sent = []
+        self.uploads = []
+
+    async def send_prepared(self, template, chat_id):
+        params = json_loads(template.render(chat_id))
+        if chat_id in self.blocked:
+            raise Forbidden("Forbidden: bot was blocked by the user", error_code=403)
+        self.sent.append((params["chat_id"], params.get("text")))
+        return {"message_id": len(self.sent)}
+
+    async def upload(self, method, params, files):
+        if params["chat_id"] in self.blocked:
+            raise Forbidden("Forbidden: bot was blocked by the user", error_code=403)
+        self.uploads.append((method, params["chat_id"], sorted(files)))
+        return {"photo": [{"file_id": "small"}, {"file_id": f"big{len(self.uploads)}"}]}
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limit(monkeypatch):
+    """Рассылка в тестах без пауз между сообщениями"""
+    monkeypatch.setattr(delivery, "DELIVERY_RATE", 0)
+
+
+def create_mailing(session, chats, **kwargs):
+    mailing = Mailing(message_text="Привет", created_by=1, **kwargs)
+    for chat_id, chat_type, status in chats:
+        chat = Chat(chat_id=chat_id, type=chat_type, title=str(chat_id), status=status)
+        session.add(chat)
+        mailing.recipients.append(chat)
+    session.add(mailing)
+    session.commit()
+    return mailing.mailing_id
+
+
+def test_deliver_mailing(sqlite_db):
+    """Рассылка уходит только активным получателям нужных типов"""
+    with database.db_session() as session:
+        mailing_id = create_mailing(
+            session,
+            [
+                (1, "private", "active"),
+                (2, "private", "active"),
+                (3, "private", "blocked"),
+                (-10, "group", "active"),
+            ],
+            send_to_groups=False,
+        )
+
+    api = FakeAPI(blocked={2})
+    stats = asyncio.run(delivery.deliver_mailing(api, mailing_id))
+
+    assert stats["status"] == "finished"
+    assert (stats["total"], stats["sent"], stats["failed"]) == (2, 1, 1)
+    assert api.sent == [(1, "Привет")]
+
+    with database.db_session() as session:
+        logs = {log.chat_id: log for log in session.query(SendLog).all()}
+        assert logs[1].status == "success"
+        assert logs[2].status == "failed"
+        assert "blocked" in logs[2].error_message
+
+
+def test_one_time_mailing_is_unscheduled(sqlite_db):
+    """После разовой рассылки время следующего запуска сбрасывается"""
+    with database.db_session() as session:
+        mailing_id = create_mailing(
+            session, [(1, "private", "active")], next_run_time=datetime.now()
+        )
+
+    asyncio.run(delivery.deliver_mailing(FakeAPI(), mailing_id))
+
+    with database.db_session() as session:
+        assert session.get(Mailing, mailing_id).next_run_time is None
+
+
+def test_next_run_after():
+    """Расчет следующего запуска для повторяющихся рассылок"""
+    now = datetime(2025, 5, 14, 12, 0)  # среда
+    daily = Mailing(
+        is_recurring=True,
+        recurrence_interval="daily",
+        next_run_time=datetime(2025, 5, 14, 10, 0),
+    )
+    assert delivery.next_run_after(daily, now) == datetime(2025, 5, 15, 10, 0)
+
+    weekly = Mailing(
+        is_recurring=True,
+        recurrence_interval="weekly",
+        recurrence_days="0,4",
+        next_run_time=datetime(2025, 5, 14, 10, 0),
+    )
+    assert delivery.next_run_after(weekly, now) == datetime(2025, 5, 16, 10, 0)
+
+    once = Mailing(is_recurring=False, next_run_time=now - timedelta(hours=1))
+    assert delivery.next_run_after(once, now) is None
+
+
+def test_media_uploaded_once_and_cached(sqlite_db, tmp_path):
+    """Файл загружается один раз, повторный запуск берет file_id из кэша"""
+    photo = tmp_path / "photo.jpg"
+    photo.write_bytes(b"jpeg-bytes")
+
+    with database.db_session() as session:
+        mailing_id = create_mailing(
+            session, [(1, "private", "active"), (2, "private", "active")]
+        )
+    assert media.attach_files(mailing_id, [str(photo)]) == [(str(photo), "photo")]
+
+    api = FakeAPI(blocked={1})
+    stats = asyncio.run(delivery.deliver_mailing(api, mailing_id))
+
+    # Первый получатель недоступен, файл загружен второму и там же доставлен
+    assert (stats["total"], stats["sent"], stats["failed"]) == (2, 1, 1)
+    assert api.uploads == [("sendPhoto", 2, ["photo"])]
+    assert api.sent == []
+    with database.db_session() as session:
+        assert session.query(MailingMedia).one().file_id == "big1"
+
+    # file_id сохранен в рассылке - файл больше не читается
+    photo.unlink()
+    api = FakeAPI()
+    asyncio.run(delivery.deliver_mailing(api, mailing_id))
+
+    # Заблокировавший бота чат исключен из рассылки после первого запуска
+    assert api.uploads == []
+    assert [chat_id for chat_id, _ in api.sent] == [2]
+    with database.db_session() as session:
+        assert session.query(MediaFile).one().file_id == "big1"
+
+    # Тот же файл в другой рассылке находится в кэше по содержимому
+    copy = tmp_path / "copy.jpg"
+    copy.write_bytes(b"jpeg-bytes")
+    with database.db_session() as session:
+        other_id = create_mailing(session, [(3, "private", "active")])
+    media.attach_files(other_id, [str(copy)])
+    api = FakeAPI()
+    asyncio.run(delivery.deliver_mailing(api, other_id))
+    assert api.uploads == []
+    assert [chat_id for chat_id, _ in api.sent] == [3]
+
+
+def test_copy_message_mode(sqlite_db):
+    """Рассылка-копия отправляется через copyMessage без текста в теле"""
+    with database.db_session() as session:
+        mailing_id = create_mailing(
+            session,
+            [(1, "private", "active"), (-10, "group", "active")],
+            source_chat_id=777,
+            source_message_id=55,
+        )
+
+    api = FakeAPI()
+    templates = []
+    send_prepared = api.send_prepared
+
+    async def spy(template, chat_id):
+        templates.append(json_loads(template.render(chat_id)))
+        return await send_prepared(template, chat_id)
+
+    api.send_prepared = spy
+    stats = asyncio.run(delivery.deliver_mailing(api, mailing_id))
+
+    assert stats["sent"] == 2
+    assert {"chat_id": 1, "from_chat_id": 777, "message_id": 55} in templates
+
+
+def test_pause_and_resume(sqlite_db, monkeypatch):
+    """Пауза срабатывает после текущего пакета, продолжение - с checkpoint"""
+    monkeypatch.setattr(delivery, "RUN_BATCH_SIZE", 2)
+    with database.db_session() as session:
+        mailing_id = create_mailing(
+            session, [(chat_id, "private", "active") for chat_id in range(1, 8)]
+        )
+
+    api = FakeAPI()
+
+    def pause(chat_id, status, enqueued_at):
+        if chat_id == 1:
+            with database.db_session() as session:
+                run_id = delivery.latest_run(session, mailing_id).run_id
+            delivery.set_run_status(run_id, "paused")
+
+    stats = asyncio.run(delivery.deliver_mailing(api, mailing_id, on_result=pause))
+
+    assert stats["status"] == "paused"
+    assert [chat_id for chat_id, _ in api.sent] == [1, 2]
+    with database.db_session() as session:
+        run = session.get(MailingRun, stats["run_id"])
+        assert (run.status, run.checkpoint, run.sent) == ("paused", 2, 2)
+
+    stats = asyncio.run(
+        delivery.deliver_mailing(api, mailing_id, run_id=stats["run_id"])
+    )
+
+    assert stats["status"] == "finished"
+    assert (stats["total"], stats["sent"]) == (7, 7)
+    assert [chat_id for chat_id, _ in api.sent] == list(range(1, 8))
+
+
+def test_cancelled_run_is_not_resumed(sqlite_db, monkeypatch):
+    """Отмененный запуск останавливается и больше не продолжается"""
+    monkeypatch.setattr(delivery, "RUN_BATCH_SIZE", 2)
+    with database.db_session() as session:
+        mailing_id = create_mailing(
+            session, [(chat_id, "private", "active") for chat_id in range(1, 6)]
+        )
+
+    api = FakeAPI()
+
+    async def cancel(stats):
+        delivery.set_run_status(stats["run_id"], "cancelled")
+
+    # Отмена после первого пакета: второй дорабатывается, третий не начинается
+    stats = asyncio.run(delivery.deliver_mailing(api, mailing_id, progress=cancel))
+    assert stats["status"] == "cancelled"
+    assert len(api.sent) == 4
+
+    stats = asyncio.run(
+        delivery.deliver_mailing(api, mailing_id, run_id=stats["run_id"])
+    )
+    assert stats["status"] is None
+    assert len(api.sent) == 4
+
+
+def test_single_active_run_per_mailing(sqlite_db):
+    """Два одновременных запуска одной рассылки: второй не создается"""
+    with database.db_session() as session:
+        mailing_id = create_mailing(
+            session, [(chat_id, "private", "active") for chat_id in range(1, 4)]
+        )
+
+    api = FakeAPI()
+
+    async def main():
+        return await asyncio.gather(
+            delivery.deliver_mailing(api, mailing_id),
+            delivery.deliver_mailing(api, mailing_id),
+        )
+
+    first, second = asyncio.run(main())
+    assert first["status"] == "finished"
+    assert second["status"] is None
+    assert [chat_id for chat_id, _ in api.sent] == [1, 2, 3]
+
+    # После завершения рассылку можно запустить снова
+    stats = asyncio.run(delivery.deliver_mailing(api, mailing_id))
+    assert stats["status"] == "finished"
+    with database.db_session() as session:
+        assert session.query(MailingRun).count() == 2
+
+
+def test_recipient_read_error_stops_run(sqlite_db, monkeypatch):
+    """Ошибка чтения получателей поднимается из deliver_mailing, а не зависает"""
+    with database.db_session() as session:
+        mailing_id = create_mailing(session, [(1, "private", "active")])
+
+    async def failing(run_id, checkpoint):
+        raise RuntimeError("БД недоступна")
+        yield
+
+    monkeypatch.setattr(delivery, "iter_recipients", failing)
+
+    async def main():
+        return await asyncio.wait_for(
+            delivery.deliver_mailing(FakeAPI(), mailing_id), timeout=5
+        )
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(main())
+    assert delivery.pause_interrupted_runs(mailing_id) == 1
+
+
+def test_interrupted_run_sends_at_most_once(sqlite_db, monkeypatch):
+    """После сбоя чат с неизвестным результатом не получает второе сообщение"""
+    monkeypatch.setattr(delivery, "DELIVERY_CONCURRENCY", 1)
+    with database.db_session() as session:
+        mailing_id = create_mailing(
+            session, [(chat_id, "private", "active") for chat_id in range(1, 6)]
+        )
+
+    class CrashingAPI(FakeAPI):
+        async def send_prepared(self, template, chat_id):
+            if chat_id == 3:
+                raise RuntimeError("процесс остановлен")
+            return await super().send_prepared(template, chat_id)
+
+    api = CrashingAPI()
+    with pytest.raises(RuntimeError):
+        asyncio.run(delivery.deliver_mailing(api, mailing_id))
+
+    # Перезапуск бота: прерванный запуск встает на паузу и продолжается
+    assert delivery.pause_interrupted_runs() == 1
+    with database.db_session() as session:
+        run_id = delivery.latest_run(session, mailing_id).run_id
+
+    resumed = FakeAPI()
+    stats = asyncio.run(delivery.deliver_mailing(resumed, mailing_id, run_id=run_id))
+
+    assert [chat_id for chat_id, _ in api.sent] == [1, 2]
+    assert [chat_id for chat_id, _ in resumed.sent] == [4, 5]
+    assert (stats["sent"], stats["failed"]) == (4, 1)
+    with database.db_session() as session:
+        log = session.query(SendLog).filter_by(run_id=run_id, chat_id=3).one()
+        assert log.status == "unknown"
+
+
+def test_claimed_chats_are_skipped(sqlite_db):
+    """Чат, уже захваченный запуском, повторно не отправляется"""
+    with database.db_session() as session:
+        mailing_id = create_mailing(
+            session, [(1, "private", "active"), (2, "private", "active")]
+        )
+
+    assert delivery.claim_chats(mailing_id, 7, [1, 2]) == [1, 2]
+    assert delivery.claim_chats(mailing_id, 7, [2, 1]) == []
+    assert delivery.claim_chats(mailing_id, 8, [2]) == [2]
+
+
+def test_resume_uses_frozen_audience(sqlite_db, monkeypatch):
+    """Продолжение идет по аудитории, зафиксированной при старте запуска"""
+    monkeypatch.setattr(delivery, "RUN_BATCH_SIZE", 2)
+    with database.db_session() as session:
+        mailing_id = create_mailing(
+            session, [(chat_id, "private", "active") for chat_id in range(1, 7)]
+        )
+
+    api = FakeAPI()
+
+    async def pause(stats):
+        delivery.set_run_status(stats["run_id"], "paused")
+
+    stats = asyncio.run(delivery.deliver_mailing(api, mailing_id, progress=pause))
+
+    # Аудитория рассылки меняется, пока запуск на паузе
+    with database.db_session() as session:
+        mailing = session.get(Mailing, mailing_id)
+        chat = Chat(chat_id=7, type="private", title="7", status="active")
+        session.add(chat)
+        mailing.recipients.append(chat)
+        session.get(Chat, 6).status = "blocked"
+
+    stats = asyncio.run(
+        delivery.deliver_mailing(api, mailing_id, run_id=stats["run_id"])
+    )
+
+    assert stats["total"] == 6
+    assert [chat_id for chat_id, _ in api.sent] == [1, 2, 3, 4, 5, 6]
+    with database.db_session() as session:
+        assert (
+            session.query(RunRecipient).filter_by(run_id=stats["run_id"]).count() == 6
+        )
+
+
+def test_dead_chats_are_marked_and_migrations_followed(sqlite_db):
+    """Недоступные чаты помечаются, группа переезжает на новый chat_id"""
+    with database.db_session() as session:
+        mailing_id = create_mailing(
+            session,
+            [
+                (1, "private", "active"),
+                (2, "private", "active"),
+                (-10, "group", "active"),
+                (-20, "group", "active"),
+            ],
+        )
+
+    class DeadChatsAPI(FakeAPI):
+        async def send_prepared(self, template, chat_id):
+            if chat_id == -10:
+                raise ChatMigrated("migrated", new_chat_id=-1000010, error_code=400)
+            if chat_id == -20:
+                raise Forbidden("Forbidden: bot was kicked from the group chat")
+            return await super().send_prepared(template, chat_id)
+
+    api = DeadChatsAPI(blocked={2})
+    stats = asyncio.run(delivery.deliver_mailing(api, mailing_id))
+
+    assert (stats["sent"], stats["failed"]) == (2, 2)
+    assert sorted(chat_id for chat_id, _ in api.sent) == [-1000010, 1]
+    with database.db_session() as session:
+        statuses = {chat.chat_id: chat.status for chat in session.query(Chat)}
+        assert statuses == {
+            1: "active",
+            2: "blocked",
+            -10: "left",
+            -20: "left",
+            -1000010: "active",
+        }
+        recipients = {
+            chat.chat_id for chat in session.get(Mailing, mailing_id).recipients
+        }
+        assert recipients == {1, 2, -20, -1000010}
+
+
+def test_classify_error():
+    """Статус чата определяется по описанию ошибки Bot API"""
+    assert (
+        chat_status.classify_error(Forbidden("Forbidden: user is deactivated"))
+        == "blocked"
+    )
+    assert (
+        chat_status.classify_error(BadRequest("Bad Request: chat not found")) == "left"
+    )
+    assert (
+        chat_status.classify_error(BadRequest("Bad Request: message is too long"))
+        is None
+    )
+    assert chat_status.classify_error(NetworkError("Bad Gateway")) is None
+
+
+def test_retry_failed_recipients(sqlite_db):
+    """Временные ошибки попадают в очередь повторов и повторяются отдельно"""
+    with database.db_session() as session:
+        mailing_id = create_mailing(
+            session,
+            [
+                (1, "private", "active"),
+                (2, "private", "active"),
+                (3, "private", "active"),
+            ],
+        )
+
+    class FlakyAPI(FakeAPI):
+        async def send_prepared(self, template, chat_id):
+            if chat_id == 2:
+                # Соединение не установлено - сообщение точно не отправлено
+                raise NetworkError("Connection refused", maybe_sent=False)
+            return await super().send_prepared(template, chat_id)
+
+    stats = asyncio.run(delivery.deliver_mailing(FlakyAPI(blocked={3}), mailing_id))
+    first_run = stats["run_id"]
+
+    # Постоянная ошибка (блокировка) в очередь повторов не попадает
+    with database.db_session() as session:
+        letters = session.query(DeadLetter).all()
+        assert [(l.chat_id, l.error_class) for l in letters] == [(2, "network")]
+
+    finished = datetime.now()
+    assert delivery.due_retries(finished) == []
+    assert delivery.due_retries(finished + timedelta(minutes=10)) == [
+        (mailing_id, first_run)
+    ]
+
+    api = FakeAPI()
+    stats = asyncio.run(delivery.deliver_mailing(api, mailing_id, retry_of=first_run))
+
+    assert api.sent == [(2, "Привет")]
+    assert (stats["total"], stats["sent"]) == (1, 1)
+    with database.db_session() as session:
+        assert session.get(MailingRun, stats["run_id"]).attempt == 1
+        assert delivery.pending_dead_letters(session, first_run) == 0
+
+
+def test_ambiguous_failures_are_not_retried_automatically(sqlite_db):
+    """Таймаут после отправки не повторяется сам, только по кнопке"""
+    with database.db_session() as session:
+        mailing_id = create_mailing(
+            session, [(chat_id, "private", "active") for chat_id in (1, 2, 3)]
+        )
+
+    class FlakyAPI(FakeAPI):
+        async def send_prepared(self, template, chat_id):
+            if chat_id == 1:
+                raise NetworkError("TimeoutError")
+            if chat_id == 2:
+                raise NetworkError("Connection refused", maybe_sent=False)
+            return await super().send_prepared(template, chat_id)
+
+    first_run = asyncio.run(delivery.deliver_mailing(FlakyAPI(), mailing_id))["run_id"]
+    with database.db_session() as session:
+        letters = session.query(DeadLetter).order_by(DeadLetter.chat_id).all()
+        assert [(l.chat_id, l.error_class) for l in letters] == [
+            (1, "unknown"),
+            (2, "network"),
+        ]
+
+    # Автоматический повтор берет только чат 2, чат 1 переходит в новый запуск
+    later = datetime.now() + timedelta(minutes=10)
+    assert delivery.due_retries(later) == [(mailing_id, first_run)]
+    api = FakeAPI()
+    stats = asyncio.run(
+        delivery.deliver_mailing(
+            api,
+            mailing_id,
+            retry_of=first_run,
+            retry_classes=delivery.AUTO_RETRY_CLASSES,
+        )
+    )
+    assert api.sent == [(2, "Привет")]
+    retry_run = stats["run_id"]
+    with database.db_session() as session:
+        assert delivery.pending_dead_letters(session, first_run) == 0
+        assert delivery.pending_dead_letters(session, retry_run) == 1
+
+    assert delivery.due_retries(later + timedelta(hours=3)) == []
+
+    # Оператор повторяет вручную - без ограничения по классам
+    api = FakeAPI()
+    asyncio.run(delivery.deliver_mailing(api, mailing_id, retry_of=retry_run))
+    assert api.sent == [(1, "Привет")]
@@ -0,0 +1,81 @@
+import os
+import sys
+import asyncio
+import pytest
+from aiohttp.test_utils import TestServer
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from telegram_api import Forbidden, PayloadTemplate, RetryAfter, TelegramAPI
+from tools.fake_bot_api import FakeBotAPI
+
+
+def run_against_fake(fake, scenario, **api_kwargs):
+    """Запуск сценария TelegramAPI против локального фейкового Bot API"""
+
+    async def main():
+        async with TestServer(fake.make_app()) as server:
+            api_url = str(server.make_url("")).rstrip("/")
+            async with TelegramAPI("123:abc", api_url=api_url, **api_kwargs) as api:
+                return await scenario(api)
+
+    return asyncio.run(main())
+
+
+def test_basic_methods():
+    """sendMessage, copyMessage и editMessageText возвращают сообщения"""
+    fake = FakeBotAPI(rate=0)
+
+    async def scenario(api):
+        sent = await api.send_message(5, "привет")
+        copied = await api.send_prepared(
+            PayloadTemplate("copyMessage", {"from_chat_id": 1, "message_id": 1}), 5
+        )
+        edited = await api.edit_message_text(5, sent["message_id"], "новый текст")
+        return sent, copied, edited
+
+    sent, copied, edited = run_against_fake(fake, scenario)
+
+    assert sent["text"] == "привет"
+    assert copied["message_id"] == sent["message_id"] + 1
+    assert edited["text"] == "новый текст"
+    assert fake.stats["ok"] == 3
+
+
+def test_blocked_ratio():
+    """Доля чатов отвечает 403 bot was blocked"""
+    fake = FakeBotAPI(rate=0, blocked_ratio=1.0)
+
+    async def scenario(api):
+        with pytest.raises(Forbidden):
+            await api.send_message(5, "text")
+
+    run_against_fake(fake, scenario)
+    assert fake.stats["blocked"] == 1
+
+
+def test_rate_limit_returns_retry_after():
+    """Превышение лимита дает 429 с retry_after"""
+    fake = FakeBotAPI(rate=2)
+
+    async def scenario(api):
+        await api.send_message(1, "a")
+        await api.send_message(2, "b")
+        with pytest.raises(RetryAfter) as exc_info:
+            await api.send_message(3, "c")
+        return exc_info.value.retry_after
+
+    retry_after = run_against_fake(fake, scenario, max_retries=0)
+
+    assert retry_after >= 1
+    assert fake.stats["throttled"] == 1
+
+
+def test_get_updates():
+    """getUpdates отдает накопленные обновления"""
+    fake = FakeBotAPI(rate=0)
+    fake.push_update({"message": {"message_id": 1, "text": "/start"}})
+
+    updates = run_against_fake(fake, lambda api: api.get_updates(timeout=0))
+
+    assert updates == [{"update_id": 1, "message": {"message_id": 1, "text": "/start"}}]
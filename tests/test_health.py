@@ -0,0 +1,48 @@
+import os
+import sys
+import asyncio
+from aiohttp.test_utils import TestClient, TestServer
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.readiness import Readiness
+from bot.health import make_health_app
+
+
+def test_ready_after_startup():
+    """/healthz отвечает всегда, /ready - только после mark_ready"""
+    readiness = Readiness()
+
+    async def scenario():
+        async with TestClient(TestServer(make_health_app(readiness))) as client:
+            health = await client.get("/healthz")
+            starting = await client.get("/ready")
+            readiness.mark_ready()
+            ready = await client.get("/ready")
+            return health.status, starting.status, ready.status, await ready.json()
+
+    health, starting, ready, body = asyncio.run(scenario())
+
+    assert (health, starting, ready) == (200, 503, 200)
+    assert body["ready"] is True
+    assert body["time_to_ready_seconds"] >= 0
+
+
+def test_stats_endpoint():
+    """/stats отдает задержку вебхука с порта проверок"""
+    from bot.webhook import UpdateLatency
+
+    latency = UpdateLatency()
+    latency.received_now(1)
+    latency.handled_now(1)
+    app = make_health_app(Readiness(), {"update_latency": latency})
+
+    async def scenario():
+        async with TestClient(TestServer(app)) as client:
+            response = await client.get("/stats")
+            return response.status, await response.json()
+
+    status, body = asyncio.run(scenario())
+
+    assert status == 200
+    assert body["count"] == 1
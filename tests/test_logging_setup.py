@@ -0,0 +1,69 @@
+import os
+import sys
+import io
+import json
+import logging
+import queue
+from logging.handlers import QueueListener
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.logging_setup import DebugSampler, JsonFormatter, LogQueueHandler
+
+
+def make_logger(name, debug_sample=1):
+    """Логгер с очередью и фоновым потоком, пишущим JSON в буфер"""
+    output = io.StringIO()
+    stream = logging.StreamHandler(output)
+    stream.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    handler = LogQueueHandler(records)
+    handler.addFilter(DebugSampler(debug_sample))
+
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    return logger, QueueListener(records, stream), output
+
+
+def read_records(listener, output):
+    listener.stop()
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+def test_json_record_with_extra_fields():
+    """Поля из extra и текст исключения - отдельные ключи записи"""
+    logger, listener, output = make_logger("test.json")
+    listener.start()
+
+    logger.info(
+        "Рассылка %s", 7, extra={"mailing_id": 7, "run_id": 3, "latency_ms": 12.5}
+    )
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("Ошибка")
+
+    first, second = read_records(listener, output)
+    assert first["message"] == "Рассылка 7"
+    assert first["level"] == "INFO"
+    assert (first["mailing_id"], first["run_id"], first["latency_ms"]) == (7, 3, 12.5)
+    assert second["message"] == "Ошибка"
+    assert "ValueError: boom" in second["exc"]
+
+
+def test_debug_records_are_sampled():
+    """Из DEBUG-записей одного места выводится каждая N-я, INFO - все"""
+    logger, listener, output = make_logger("test.sampling", debug_sample=10)
+    listener.start()
+
+    for chat_id in range(25):
+        logger.debug("Отправка", extra={"chat_id": chat_id})
+        logger.info("Пакет")
+
+    records = read_records(listener, output)
+    debug = [record for record in records if record["level"] == "DEBUG"]
+    assert [record["chat_id"] for record in debug] == [0, 10, 20]
+    assert all(record["sampled"] == 10 for record in debug)
+    assert sum(record["level"] == "INFO" for record in records) == 25
@@ -0,0 +1,135 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.database import (
+    Chat,
+    DeadLetter,
+    Mailing,
+    MailingMedia,
+    MailingRun,
+    SendLog,
+)
+from bot.mailing_list import CountCache, RenderCache, fetch_page, mailing_details
+
+
+@pytest.fixture
+def session(sqlite_db):
+    session = sessionmaker(bind=sqlite_db)()
+    for i in range(1, 13):
+        session.add(
+            Mailing(
+                mailing_id=i,
+                message_text=f"m{i}",
+                created_by=1 if i % 2 else 2,
+                is_recurring=i % 3 == 0,
+                next_run_time=datetime(2030, 1, 1) if i > 8 else None,
+            )
+        )
+    session.commit()
+    yield session
+    session.close()
+
+
+def ids(page):
+    return [mailing.mailing_id for mailing in page[0]], page[1], page[2]
+
+
+def test_keyset_pages_forward_and_back(session):
+    assert ids(fetch_page(session)) == ([12, 11, 10, 9, 8], False, True)
+    assert ids(fetch_page(session, direction="next", cursor=8)) == (
+        [7, 6, 5, 4, 3],
+        True,
+        True,
+    )
+    assert ids(fetch_page(session, direction="next", cursor=3)) == ([2, 1], True, False)
+    assert ids(fetch_page(session, direction="prev", cursor=2)) == (
+        [7, 6, 5, 4, 3],
+        True,
+        True,
+    )
+    assert ids(fetch_page(session, direction="prev", cursor=7)) == (
+        [12, 11, 10, 9, 8],
+        False,
+        True,
+    )
+
+
+def test_filters(session):
+    assert ids(fetch_page(session, "scheduled")) == ([12, 11, 10, 9], False, False)
+    assert ids(fetch_page(session, "recurring")) == ([12, 9, 6, 3], False, False)
+    assert ids(fetch_page(session, "mine", user_id=2, size=3)) == (
+        [12, 10, 8],
+        False,
+        True,
+    )
+
+
+def test_count_cache(session):
+    counts = CountCache(ttl=60)
+    assert counts.get(session, "all") == 12
+    assert counts.get(session, "mine", 1) == 6
+
+    session.add(Mailing(message_text="new", created_by=1))
+    session.commit()
+    assert counts.get(session, "all") == 12
+
+    counts.invalidate()
+    assert counts.get(session, "all") == 13
+    assert counts.get(session, "mine", 1) == 7
+
+
+def test_mailing_details(session):
+    mailing = session.get(Mailing, 1)
+    for chat_id, chat_type in ((10, "private"), (11, "private"), (-12, "supergroup")):
+        chat = Chat(chat_id=chat_id, type=chat_type, title=str(chat_id))
+        mailing.recipients.append(chat)
+    mailing.media.append(MailingMedia(position=0, media_type="video"))
+    mailing.media.append(MailingMedia(position=1, media_type="photo"))
+    old_run = MailingRun(mailing_id=1, status="finished")
+    run = MailingRun(mailing_id=1, status="finished")
+    session.add_all([old_run, run])
+    session.flush()
+    session.add_all(
+        [
+            SendLog(mailing_id=1, run_id=run.run_id, chat_id=10, status="success"),
+            SendLog(mailing_id=1, run_id=run.run_id, chat_id=11, status="failed"),
+            SendLog(mailing_id=2, run_id=None, chat_id=11, status="success"),
+            DeadLetter(run_id=old_run.run_id, chat_id=10, error_class="network"),
+            DeadLetter(run_id=run.run_id, chat_id=11, error_class="network"),
+        ]
+    )
+    session.commit()
+
+    details = mailing_details(session, 1)
+    assert details.Mailing.mailing_id == 1
+    assert (details.users, details.groups) == (2, 1)
+    assert (details.successful, details.failed) == (1, 1)
+    assert (details.media_count, details.media_type) == (2, "video")
+    assert (details.run_id, details.run_status) == (run.run_id, "finished")
+    assert details.retry_count == 1
+
+    other = mailing_details(session, 2)
+    assert (other.users, other.groups, other.successful) == (0, 0, 1)
+    assert (other.media_count, other.run_id, other.retry_count) == (0, None, 0)
+    assert mailing_details(session, 100) is None
+
+
+def test_render_cache():
+    views = RenderCache(ttl=60)
+    views.put(1, "one")
+    views.put(2, "two")
+    assert views.get(1) == "one"
+
+    views.invalidate(1)
+    assert views.get(1) is None
+    assert views.get(2) == "two"
+
+    expired = RenderCache(ttl=0)
+    expired.put(1, "one")
+    assert expired.get(1) is None
@@ -0,0 +1,78 @@
+import os
+import sys
+import asyncio
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from sqlalchemy import create_engine, text
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared import metrics
+from shared.readiness import Readiness
+from bot.health import make_health_app
+
+
+def test_render_counter_and_histogram():
+    """Счетчик с метками и накопительные корзины гистограммы"""
+    registry = metrics.Registry()
+    sent = metrics.Counter("sent_total", "Отправки", ["result"], registry=registry)
+    latency = metrics.Histogram(
+        "latency_seconds", "Задержка", buckets=(0.1, 1), registry=registry
+    )
+
+    sent.inc(result="success")
+    sent.inc(2, result="success")
+    sent.inc(result="failed")
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(3)
+
+    lines = metrics.render(registry).splitlines()
+    assert "# TYPE sent_total counter" in lines
+    assert 'sent_total{result="success"} 3' in lines
+    assert 'sent_total{result="failed"} 1' in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert "latency_seconds_sum 3.55" in lines
+    assert "latency_seconds_count 3" in lines
+
+
+def test_labels_are_validated():
+    """Неверный набор меток и повторная регистрация имени - ошибка"""
+    registry = metrics.Registry()
+    sent = metrics.Counter("sent_total", "Отправки", ["result"], registry=registry)
+
+    with pytest.raises(ValueError):
+        sent.inc(status="success")
+    with pytest.raises(ValueError):
+        metrics.Gauge("sent_total", "Повтор", registry=registry)
+
+
+def test_instrument_engine_times_queries():
+    """Каждый SQL-запрос попадает в гистограмму длительности"""
+    engine = create_engine("sqlite://")
+    metrics.instrument_engine(engine)
+    before = metrics.DB_QUERY_SECONDS.count()
+
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        connection.execute(text("SELECT 2"))
+
+    assert metrics.DB_QUERY_SECONDS.count() - before == 2
+
+
+def test_health_app_serves_metrics():
+    """/metrics отдает общий реестр в текстовом формате"""
+
+    async def scenario():
+        async with TestClient(TestServer(make_health_app(Readiness()))) as client:
+            response = await client.get("/metrics")
+            return response.status, response.content_type, await response.text()
+
+    status, content_type, body = asyncio.run(scenario())
+
+    assert status == 200
+    assert content_type == "text/plain"
+    assert "# TYPE db_query_duration_seconds histogram" in body
+    assert "# TYPE event_loop_lag_seconds histogram" in body
@@ -0,0 +1,108 @@
+import os
+import sys
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bot.persistence import DatabasePersistence
+
+
+def test_state_survives_restart(sqlite_db):
+    """Записи одного цикла сохраняются пачкой и читаются после перезапуска"""
+    draft = {
+        "temp_mailing": {
+            "message_text": "Привет",
+            "next_run_time": datetime(2030, 1, 2, 3, 4),
+        },
+        "awaiting_input": "create_message",
+    }
+    statements = []
+    event.listen(
+        sqlite_db, "before_cursor_execute", lambda *args: statements.append(args[2])
+    )
+
+    async def save():
+        persistence = DatabasePersistence()
+        await asyncio.gather(
+            persistence.update_user_data(1, draft),
+            persistence.update_user_data(2, {"last_mailing_id": 5}),
+            persistence.update_conversation("create", (10, 1), 1),
+        )
+        await persistence.flush()
+
+    asyncio.run(save())
+    assert len([s for s in statements if s.startswith("INSERT")]) == 1
+
+    async def restart():
+        persistence = DatabasePersistence()
+        assert await persistence.get_user_data() == {}
+        conversations = await persistence.get_conversations("create")
+
+        user_data = {}
+        await persistence.refresh_user_data(1, user_data)
+        # Повторно из БД не читаем и новые значения не затираем
+        user_data["awaiting_input"] = None
+        await persistence.refresh_user_data(1, user_data)
+        return conversations, user_data
+
+    conversations, user_data = asyncio.run(restart())
+    assert conversations == {(10, 1): 1}
+    assert user_data == dict(draft, awaiting_input=None)
+
+
+def test_finished_state_is_deleted(sqlite_db):
+    async def scenario():
+        persistence = DatabasePersistence()
+        await persistence.update_user_data(1, {"page": 1})
+        await persistence.update_conversation("create", (10, 1), 2)
+
+        await persistence.update_user_data(1, {})
+        await persistence.update_conversation("create", (10, 1), None)
+        await persistence.flush()
+
+        restarted = DatabasePersistence()
+        user_data = {}
+        await restarted.refresh_user_data(1, user_data)
+        return user_data, await restarted.get_conversations("create")
+
+    assert asyncio.run(scenario()) == ({}, {})
+
+
+def test_batches_are_saved_in_order(sqlite_db):
+    """Поздняя пачка не записывается раньше медленной предыдущей"""
+    persistence = DatabasePersistence()
+    save = persistence.save
+    calls, saved = [], []
+
+    def slow_save(entries):
+        calls.append(entries)
+        if len(calls) == 1:
+            # Первая пачка медленная: вторая успевает начаться
+            time.sleep(0.1)
+        saved.append(dict(entries))
+        save(entries)
+
+    persistence.save = slow_save
+
+    async def scenario():
+        first = asyncio.create_task(persistence.update_user_data(1, {"page": 1}))
+        await asyncio.sleep(0.02)
+        await persistence.update_user_data(1, {"page": 2})
+        await first
+        await persistence.flush()
+
+        restarted = DatabasePersistence()
+        user_data = {}
+        await restarted.refresh_user_data(1, user_data)
+        return user_data
+
+    assert asyncio.run(scenario()) == {"page": 2}
+    assert [entries[("user_data", "1")] for entries in saved] == [
+        {"page": 1},
+        {"page": 2},
+    ]
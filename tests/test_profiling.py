@@ -0,0 +1,62 @@
+import os
+import sys
+import pstats
+import asyncio
+import threading
+import time
+
+import pytest
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bot.profiling import (
+    SamplingProfiler,
+    cprofile_report,
+    main,
+    profile_delivery,
+)
+
+
+def busy_loop(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_sampling_profiler_finds_busy_function():
+    """Занятая функция фонового потока - в свернутых стеках и в отчете"""
+    worker = threading.Thread(target=busy_loop, args=(0.3,), name="busy")
+    with SamplingProfiler(interval=0.002) as profiler:
+        worker.start()
+        worker.join()
+
+    assert profiler.samples > 0
+    lines = profiler.collapsed().splitlines()
+    busy = [line for line in lines if line.startswith("busy;")]
+    assert busy and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert "test_profiling.py:busy_loop" in busy[0]
+
+    top = {function: (own, total) for function, own, total in profiler.top()}
+    own, total = top["test_profiling.py:busy_loop"]
+    assert 0 < own <= total
+    assert "test_profiling.py:busy_loop" in profiler.report()
+
+
+def test_profile_delivery_with_cprofile():
+    """Прогон рассылки под cProfile: в отчете виден deliver_mailing"""
+    result, profile = asyncio.run(profile_delivery(mode="cprofile", chats=300))
+
+    assert result["sent"] + result["failed"] == result["recipients"]
+    assert "deliver_mailing" in cprofile_report(profile)
+
+
+def test_cprofile_mode_writes_pstats_only(tmp_path):
+    """cProfile пишет только pstats: --collapsed в этом режиме - ошибка"""
+    target = tmp_path / "delivery.folded"
+    with pytest.raises(SystemExit):
+        main(["--mode", "cprofile", "--collapsed", str(target)])
+    assert not target.exists()
+
+    stats_file = tmp_path / "delivery.prof"
+    main(["--mode", "cprofile", "--chats", "300", "--pstats", str(stats_file)])
+    assert "deliver_mailing" in str(pstats.Stats(str(stats_file)).stats)
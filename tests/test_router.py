@@ -0,0 +1,66 @@
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bot.router import CallbackRouter, parse_callback_data
+
+
+def make_callback(data):
+    return Update.de_json(
+        {
+            "update_id": 1,
+            "callback_query": {
+                "id": "1",
+                "chat_instance": "1",
+                "from": {"id": 1, "is_bot": False, "first_name": "u"},
+                "data": data,
+            },
+        },
+        None,
+    )
+
+
+def test_parse_callback_data():
+    assert parse_callback_data("back_to_list") == ("back_to_list", [])
+    assert parse_callback_data("page:mine:next:15") == ("page", ["mine", "next", "15"])
+
+
+def test_dispatch_by_action_with_stats():
+    """Действие выбирается по словарю, аргументы - в context.args"""
+    calls = []
+
+    async def show(update, context):
+        calls.append(("show", context.args))
+
+    async def broken(update, context):
+        raise RuntimeError("boom")
+
+    router = CallbackRouter({"mailing": show, "send": broken})
+
+    # Неизвестные действия достаются другим обработчикам
+    assert router.check_update(make_callback("start_create")) is None
+    assert router.check_update(object()) is None
+
+    async def press(data):
+        update = make_callback(data)
+        context = SimpleNamespace(args=None)
+        return await router.handle_update(
+            update, None, router.check_update(update), context
+        )
+
+    asyncio.run(press("mailing:7"))
+    asyncio.run(press("mailing:8"))
+    with pytest.raises(RuntimeError):
+        asyncio.run(press("send:7"))
+
+    assert calls == [("show", ["7"]), ("show", ["8"])]
+    summary = router.summary()
+    assert summary["mailing"]["count"] == 2
+    assert summary["mailing"]["errors"] == 0
+    assert summary["send"]["errors"] == 1
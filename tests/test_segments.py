@@ -0,0 +1,224 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import shared.database as database
+from shared.database import Chat, Mailing, RunRecipient, Segment
+from shared.segments import (
+    SegmentError,
+    affected_segments,
+    apply_chat_changes,
+    create_segment,
+    delete_segment,
+    pack,
+    unpack,
+)
+from bot.chat_registry import ChatRegistry
+from bot.chat_status import ChatStatusBuffer
+from bot.delivery import snapshot_audience
+from telegram_api import Forbidden
+
+
+def seed_chats(session):
+    """3 пользователя, 2 группы и заблокированный пользователь"""
+    for chat_id in (1, 2, 3):
+        session.add(Chat(chat_id=chat_id, type="private", status="active"))
+    for chat_id in (-10, -20):
+        session.add(Chat(chat_id=chat_id, type="supergroup", status="active"))
+    session.add(Chat(chat_id=4, type="private", status="blocked"))
+
+
+with_chats = pytest.mark.parametrize("sqlite_db", [{"seed": seed_chats}], indirect=True)
+
+
+def members(name):
+    with database.db_session() as session:
+        segment = session.scalar(select(Segment).where(Segment.name == name))
+        return list(unpack(segment.members)), segment.users, segment.groups
+
+
+def test_pack_roundtrip():
+    """Состав хранится по 8 байт на чат"""
+    ids = [-1001234567890, -5, 0, 7, 2**40]
+    assert len(pack(ids)) == 8 * len(ids)
+    assert list(unpack(pack(ids))) == ids
+    assert list(unpack(None)) == []
+
+
+@with_chats
+def test_set_operations(sqlite_db):
+    """Правило, выбранные чаты и операции вычисляются при создании"""
+    with database.db_session() as session:
+        users = create_segment(session, "users", {"type": "private"})
+        vip = create_segment(session, "vip", {}, chats=[3, 2, 4, -10])
+        create_segment(
+            session, "all", {"op": "union", "of": [users.segment_id, vip.segment_id]}
+        )
+        create_segment(
+            session,
+            "vip users",
+            {"op": "intersection", "of": [users.segment_id, vip.segment_id]},
+        )
+        create_segment(
+            session,
+            "regular",
+            {"op": "difference", "of": [users.segment_id, vip.segment_id]},
+        )
+
+    assert members("users") == ([1, 2, 3], 3, 0)
+    # Заблокированный чат 4 выбран, но в состав не входит
+    assert members("vip") == ([-10, 2, 3], 2, 1)
+    assert members("all") == ([-10, 1, 2, 3], 3, 1)
+    assert members("vip users") == ([2, 3], 2, 0)
+    assert members("regular") == ([1], 1, 0)
+
+
+def test_invalid_definitions(sqlite_db):
+    with database.db_session() as session:
+        create_segment(session, "users", {"type": "private"})
+        with pytest.raises(SegmentError):
+            create_segment(session, "users", {"type": "groups"})
+        with pytest.raises(SegmentError):
+            create_segment(session, "bad", {"type": "bots"})
+        with pytest.raises(SegmentError):
+            create_segment(session, "bad", {"op": "union", "of": [1, 99]})
+
+
+@with_chats
+def test_membership_follows_joins_and_leaves(sqlite_db):
+    """Появление и уход чатов точечно меняют составы и счетчики"""
+    with database.db_session() as session:
+        groups = create_segment(session, "groups", {"type": "groups"})
+        vip = create_segment(session, "vip", {}, chats=[1, -10, -30])
+        create_segment(
+            session,
+            "vip groups",
+            {"op": "intersection", "of": [groups.segment_id, vip.segment_id]},
+        )
+
+    registry = ChatRegistry()
+    # Новая группа -30 (была выбрана заранее) и уход группы -10
+    registry.touch(SimpleNamespace(id=-30, type="group", title="new", full_name=None))
+    registry.touch(
+        SimpleNamespace(id=-10, type="supergroup", title="old", full_name=None),
+        status="left",
+    )
+    # Активность уже известного чата сегменты не трогает
+    registry.touch(SimpleNamespace(id=1, type="private", title=None, full_name="u"))
+    registry.flush()
+
+    assert members("groups") == ([-30, -20], 0, 2)
+    assert members("vip") == ([-30, 1], 1, 1)
+    assert members("vip groups") == ([-30], 0, 1)
+
+    # Пользователь заблокировал бота во время рассылки
+    buffer = ChatStatusBuffer()
+    buffer.record_error(1, Forbidden("Forbidden: bot was blocked by the user"))
+    with database.db_session() as session:
+        buffer.apply(session)
+    assert members("vip") == ([-30], 0, 1)
+
+
+@with_chats
+def test_only_affected_segments_are_loaded(sqlite_db):
+    """Сегменты, которые изменения не могут затронуть, не загружаются"""
+    with database.db_session() as session:
+        users = create_segment(session, "users", {"type": "private"}).segment_id
+        groups = create_segment(session, "groups", {"type": "groups"}).segment_id
+        vip = create_segment(session, "vip", {}, chats=[1, -10]).segment_id
+        mixed = create_segment(
+            session, "mixed", {"op": "union", "of": [users, vip]}
+        ).segment_id
+        vip_groups = create_segment(
+            session, "vip groups", {"op": "intersection", "of": [groups, vip]}
+        ).segment_id
+
+    with database.db_session() as session:
+        # Ушел пользователь 2: его нет среди выбранных чатов vip
+        affected, needed = affected_segments(session, {2: ("private", False)})
+        assert affected == {users, mixed}
+        assert needed == {users, vip, mixed}
+        # Переезд группы -10 затрагивает vip и операции над ним
+        affected, _ = affected_segments(session, {}, renamed={-10: -1000010})
+        assert affected == {vip, mixed, vip_groups}
+
+        assert apply_chat_changes(session, {2: ("private", False)}) == 2
+
+    assert members("users") == ([1, 3], 2, 0)
+    assert members("mixed") == ([-10, 1, 3], 2, 1)
+    assert members("groups") == ([-20, -10], 0, 2)
+
+
+@with_chats
+def test_activity_of_blocked_chat_keeps_it_out(sqlite_db):
+    """Сообщение от заблокировавшего бота чата не возвращает его в сегменты"""
+    with database.db_session() as session:
+        create_segment(session, "private", {"type": "private"})
+
+    registry = ChatRegistry()
+    registry.touch(SimpleNamespace(id=4, type="private", title=None, full_name="u"))
+    registry.flush()
+
+    assert members("private") == ([1, 2, 3], 3, 0)
+    with database.db_session() as session:
+        assert session.get(Chat, 4).status == "blocked"
+
+
+@with_chats
+def test_migrated_group_replaces_old_one(sqlite_db):
+    """Группа, ставшая супергруппой, остается в выбранных чатах под новым ID"""
+    with database.db_session() as session:
+        create_segment(session, "vip", {}, chats=[-10, 1])
+
+    buffer = ChatStatusBuffer()
+    buffer.record_migration(-10, -1000010)
+    with database.db_session() as session:
+        buffer.apply(session)
+
+    assert members("vip") == ([-1000010, 1], 1, 1)
+
+
+@with_chats
+def test_mailing_audience_from_segment(sqlite_db):
+    """Аудитория запуска берется из состава сегмента с учетом типов и статусов"""
+    with database.db_session() as session:
+        segment = create_segment(session, "vip", {}, chats=[1, 2, -10])
+        mailing = Mailing(
+            message_text="hi", segment_id=segment.segment_id, send_to_groups=False
+        )
+        session.add(mailing)
+        session.flush()
+        # Чат 2 стал недоступен после последнего пересчета сегмента
+        session.get(Chat, 2).status = "blocked"
+
+        total = snapshot_audience(session, mailing, run_id=1)
+        recipients = session.scalars(
+            select(RunRecipient.chat_id).where(RunRecipient.run_id == 1)
+        ).all()
+
+    assert total == 1
+    assert recipients == [1]
+
+
+def test_segment_in_use_is_not_deleted(sqlite_db):
+    with database.db_session() as session:
+        users = create_segment(session, "users", {"type": "private"})
+        vip = create_segment(session, "vip", {}, chats=[1])
+        create_segment(
+            session, "both", {"op": "union", "of": [users.segment_id, vip.segment_id]}
+        )
+
+        with pytest.raises(SegmentError):
+            delete_segment(session, users.segment_id)
+        delete_segment(
+            session,
+            session.scalar(select(Segment.segment_id).where(Segment.name == "both")),
+        )
+        delete_segment(session, users.segment_id)
+
+        assert session.scalars(select(Segment.name)).all() == ["vip"]
@@ -0,0 +1,213 @@
+import os
+import sys
+import asyncio
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from telegram_api import (
+    PayloadTemplate,
+    TelegramAPI,
+    BadRequest,
+    ChatMigrated,
+    Forbidden,
+    NetworkError,
+    RetryAfter,
+    json_loads,
+)
+
+
+def run_with_server(responses, scenario):
+    """Запуск сценария против локального сервера с заданными ответами"""
+    requests = []
+
+    async def handler(request):
+        body = await request.read()
+        requests.append((request.match_info["method"], json_loads(body)))
+        status, payload = responses[min(len(requests), len(responses)) - 1]
+        return web.json_response(payload, status=status)
+
+    async def main():
+        app = web.Application()
+        app.router.add_post("/bottoken/{method}", handler)
+        async with TestServer(app) as server:
+            api = TelegramAPI("token", api_url=str(server.make_url("")), backoff=0)
+            async with api:
+                return await scenario(api)
+
+    return asyncio.run(main()), requests
+
+
+OK = (200, {"ok": True, "result": {"message_id": 1}})
+
+
+def test_reply_markup_sent_as_object():
+    """reply_markup передается объектом, а не JSON-строкой"""
+    markup = {"inline_keyboard": [[{"text": "A", "callback_data": "a"}]]}
+    result, requests = run_with_server(
+        [OK], lambda api: api.send_message(1, "текст", reply_markup=markup)
+    )
+
+    assert result == {"message_id": 1}
+    method, params = requests[0]
+    assert method == "sendMessage"
+    assert params["reply_markup"] == markup
+    assert params["text"] == "текст"
+
+
+@pytest.mark.parametrize(
+    "status, payload, exc_type",
+    [
+        (403, {"ok": False, "error_code": 403, "description": "blocked"}, Forbidden),
+        (400, {"ok": False, "error_code": 400, "description": "bad"}, BadRequest),
+        (
+            400,
+            {
+                "ok": False,
+                "error_code": 400,
+                "description": "migrated",
+                "parameters": {"migrate_to_chat_id": -1002},
+            },
+            ChatMigrated,
+        ),
+    ],
+)
+def test_typed_errors(status, payload, exc_type):
+    """Ошибки API преобразуются в типизированные исключения без повторов"""
+
+    async def scenario(api):
+        with pytest.raises(exc_type) as exc_info:
+            await api.send_message(1, "text")
+        return exc_info.value
+
+    error, requests = run_with_server([(status, payload)], scenario)
+
+    assert len(requests) == 1
+    if exc_type is ChatMigrated:
+        assert error.new_chat_id == -1002
+
+
+def test_retry_on_server_error_and_flood_wait():
+    """Временные ошибки и 429 повторяются"""
+    responses = [
+        (502, {"ok": False, "error_code": 502, "description": "Bad Gateway"}),
+        (
+            429,
+            {
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests",
+                "parameters": {"retry_after": 0},
+            },
+        ),
+        OK,
+    ]
+    result, requests = run_with_server(
+        responses, lambda api: api.edit_message_text(1, 2, "t")
+    )
+
+    assert result == {"message_id": 1}
+    assert len(requests) == 3
+
+
+def test_send_message_does_not_repeat_ambiguous_errors():
+    """sendMessage после 5xx не повторяется, 429 - повторяется"""
+
+    async def scenario(api):
+        with pytest.raises(NetworkError):
+            await api.send_message(1, "t")
+
+    _, requests = run_with_server(
+        [(502, {"ok": False, "error_code": 502, "description": "Bad Gateway"}), OK],
+        scenario,
+    )
+    assert len(requests) == 1
+
+    flood = (
+        429,
+        {
+            "ok": False,
+            "error_code": 429,
+            "description": "Too Many Requests",
+            "parameters": {"retry_after": 0},
+        },
+    )
+    result, requests = run_with_server(
+        [flood, OK], lambda api: api.send_message(1, "t")
+    )
+    assert result == {"message_id": 1}
+    assert len(requests) == 2
+
+
+def test_retry_limits():
+    """Долгий retry_after и исчерпание повторов поднимают исключение"""
+    flood = (
+        429,
+        {
+            "ok": False,
+            "error_code": 429,
+            "description": "Too Many Requests",
+            "parameters": {"retry_after": 3600},
+        },
+    )
+
+    async def scenario(api):
+        with pytest.raises(RetryAfter) as exc_info:
+            await api.send_message(1, "t")
+        return exc_info.value.retry_after
+
+    retry_after, requests = run_with_server([flood], scenario)
+    assert retry_after == 3600
+    assert len(requests) == 1
+
+    async def scenario_5xx(api):
+        with pytest.raises(NetworkError):
+            await api.edit_message_text(1, 2, "t")
+
+    _, requests = run_with_server(
+        [(500, {"ok": False, "error_code": 500, "description": "Internal"})],
+        scenario_5xx,
+    )
+    assert len(requests) == 4
+
+
+def test_payload_template_matches_plain_encoding():
+    """Шаблон дает тот же JSON, что и сборка словаря на каждого получателя"""
+    params = {
+        "text": 'Текст с "кавычками"\nи переносом',
+        "parse_mode": "HTML",
+        "reply_markup": {"inline_keyboard": [[{"text": "A", "url": "https://a"}]]},
+    }
+    template = PayloadTemplate("sendMessage", params)
+
+    for chat_id in (1, 123456789, -1001234567890):
+        assert json_loads(template.render(chat_id)) == {"chat_id": chat_id, **params}
+
+    assert json_loads(PayloadTemplate("getChat", {}).render(5)) == {"chat_id": 5}
+
+
+def test_send_prepared():
+    """Отправка заранее сериализованного тела"""
+    template = PayloadTemplate("sendMessage", {"text": "t"})
+    _, requests = run_with_server([OK], lambda api: api.send_prepared(template, 42))
+
+    assert requests == [("sendMessage", {"chat_id": 42, "text": "t"})]
+
+
+def test_send_prepared_does_not_repeat_ambiguous_errors():
+    """Сообщение не отправляется повторно, если первая попытка могла дойти"""
+    template = PayloadTemplate("sendMessage", {"text": "t"})
+
+    async def scenario(api):
+        with pytest.raises(NetworkError) as exc_info:
+            await api.send_prepared(template, 42)
+        return exc_info.value.maybe_sent
+
+    maybe_sent, requests = run_with_server(
+        [(502, {"ok": False, "error_code": 502, "description": "Bad Gateway"}), OK],
+        scenario,
+    )
+    assert maybe_sent is True
+    assert len(requests) == 1
@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import asyncio
+import pytest
+from sqlalchemy import create_engine, text
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared import tracing
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    tracing.configure(str(path))
+    yield path
+    tracing.configure(None)
+
+
+def read_spans(path):
+    return {
+        span["name"]: span
+        for span in map(json.loads, path.read_text(encoding="utf-8").splitlines())
+    }
+
+
+def test_spans_are_linked_across_threads(trace_file):
+    """Дочерние спаны (в том числе из asyncio.to_thread) ссылаются на родителя"""
+
+    def query():
+        with tracing.span("db.session"):
+            pass
+
+    async def scenario():
+        with tracing.span("bot.update", kind="message"):
+            await asyncio.to_thread(query)
+            with pytest.raises(ValueError):
+                with tracing.span("telegram.sendMessage"):
+                    raise ValueError("boom")
+
+    asyncio.run(scenario())
+    spans = read_spans(trace_file)
+
+    root = spans["bot.update"]
+    assert root["parent_id"] is None
+    assert root["attributes"] == {"kind": "message"}
+    for name in ("db.session", "telegram.sendMessage"):
+        assert spans[name]["trace_id"] == root["trace_id"]
+        assert spans[name]["parent_id"] == root["span_id"]
+    assert spans["telegram.sendMessage"]["error"] == "ValueError: boom"
+
+
+def test_repeated_statements_are_reported(trace_file):
+    """Повторы одного запроса в спане (N+1) видны в атрибуте db.repeated"""
+    engine = create_engine("sqlite://")
+    tracing.instrument_engine(engine)
+
+    with tracing.span("db.session"):
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 0"))
+            for chat_id in range(3):
+                connection.execute(text("SELECT :id"), {"id": chat_id})
+
+    db = read_spans(trace_file)["db.session"]["db"]
+    assert db["statements"] == 4
+    assert db["repeated"] == {"count": 3, "statement": "SELECT ?"}
+
+
+def test_disabled_tracing_writes_nothing():
+    """Без configure спаны не создаются"""
+    with tracing.span("bot.update") as span:
+        span.set(kind="message")
+        assert tracing.current_span() is None
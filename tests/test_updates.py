@@ -0,0 +1,65 @@
+import os
+import sys
+import asyncio
+from telegram import Update
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bot.updates import KeyedUpdateProcessor, update_keys
+
+
+def make_update(update_id, user_id, chat_id=None):
+    chat_id = chat_id or user_id
+    return Update.de_json(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+                "text": "x",
+            },
+        },
+        None,
+    )
+
+
+def test_update_keys():
+    """Ключи: чат и пользователь, в постоянном порядке"""
+    assert update_keys(make_update(1, 5, -100)) == [("chat", -100), ("user", 5)]
+    assert update_keys(object()) == []
+
+
+def test_same_user_is_serialized_others_run_in_parallel():
+    """Обновления одного пользователя идут по очереди, разных - параллельно"""
+    events = []
+    running = {"now": 0, "max": 0}
+
+    async def handler(name, delay):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        events.append(f"start {name}")
+        await asyncio.sleep(delay)
+        events.append(f"end {name}")
+        running["now"] -= 1
+
+    async def scenario():
+        processor = KeyedUpdateProcessor(max_running=2)
+        async with processor:
+            await asyncio.gather(
+                processor.process_update(make_update(1, 1), handler("a1", 0.05)),
+                processor.process_update(make_update(2, 1), handler("a2", 0)),
+                processor.process_update(make_update(3, 2), handler("b", 0)),
+                processor.process_update(make_update(4, 3), handler("c", 0)),
+            )
+        return processor
+
+    processor = asyncio.run(scenario())
+
+    # Второе обновление пользователя 1 начинается только после первого
+    assert events.index("start a2") > events.index("end a1")
+    # Другие пользователи не ждут медленного обработчика
+    assert events.index("end b") < events.index("end a1")
+    assert running["max"] == 2
+    assert processor._locks == {}
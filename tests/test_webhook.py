@@ -0,0 +1,75 @@
+import os
+import sys
+import asyncio
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+# Add parent directory to path for shared imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bot.webhook import SECRET_HEADER, make_webhook_app
+
+
+class FakeApplication:
+    """Минимальная замена telegram.ext.Application для приемника"""
+
+    def __init__(self):
+        self.bot = None
+        self.bot_data = {}
+        self.update_queue = asyncio.Queue()
+
+
+UPDATE = {
+    "update_id": 10,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 5, "type": "private"},
+        "text": "/start",
+    },
+}
+
+
+def test_webhook_checks_secret_and_enqueues_updates():
+    """Обновление попадает в очередь только с верным secret token"""
+    application = FakeApplication()
+
+    async def scenario():
+        app = make_webhook_app(application, secret="s3cret", path="/tg-webhook")
+        async with TestClient(TestServer(app)) as client:
+            denied = await client.post(
+                "/tg-webhook", json=UPDATE, headers={SECRET_HEADER: "wrong"}
+            )
+            broken = await client.post(
+                "/tg-webhook", data=b"{", headers={SECRET_HEADER: "s3cret"}
+            )
+            missing = await client.post("/tg-webhook", json=UPDATE)
+            accepted = await client.post(
+                "/tg-webhook", json=UPDATE, headers={SECRET_HEADER: "s3cret"}
+            )
+            stats = await client.get("/tg-webhook/stats")
+            return (
+                denied.status,
+                broken.status,
+                missing.status,
+                accepted.status,
+                stats.status,
+            )
+
+    statuses = asyncio.run(scenario())
+
+    # Статистика наружу не отдается - она на порту проверок
+    assert statuses == (403, 400, 403, 200, 404)
+    assert application.update_queue.qsize() == 1
+    update = application.update_queue.get_nowait()
+    assert update.update_id == 10
+    assert update.message.text == "/start"
+
+    latency = application.bot_data["update_latency"]
+    latency.handled_now(10)
+    assert latency.percentiles()["count"] == 1
+
+
+def test_webhook_requires_secret():
+    """Приемник без secret token не создается"""
+    with pytest.raises(ValueError):
+        make_webhook_app(FakeApplication(), secret="")
@@ -0,0 +1,86 @@
+"""Микробенчмарк сериализации тела sendMessage на получателя
+
+Сравнивает построение словаря с json-кодированием на каждого получателя
+и подстановку chat_id в заранее сериализованный PayloadTemplate.
+
+Запуск: python -m tools.bench_payload --recipients 1000000
+"""
+
+import argparse
+import json
+import time
+
+from telegram_api import PayloadTemplate, json_dumps
+
+SAMPLE_TEXT = (
+    "<b>Новости недели</b>\n\n"
+    "Мы обновили бота и добавили новые возможности. "
+    "Подробности по ссылке ниже." * 3
+)
+SAMPLE_MARKUP = {
+    "inline_keyboard": [
+        [{"text": "Подробнее", "url": "https://example.com/news"}],
+        [{"text": "Отписаться", "callback_data": "unsubscribe"}],
+    ]
+}
+
+
+def synthetic_chat_ids(count: int):
+    """Синтетическая аудитория: пользователи и супергруппы вперемешку"""
+    for i in range(count):
+        yield -1001000000000 - i if i % 4 == 0 else 100000000 + i
+
+
+def bench_per_message(count: int) -> float:
+    """Словарь и JSON на каждого получателя (как до шаблонов)"""
+    start = time.process_time()
+    for chat_id in synthetic_chat_ids(count):
+        params = {"chat_id": chat_id, "text": SAMPLE_TEXT}
+        params["parse_mode"] = "HTML"
+        params["reply_markup"] = SAMPLE_MARKUP
+        json_dumps(params)
+    return time.process_time() - start
+
+
+def bench_template(count: int) -> float:
+    """Шаблон сериализуется один раз, на получателя - только склейка"""
+    start = time.process_time()
+    template = PayloadTemplate(
+        "sendMessage",
+        {"text": SAMPLE_TEXT, "parse_mode": "HTML", "reply_markup": SAMPLE_MARKUP},
+    )
+    render = template.render
+    for chat_id in synthetic_chat_ids(count):
+        render(chat_id)
+    return time.process_time() - start
+
+
+def bench_loop_only(count: int) -> float:
+    """Стоимость перебора получателей без сериализации"""
+    start = time.process_time()
+    for _ in synthetic_chat_ids(count):
+        pass
+    return time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recipients", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    count = args.recipients
+    baseline = bench_loop_only(count)
+    per_message = bench_per_message(count) - baseline
+    template = bench_template(count) - baseline
+
+    result = {
+        "recipients": count,
+        "per_message_us": round(per_message / count * 1e6, 3),
+        "template_us": round(template / count * 1e6, 3),
+        "speedup": round(per_message / template, 2) if template > 0 else None,
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
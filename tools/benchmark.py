@@ -0,0 +1,280 @@
+"""Сквозной бенчмарк доставки рассылок на синтетической аудитории
+
+Заполняет базу (SQLite или локальный PostgreSQL) N чатами и рассылкой
+с реалистичным набором получателей, выполняет deliver_mailing против
+локального фейкового Bot API и выводит результаты в JSON: сообщений
+в секунду, p50/p99 задержки от постановки в очередь до отправки,
+запросов к БД на сообщение, пиковый RSS и лаг event loop.
+
+Запуск: python -m tools.benchmark --chats 100000 --output bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from aiohttp import web
+from sqlalchemy import create_engine, event, insert
+
+import shared.database as database
+from shared.database import Base, Chat, Mailing, mailing_recipients
+from telegram_api import TelegramAPI
+from tools.fake_bot_api import FakeBotAPI
+from bot import delivery
+
+SEED_BATCH = 10000
+# Размер выборки задержек: память бенчмарка не растет с числом сообщений
+SAMPLE_SIZE = 10000
+
+
+class Reservoir:
+    """Равномерная выборка фиксированного размера из потока значений"""
+
+    def __init__(self, size: int = SAMPLE_SIZE, seed: int = 0):
+        self.size = size
+        self.values = []
+        self.seen = 0
+        self.random = random.Random(seed)
+
+    def append(self, value: float) -> None:
+        self.seen += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+            return
+        index = self.random.randrange(self.seen)
+        if index < self.size:
+            self.values[index] = value
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS процесса в мегабайтах"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux возвращает килобайты, macOS - байты
+    return usage / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def seed_database(engine, chats: int, recipient_ratio: float, seed: int) -> int:
+    """Синтетическая аудитория: 70% пользователей, 30% групп, 5% неактивных"""
+    rnd = random.Random(seed)
+    Base.metadata.create_all(engine)
+
+    with engine.begin() as conn:
+        result = conn.execute(
+            insert(Mailing).values(
+                message_text="Бенчмарк рассылки " * 10,
+                created_by=1,
+                send_to_users=True,
+                send_to_groups=True,
+            )
+        )
+        mailing_id = result.inserted_primary_key[0]
+
+        chat_rows, link_rows = [], []
+        for i in range(chats):
+            is_group = rnd.random() < 0.3
+            chat_id = -1001000000000 - i if is_group else 100000000 + i
+            chat_rows.append(
+                {
+                    "chat_id": chat_id,
+                    "type": "supergroup" if is_group else "private",
+                    "title": f"chat {i}",
+                    "status": "active" if rnd.random() >= 0.05 else "blocked",
+                }
+            )
+            if rnd.random() < recipient_ratio:
+                link_rows.append({"mailing_id": mailing_id, "chat_id": chat_id})
+
+            if len(chat_rows) >= SEED_BATCH:
+                conn.execute(insert(Chat), chat_rows)
+                chat_rows.clear()
+        if chat_rows:
+            conn.execute(insert(Chat), chat_rows)
+        for start in range(0, len(link_rows), SEED_BATCH):
+            conn.execute(
+                insert(mailing_recipients), link_rows[start : start + SEED_BATCH]
+            )
+
+    return mailing_id
+
+
+async def measure_loop_lag(samples: list, interval: float = 0.01):
+    """Лаг event loop: насколько позже запланированного просыпается задача"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+
+async def run_benchmark(
+    chats: int = 10000,
+    database_url: str = None,
+    recipient_ratio: float = 0.8,
+    api_url: str = None,
+    api_rate: float = 0,
+    blocked_ratio: float = 0.02,
+    latency: float = 0.0,
+    jitter: float = 0.0,
+    concurrency: int = 50,
+    delivery_rate: float = 0,
+    seed: int = 1,
+    trace_memory: bool = False,
+) -> dict:
+    """Один прогон бенчмарка, результат - словарь метрик
+
+    trace_memory - замерить пик памяти Python-объектов во время рассылки
+    (tracemalloc, заметно замедляет прогон).
+    """
+    temp_path = None
+    if database_url is None:
+        fd, temp_path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+        database_url = f"sqlite:///{temp_path}"
+    engine = create_engine(database_url)
+
+    seed_started = time.perf_counter()
+    mailing_id = seed_database(engine, chats, recipient_ratio, seed)
+    seed_seconds = time.perf_counter() - seed_started
+
+    # Счетчик SQL-запросов во время рассылки
+    queries = {"count": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_query(*args):
+        queries["count"] += 1
+
+    database.SessionLocal.configure(bind=engine)
+    saved_settings = (delivery.DELIVERY_CONCURRENCY, delivery.DELIVERY_RATE)
+    delivery.DELIVERY_CONCURRENCY = concurrency
+    delivery.DELIVERY_RATE = delivery_rate
+
+    runner = None
+    fake = None
+    if api_url is None:
+        fake = FakeBotAPI(
+            rate=api_rate,
+            group_rate_per_minute=0,
+            blocked_ratio=blocked_ratio,
+            latency=latency,
+            jitter=jitter,
+        )
+        runner = web.AppRunner(fake.make_app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        api_url = f"http://127.0.0.1:{port}"
+
+    latencies = Reservoir(seed=seed)
+
+    def on_result(chat_id, status, enqueued_at):
+        latencies.append(time.monotonic() - enqueued_at)
+
+    lag_samples = Reservoir(seed=seed)
+    lag_task = asyncio.create_task(measure_loop_lag(lag_samples))
+    traced_peak = None
+    try:
+        async with TelegramAPI("0:benchmark", api_url=api_url) as api:
+            if trace_memory:
+                tracemalloc.start()
+            started = time.perf_counter()
+            stats = await delivery.deliver_mailing(api, mailing_id, on_result=on_result)
+            elapsed = time.perf_counter() - started
+            if trace_memory:
+                traced_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        lag_task.cancel()
+        if runner:
+            await runner.cleanup()
+        database.SessionLocal.configure(bind=database.engine)
+        delivery.DELIVERY_CONCURRENCY, delivery.DELIVERY_RATE = saved_settings
+        engine.dispose()
+        if temp_path:
+            os.remove(temp_path)
+
+    processed = stats["sent"] + stats["failed"]
+    return {
+        "chats": chats,
+        "recipients": stats["total"],
+        "sent": stats["sent"],
+        "failed": stats["failed"],
+        "seed_seconds": round(seed_seconds, 3),
+        "elapsed_seconds": round(elapsed, 3),
+        "msgs_per_sec": round(processed / elapsed, 1) if elapsed else None,
+        "latency_p50_ms": round(percentile(latencies.values, 50) * 1000, 2),
+        "latency_p99_ms": round(percentile(latencies.values, 99) * 1000, 2),
+        "db_queries": queries["count"],
+        "db_queries_per_message": (
+            round(queries["count"] / processed, 4) if processed else None
+        ),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "peak_traced_mb": (
+            round(traced_peak / 1024 / 1024, 2) if traced_peak is not None else None
+        ),
+        "loop_lag_p99_ms": round(percentile(lag_samples.values, 99) * 1000, 2),
+        "loop_lag_max_ms": round(max(lag_samples.values, default=0) * 1000, 2),
+        "api_stats": dict(fake.stats) if fake else None,
+        "concurrency": concurrency,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=10000)
+    parser.add_argument("--database-url", help="по умолчанию временный SQLite")
+    parser.add_argument("--recipient-ratio", type=float, default=0.8)
+    parser.add_argument("--api-url", help="внешний Bot API вместо встроенного")
+    parser.add_argument("--api-rate", type=float, default=0, help="0 - без лимита")
+    parser.add_argument("--blocked-ratio", type=float, default=0.02)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--delivery-rate", type=float, default=0)
+    parser.add_argument(
+        "--trace-memory", action="store_true", help="пик памяти через tracemalloc"
+    )
+    parser.add_argument("--output", help="файл для JSON с результатами")
+    args = parser.parse_args()
+
+    result = asyncio.run(
+        run_benchmark(
+            chats=args.chats,
+            database_url=args.database_url,
+            recipient_ratio=args.recipient_ratio,
+            api_url=args.api_url,
+            api_rate=args.api_rate,
+            blocked_ratio=args.blocked_ratio,
+            latency=args.latency,
+            jitter=args.jitter,
+            concurrency=args.concurrency,
+            delivery_rate=args.delivery_rate,
+            trace_memory=args.trace_memory,
+        )
+    )
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
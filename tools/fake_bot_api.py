@@ -0,0 +1,283 @@
+"""Локальная замена Telegram Bot API для нагрузочного тестирования
+
+Реализует основные методы (sendMessage, copyMessage, editMessageText,
+getUpdates, getMe и др.), ограничивает частоту запросов с ответами 429
+и retry_after, возвращает 403 "bot was blocked" для заданной доли чатов
+и добавляет задержку со случайным разбросом.
+
+Запуск: python -m tools.fake_bot_api --port 8081 --rate 30 --blocked-ratio 0.05
+Бот и TelegramAPI направляются на сервер переменной
+TELEGRAM_API_URL=http://localhost:8081
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import time
+import zlib
+from collections import Counter
+
+from aiohttp import web
+
+BLOCKED_DESCRIPTION = "Forbidden: bot was blocked by the user"
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Списать токен; 0 при успехе, иначе сколько секунд ждать"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class FakeBotAPI:
+    """Сервер-заглушка Bot API с лимитами, блокировками и задержкой"""
+
+    def __init__(
+        self,
+        rate: float = 30,
+        group_rate_per_minute: float = 20,
+        blocked_ratio: float = 0.0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        seed: int = 0,
+    ):
+        self.rate = rate
+        self.group_rate_per_minute = group_rate_per_minute
+        self.blocked_ratio = blocked_ratio
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+
+        self.global_bucket = TokenBucket(rate, rate) if rate else None
+        self.group_buckets = {}
+        # Общий счетчик: message_id уникальны и внутри каждого чата, а память
+        # не растет с числом чатов
+        self.message_ids = itertools.count(1)
+        self.file_ids = itertools.count(1)
+        self.updates = asyncio.Queue()
+        self.update_ids = itertools.count(1)
+        self.stats = Counter()
+
+        self.handlers = {
+            "getMe": self.get_me,
+            "sendMessage": self.send_message,
+            "copyMessage": self.copy_message,
+            "editMessageText": self.edit_message_text,
+            "answerCallbackQuery": self.ok_true,
+            "deleteWebhook": self.ok_true,
+            "setWebhook": self.ok_true,
+            "setMyCommands": self.ok_true,
+            "deleteMessage": self.ok_true,
+            "getUpdates": self.get_updates,
+            "sendPhoto": self.send_media,
+            "sendVideo": self.send_media,
+            "sendDocument": self.send_media,
+            "sendMediaGroup": self.send_media_group,
+        }
+
+    # Поведение сервера
+
+    def is_blocked(self, chat_id) -> bool:
+        """Детерминированно "заблокированные" чаты: одни и те же между запусками"""
+        if not self.blocked_ratio:
+            return False
+        bucket = zlib.crc32(str(chat_id).encode()) % 10000
+        return bucket < self.blocked_ratio * 10000
+
+    def throttle(self, chat_id) -> float:
+        """Проверка лимитов; 0 если запрос разрешен, иначе retry_after"""
+        if self.global_bucket:
+            wait = self.global_bucket.take()
+            if wait:
+                return wait
+        if chat_id is not None and int(chat_id) < 0 and self.group_rate_per_minute:
+            bucket = self.group_buckets.get(chat_id)
+            if bucket is None:
+                rate = self.group_rate_per_minute / 60
+                bucket = TokenBucket(rate, self.group_rate_per_minute)
+                self.group_buckets[chat_id] = bucket
+            return bucket.take()
+        return 0.0
+
+    def push_update(self, update: dict) -> None:
+        """Добавить входящее обновление для getUpdates"""
+        update.setdefault("update_id", next(self.update_ids))
+        self.updates.put_nowait(update)
+
+    def next_message_id(self, chat_id) -> int:
+        return next(self.message_ids)
+
+    def message(self, chat_id, **fields) -> dict:
+        chat_id = int(chat_id)
+        return {
+            "message_id": self.next_message_id(chat_id),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            **fields,
+        }
+
+    # Методы API
+
+    async def get_me(self, params):
+        return {
+            "id": 1,
+            "is_bot": True,
+            "first_name": "Fake Bot",
+            "username": "fake_bot",
+            "can_join_groups": True,
+            "can_read_all_group_messages": False,
+            "supports_inline_queries": False,
+        }
+
+    async def ok_true(self, params):
+        return True
+
+    async def send_message(self, params):
+        return self.message(params["chat_id"], text=params.get("text", ""))
+
+    async def copy_message(self, params):
+        return {"message_id": self.next_message_id(params["chat_id"])}
+
+    async def edit_message_text(self, params):
+        return self.message(params["chat_id"], text=params.get("text", ""))
+
+    async def send_media(self, params, media_type=None):
+        media_type = media_type or next(
+            key for key in ("photo", "video", "document") if key in params
+        )
+        file_id = f"fake-file-{next(self.file_ids)}"
+        media = {"file_id": file_id, "file_unique_id": file_id}
+        value = [media] if media_type == "photo" else media
+        return self.message(params["chat_id"], **{media_type: value})
+
+    async def send_media_group(self, params):
+        media = params["media"]
+        if isinstance(media, str):
+            media = json.loads(media)
+        return [
+            (await self.send_media(params, item["type"])) | {"media_group_id": "1"}
+            for item in media
+        ]
+
+    async def get_updates(self, params):
+        timeout = float(params.get("timeout") or 0)
+        updates = []
+        if self.updates.empty() and timeout > 0:
+            # Long polling: ждем первое обновление не дольше timeout
+            try:
+                updates.append(await asyncio.wait_for(self.updates.get(), timeout))
+            except asyncio.TimeoutError:
+                return []
+        while not self.updates.empty():
+            updates.append(self.updates.get_nowait())
+        return updates
+
+    # HTTP
+
+    async def read_params(self, request) -> dict:
+        if request.content_type == "application/json":
+            return json.loads(await request.read() or b"{}")
+        form = await request.post()
+        params = {}
+        for key, value in form.items():
+            if isinstance(value, str):
+                # Вложенные объекты в form-data передаются JSON-строкой
+                try:
+                    value = json.loads(value) if value[:1] in "[{" else value
+                except ValueError:
+                    pass
+            params[key] = value
+        return params
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        handler = self.handlers.get(method)
+        self.stats[f"requests:{method}"] += 1
+
+        if handler is None:
+            return self.error(404, "Not Found: method not found")
+
+        params = await self.read_params(request)
+        chat_id = params.get("chat_id")
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(
+                max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            )
+
+        if method != "getUpdates" and chat_id is not None:
+            if self.is_blocked(chat_id):
+                self.stats["blocked"] += 1
+                return self.error(403, BLOCKED_DESCRIPTION)
+
+            retry_after = self.throttle(chat_id)
+            if retry_after:
+                self.stats["throttled"] += 1
+                return self.error(
+                    429,
+                    f"Too Many Requests: retry after {math.ceil(retry_after)}",
+                    {"retry_after": math.ceil(retry_after)},
+                )
+
+        result = await handler(params)
+        if method != "getUpdates":
+            self.stats["ok"] += 1
+        return web.json_response({"ok": True, "result": result})
+
+    def error(self, code: int, description: str, parameters: dict = None):
+        payload = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            payload["parameters"] = parameters
+        return web.json_response(payload, status=code)
+
+    async def handle_stats(self, request):
+        return web.json_response(dict(self.stats))
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--rate", type=float, default=30, help="запросов в секунду")
+    parser.add_argument(
+        "--group-rate", type=float, default=20, help="сообщений в минуту на группу"
+    )
+    parser.add_argument("--blocked-ratio", type=float, default=0.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="секунды")
+    parser.add_argument("--jitter", type=float, default=0.0, help="секунды")
+    args = parser.parse_args()
+
+    fake = FakeBotAPI(
+        rate=args.rate,
+        group_rate_per_minute=args.group_rate,
+        blocked_ratio=args.blocked_ratio,
+        latency=args.latency,
+        jitter=args.jitter,
+    )
+    web.run_app(fake.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
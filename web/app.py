@@ -1,23 +1,82 @@
+# Первым: момент импорта - точка отсчета времени запуска
+from shared.readiness import readiness
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Query, HTTPException, Depends, Request
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional, Dict, Any, List
 import os
+import pathlib
 import hashlib
 import hmac
 import json
 import time
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from shared.database import Chat, db_session, Mailing, mailing_recipients
+from shared import metrics, tracing
+
+# ORM (SQLAlchemy и модели) импортируется в фоне после открытия порта,
+# а эндпоинты импортируют его локально - к первому запросу он уже загружен.
 
 # Загрузка переменных окружения из .env
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Каталог приложения: статика и шаблоны не зависят от текущей директории
+WEB_DIR = pathlib.Path(__file__).parent
+
+# Пауза между попытками подготовки, пока БД недоступна (секунды)
+WARM_UP_RETRY = 1.0
+
+
+def check_database() -> None:
+    """Импорт ORM и проверка БД одним запросом версии схемы
+
+    Схему создает и обновляет бот; веб-сервер только сверяет версию.
+    """
+    from shared.database import SCHEMA_VERSION, stored_schema_version
+
+    version = stored_schema_version()
+    if version is None:
+        raise RuntimeError("схема БД еще не создана")
+    if version != SCHEMA_VERSION:
+        logger.warning(f"Версия схемы БД {version}, код рассчитан на {SCHEMA_VERSION}")
+
+
+async def warm_up() -> None:
+    """Подготовка к работе; /ready отвечает 200 после ее завершения"""
+    while True:
+        try:
+            await asyncio.to_thread(check_database)
+        except Exception as e:
+            readiness.error = str(e)
+            await asyncio.sleep(WARM_UP_RETRY)
+            continue
+        time_to_ready = readiness.mark_ready()
+        logger.info(f"Веб-сервер готов к работе за {time_to_ready:.2f} с")
+        return
+
+
+@asynccontextmanager
+async def lifespan(app):
+    tracing.configure(os.environ.get("TRACE_FILE"))
+    tasks = [
+        asyncio.create_task(warm_up()),
+        asyncio.create_task(metrics.watch_event_loop()),
+    ]
+    yield
+    for task in tasks:
+        task.cancel()
+    tracing.configure(None)
+
+
 # Создаем экземпляр FastAPI
-app = FastAPI(title="Telegram Broadcast Bot API")
+app = FastAPI(title="Telegram Broadcast Bot API", lifespan=lifespan)
 
 # Настраиваем CORS
 app.add_middleware(
@@ -29,10 +88,10 @@ app.add_middleware(
 )
 
 # Подключаем статические файлы
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", StaticFiles(directory=WEB_DIR / "static"), name="static")
 
 # Настраиваем шаблоны
-templates = Jinja2Templates(directory="templates")
+templates = Jinja2Templates(directory=WEB_DIR / "templates")
 
 # Список ID администраторов
 ADMIN_IDS = [int(id) for id in os.environ.get("ADMIN_IDS", "").split(",") if id]
@@ -44,13 +103,43 @@ BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 # Модели данных Pydantic
 class ChatsResponse(BaseModel):
     active_chats: List[Dict[str, Any]]
-    unavailable_count: int
+    # Счетчики - только в первой странице
+    active_count: Optional[int] = None
+    unavailable_count: Optional[int] = None
+    # chat_id для запроса следующей страницы (after); None - страниц больше нет
+    next_after: Optional[int] = None
 
 
 class RecipientsResponse(BaseModel):
     recipients: List[int]
 
 
+class SegmentRequest(BaseModel):
+    """Новый сегмент: выбранные чаты, тип чатов или операция над сегментами"""
+
+    name: str
+    chats: Optional[List[int]] = None
+    chat_type: Optional[str] = None  # 'private' или 'groups'
+    op: Optional[str] = None  # 'union', 'intersection', 'difference'
+    of: Optional[List[int]] = None
+
+
+class SegmentInfo(BaseModel):
+    segment_id: int
+    name: str
+    definition: Dict[str, Any]
+    users: int
+    groups: int
+
+
+class SegmentsResponse(BaseModel):
+    segments: List[SegmentInfo]
+
+
+class MailingSegmentRequest(BaseModel):
+    segment_id: Optional[int] = None
+
+
 class ErrorResponse(BaseModel):
     error: str
 
@@ -117,6 +206,24 @@ async def verify_admin(initData: str = Query(...)):
 
 
 # Маршруты
+@app.get("/healthz")
+async def health():
+    """Процесс жив"""
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    """Готовность к работе и время запуска; 503, пока подготовка не завершена"""
+    return JSONResponse(readiness.status(), status_code=200 if readiness.ready else 503)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Метрики в формате Prometheus"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     """Главная страница"""
@@ -134,62 +241,180 @@ async def mini_app(request: Request, mailing_id: int = Query(...)):
     )
 
 
+# Размер страницы /api/chats по умолчанию и наибольший допустимый
+CHATS_PAGE_SIZE = 500
+CHATS_PAGE_LIMIT = 1000
+
+
 @app.get("/api/chats", response_model=ChatsResponse)
 async def get_chats(
-    user_id: int = Depends(verify_admin), show_only_active: bool = Query(True)
+    user_id: int = Depends(verify_admin),
+    show_only_active: bool = Query(True),
+    after: Optional[int] = Query(None),
+    limit: int = Query(CHATS_PAGE_SIZE, ge=1, le=CHATS_PAGE_LIMIT),
 ):
-    """API-эндпоинт для получения списка чатов"""
+    """API-эндпоинт для получения списка чатов
+
+    Возвращает страницу из не более limit чатов по возрастанию chat_id после
+    after и next_after для следующей страницы (None - страница последняя).
+    Счетчики чатов считаются только для первой страницы (без after).
+    """
+    from sqlalchemy import func, select
+    from shared.database import Chat, db_session
+
+    query = select(Chat.chat_id, Chat.title, Chat.type, Chat.status)
+    if show_only_active:
+        query = query.where(Chat.status == "active")
+    if after is not None:
+        query = query.where(Chat.chat_id > after)
+    query = query.order_by(Chat.chat_id).limit(limit)
+
+    active_count = unavailable_count = None
     with db_session() as session:
-        if show_only_active:
-            # Получаем только активные чаты
-            chats = session.query(Chat).filter_by(status="active").all()
-            # Подсчитываем количество недоступных чатов
-            unavailable_count = (
-                session.query(Chat).filter(Chat.status != "active").count()
-            )
-        else:
-            # Получаем все чаты
-            chats = session.query(Chat).all()
-            unavailable_count = 0
-
-        # Формируем список чатов
-        chat_list = []
-        for chat in chats:
-            chat_list.append(
-                {
-                    "chat_id": chat.chat_id,
-                    "title": chat.title or str(chat.chat_id),
-                    "type": chat.type,
-                    "status": chat.status,
-                }
-            )
-
-    return ChatsResponse(active_chats=chat_list, unavailable_count=unavailable_count)
+        if after is None:
+            active_count, unavailable_count = session.execute(
+                select(
+                    func.count().filter(Chat.status == "active"),
+                    func.count().filter(Chat.status != "active"),
+                )
+            ).one()
+            if not show_only_active:
+                unavailable_count = 0
+
+        # Строки без создания ORM-объектов
+        chat_list = [
+            {
+                "chat_id": chat_id,
+                "title": title or str(chat_id),
+                "type": chat_type,
+                "status": status,
+            }
+            for chat_id, title, chat_type, status in session.execute(query)
+        ]
+
+    next_after = chat_list[-1]["chat_id"] if len(chat_list) == limit else None
+    return ChatsResponse(
+        active_chats=chat_list,
+        active_count=active_count,
+        unavailable_count=unavailable_count,
+        next_after=next_after,
+    )
 
 
 @app.get("/api/mailing/{mailing_id}/recipients", response_model=RecipientsResponse)
 async def get_mailing_recipients(mailing_id: int, user_id: int = Depends(verify_admin)):
     """API-эндпоинт для получения получателей рассылки"""
-    with db_session() as session:
-        from sqlalchemy.orm import joinedload
-
-        # Получаем рассылку с получателями
-        mailing = (
-            session.query(Mailing)
-            .options(joinedload(Mailing.recipients))
-            .filter_by(mailing_id=mailing_id)
-            .first()
-        )
+    from sqlalchemy import select
+    from shared.database import Mailing, db_session, mailing_recipients
 
-        if not mailing:
+    with db_session() as session:
+        if session.get(Mailing, mailing_id) is None:
             raise HTTPException(status_code=404, detail="Рассылка не найдена")
 
-        # Формируем список получателей
-        recipients = [chat.chat_id for chat in mailing.recipients]
+        # Только идентификаторы получателей, без загрузки чатов
+        recipients = list(
+            session.execute(
+                select(mailing_recipients.c.chat_id).where(
+                    mailing_recipients.c.mailing_id == mailing_id
+                )
+            ).scalars()
+        )
 
     return RecipientsResponse(recipients=recipients)
 
 
+def segment_info(segment) -> SegmentInfo:
+    return SegmentInfo(
+        segment_id=segment.segment_id,
+        name=segment.name,
+        definition=json.loads(segment.definition),
+        users=segment.users,
+        groups=segment.groups,
+    )
+
+
+@app.get("/api/segments", response_model=SegmentsResponse)
+async def list_segments(user_id: int = Depends(verify_admin)):
+    """Сохраненные сегменты с числом получателей (без самих составов)"""
+    from sqlalchemy import select
+    from shared.database import Segment, db_session
+
+    with db_session() as session:
+        segments = [
+            segment_info(segment)
+            for segment in session.scalars(select(Segment).order_by(Segment.name))
+        ]
+    return SegmentsResponse(segments=segments)
+
+
+@app.post("/api/segments", response_model=SegmentInfo)
+async def create_segment_endpoint(
+    request: SegmentRequest, user_id: int = Depends(verify_admin)
+):
+    """Создание сегмента; состав вычисляется сразу"""
+    from shared.database import db_session
+    from shared.segments import SegmentError, create_segment
+
+    if request.op:
+        definition = {"op": request.op, "of": request.of or []}
+    elif request.chat_type:
+        definition = {"type": request.chat_type}
+    else:
+        definition = {}
+
+    try:
+        with db_session() as session:
+            segment = create_segment(
+                session, request.name, definition, request.chats, created_by=user_id
+            )
+            return segment_info(segment)
+    except SegmentError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.delete("/api/segments/{segment_id}")
+async def delete_segment_endpoint(
+    segment_id: int, user_id: int = Depends(verify_admin)
+):
+    """Удаление сегмента, если на него не ссылаются рассылки и другие сегменты"""
+    from shared.database import db_session
+    from shared.segments import SegmentError, delete_segment
+
+    try:
+        with db_session() as session:
+            delete_segment(session, segment_id)
+    except SegmentError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "ok"}
+
+
+@app.put("/api/mailing/{mailing_id}/segment")
+async def set_mailing_segment(
+    mailing_id: int,
+    request: MailingSegmentRequest,
+    user_id: int = Depends(verify_admin),
+):
+    """Рассылка по сегменту вместо списка получателей (segment_id=null - отменить)"""
+    from sqlalchemy import delete
+    from shared.database import Mailing, Segment, db_session, mailing_recipients
+
+    with db_session() as session:
+        mailing = session.get(Mailing, mailing_id)
+        if mailing is None:
+            raise HTTPException(status_code=404, detail="Рассылка не найдена")
+        if request.segment_id is not None:
+            if session.get(Segment, request.segment_id) is None:
+                raise HTTPException(status_code=404, detail="Сегмент не найден")
+            # Связи больше не нужны: аудитория берется из состава сегмента
+            session.execute(
+                delete(mailing_recipients).where(
+                    mailing_recipients.c.mailing_id == mailing_id
+                )
+            )
+        mailing.segment_id = request.segment_id
+    return {"status": "ok"}
+
+
 # Запуск приложения
 if __name__ == "__main__":
     import uvicorn